@@ -0,0 +1,21 @@
+"""
+ASGI config for OMDB_API_bridge project (async deployment mode).
+
+Movie lookups (POST /api/movies) run on the event loop with a non-blocking
+OMDb client; all other routes are served by the regular WSGI application on
+a thread pool. Run f.e. with:
+
+    gunicorn OMDB_API_bridge.asgi:application -k uvicorn.workers.UvicornWorker
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "OMDB_API_bridge.settings")
+
+django_application = get_wsgi_application()
+
+from movie_api.asgi import MovieApiAsgi  # noqa: E402 (needs configured Django)
+
+application = MovieApiAsgi(django_application)
@@ -0,0 +1,142 @@
+"""Read replicas: GET requests read from DATABASE_REPLICAS, everything else uses default.
+
+ReplicaRoutingMiddleware marks requests with safe methods as read-only;
+ReplicaRouter sends their reads to the replicas in turn, skipping replicas
+that failed a health check for REPLICA_RETRY_INTERVAL seconds (default
+when none is left). Writes always go to default, and a client that wrote
+is pinned to default for REPLICA_PIN_SECONDS (by cookie), so it reads its
+own writes despite replication lag. Code outside requests (management
+commands, background threads) always uses default.
+"""
+import contextvars
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+
+PIN_COOKIE = "db_pinned"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class RoutingState:
+
+    def __init__(self, read_only):
+        self.read_only = read_only
+        self.wrote = False
+
+
+_state = contextvars.ContextVar("db_routing", default=None)
+_turns = itertools.count()
+_down_until = {}
+_checked_at = {}
+_lock = threading.Lock()
+
+
+def healthy(alias):
+    """Whether the replica alias answers; checked at most every DATABASE_HEALTH_CHECK_INTERVAL seconds."""
+    now = time.monotonic()
+    with _lock:
+        if _down_until.get(alias, 0) > now:
+            return False
+        if now - _checked_at.get(alias, float("-inf")) < settings.DATABASE_HEALTH_CHECK_INTERVAL:
+            return True
+        _checked_at[alias] = now
+    connection = connections[alias]
+    try:
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except DatabaseError:
+        connection.close()
+        with _lock:
+            _down_until[alias] = now + settings.REPLICA_RETRY_INTERVAL
+        return False
+    return True
+
+
+def replica_status():
+    """{alias: True if in use} of the configured replicas."""
+    now = time.monotonic()
+    return {alias: _down_until.get(alias, 0) <= now for alias in settings.DATABASE_REPLICAS}
+
+
+def check_connections():
+    """Close persistent connections of this thread that stopped working (f.e. after a
+    database restart), at most every DATABASE_HEALTH_CHECK_INTERVAL seconds each."""
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        if now - getattr(connection, "health_checked_at", 0) < settings.DATABASE_HEALTH_CHECK_INTERVAL:
+            continue
+        connection.health_checked_at = now
+        if not connection.is_usable():
+            connection.close()
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = settings.DATABASE_REPLICAS
+        if state is None or not state.read_only or state.wrote or not replicas:
+            return "default"
+        for _ in range(len(replicas)):
+            alias = replicas[next(_turns) % len(replicas)]
+            if healthy(alias):
+                return alias
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as default.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication.
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaRoutingMiddleware:
+    """Lets ReplicaRouter send reads of safe requests of unpinned clients to replicas,
+    and pins clients that wrote to default."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        check_connections()
+        state = RoutingState(request.method in SAFE_METHODS and PIN_COOKIE not in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if response.streaming:
+            # Streamed listings query while the body is read, after this returned.
+            response.streaming_content = _routed(response.streaming_content, state)
+        if settings.DATABASE_REPLICAS and (state.wrote or request.method not in SAFE_METHODS):
+            response.set_cookie(PIN_COOKIE, "1", max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        return response
+
+
+def _routed(content, state):
+    """Iterate content with the routing state of its request."""
+    chunks = iter(content)
+    while True:
+        token = _state.set(state)
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            _state.reset(token)
+        yield chunk
@@ -46,6 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'movie_api.metrics.MetricsMiddleware',
+    'movie_api.compression.CompressionMiddleware',
+    'OMDB_API_bridge.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -131,9 +134,178 @@ STATICFILES_DIRS = (
     os.path.join(BASE_DIR, 'static'),
 )
 
+
+# Pagination of GET /api/movies and GET /api/comments
+
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+API_MAX_PAGE_SIZE = 500
+
+# Write-behind mode of POST /api/comments: comments are queued (up to
+# COMMENT_BUFFER_SIZE, a request waits COMMENT_BUFFER_TIMEOUT seconds for room,
+# then gets 503) and written in batches of up to COMMENT_FLUSH_SIZE at most
+# COMMENT_FLUSH_INTERVAL seconds apart. Also the chunk size of POST /api/comments/batch.
+
+COMMENT_WRITE_BEHIND = os.environ.get('COMMENT_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes', 'on')
+COMMENT_BUFFER_SIZE = 10000
+COMMENT_BUFFER_TIMEOUT = 1
+COMMENT_FLUSH_SIZE = 500
+COMMENT_FLUSH_INTERVAL = 0.005
+COMMENT_WRITE_TIMEOUT = 10
+COMMENT_BATCH_MAX = 5000
+
+# Request metrics, served in Prometheus format on /metrics (per worker
+# process). With METRICS_SERVER_TIMING responses also carry a Server-Timing
+# header (time in SQL, OMDb calls and serializers).
+
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '').lower() in ('1', 'true', 'yes', 'on')
+
+# Change feed (GET /api/changes): longest long-poll a client can ask for with
+# ?wait= and how often waiting requests look for changes of other workers (seconds).
+
+CHANGE_FEED_MAX_WAIT = 30
+CHANGE_FEED_POLL_INTERVAL = 1
+# prune_changes drops changes older than this that consumers don't need (see changes.prune_changes).
+CHANGE_FEED_RETENTION_DAYS = int(os.environ.get('CHANGE_FEED_RETENTION_DAYS', 30))
+# Rows fetched and serialized at a time by streamed listings (stream=1 or Accept: application/x-ndjson)
+STREAM_CHUNK_SIZE = 500
+
+# OMDb client
+
+OMDB_API_KEY = os.environ.get('OMDB_API_KEY', '28cb1743')
+OMDB_API_URL = os.environ.get('OMDB_API_URL', 'http://www.omdbapi.com/')
+OMDB_CONNECT_TIMEOUT = 3.05
+OMDB_READ_TIMEOUT = float(os.environ.get('OMDB_READ_TIMEOUT', 5))
+OMDB_MAX_RETRIES = int(os.environ.get('OMDB_MAX_RETRIES', 2))
+OMDB_RETRY_BACKOFF = 0.2
+# Connections kept alive per worker process; match it to the threads a worker runs.
+OMDB_POOL_SIZE = int(os.environ.get('OMDB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 10)))
+
+# Pool of OMDb API keys (comma-separated OMDB_API_KEYS, OMDB_API_KEY if unset).
+# Calls go to the least used key; every key is held to OMDB_KEY_RATE calls per
+# second and OMDB_KEY_DAILY_LIMIT calls per day (counted in the database, for
+# all workers). Keys OMDb rejects are skipped for OMDB_KEY_QUARANTINE seconds.
+# Lookups fail with 503 once no key is left, or no token frees up within
+# OMDB_KEY_MAX_WAIT seconds.
+
+OMDB_API_KEYS = [key.strip() for key in os.environ.get('OMDB_API_KEYS', OMDB_API_KEY).split(',') if key.strip()]
+OMDB_KEY_RATE = float(os.environ.get('OMDB_KEY_RATE', 10))
+OMDB_KEY_DAILY_LIMIT = int(os.environ.get('OMDB_KEY_DAILY_LIMIT', 1000))
+OMDB_KEY_QUARANTINE = int(os.environ.get('OMDB_KEY_QUARANTINE', 3600))
+OMDB_KEY_RESERVE_BLOCK = 10  # calls a worker reserves per database round trip
+OMDB_KEY_MAX_WAIT = 1.0
+
+# Circuit breaker of OMDb calls (see movie_api/breaker.py): opens when at
+# least OMDB_BREAKER_MIN_CALLS calls were made in the last OMDB_BREAKER_WINDOW
+# seconds and OMDB_BREAKER_FAILURE_RATE of them failed, or
+# OMDB_BREAKER_SLOW_CALL_RATE of them took OMDB_BREAKER_SLOW_CALL_SECONDS or
+# more. Lookups of titles not stored then get 503 for OMDB_BREAKER_OPEN_SECONDS,
+# after which one probe call decides. Its state is kept in the
+# OMDB_BREAKER_CACHE_ALIAS cache, shared by workers when that cache is.
+
+OMDB_BREAKER = os.environ.get('OMDB_BREAKER', '1').lower() in ('1', 'true', 'yes', 'on')
+OMDB_BREAKER_CACHE_ALIAS = 'default'
+OMDB_BREAKER_WINDOW = 60
+OMDB_BREAKER_MIN_CALLS = int(os.environ.get('OMDB_BREAKER_MIN_CALLS', 10))
+OMDB_BREAKER_FAILURE_RATE = float(os.environ.get('OMDB_BREAKER_FAILURE_RATE', 0.5))
+OMDB_BREAKER_SLOW_CALL_SECONDS = float(os.environ.get('OMDB_BREAKER_SLOW_CALL_SECONDS', 2.5))
+OMDB_BREAKER_SLOW_CALL_RATE = float(os.environ.get('OMDB_BREAKER_SLOW_CALL_RATE', 0.5))
+OMDB_BREAKER_OPEN_SECONDS = int(os.environ.get('OMDB_BREAKER_OPEN_SECONDS', 30))
+OMDB_BREAKER_PROBE_TIMEOUT = OMDB_CONNECT_TIMEOUT + OMDB_READ_TIMEOUT
+
+# Async deployment mode (OMDB_API_bridge/asgi.py): upstream connections of
+# the asyncio client, threads for ORM calls of async lookups and threads
+# serving all other (sync) routes.
+
+OMDB_ASYNC_POOL_SIZE = int(os.environ.get('OMDB_ASYNC_POOL_SIZE', 200))
+ASGI_DB_THREADS = int(os.environ.get('ASGI_DB_THREADS', 10))
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 20))
+
+# Batch import (POST /api/movies/batch)
+
+OMDB_BATCH_WORKERS = int(os.environ.get('OMDB_BATCH_WORKERS', 8))
+MOVIE_BATCH_MAX_TITLES = 5000
+MOVIE_BULK_CHUNK_SIZE = 500
+
+# Background refresh of stored movies (manage.py refresh_movies)
+
+MOVIE_REFRESH_MAX_AGE_DAYS = int(os.environ.get('MOVIE_REFRESH_MAX_AGE_DAYS', 7))
+MOVIE_REFRESH_DAILY_QUOTA = int(os.environ.get('MOVIE_REFRESH_DAILY_QUOTA', 500))
+MOVIE_REFRESH_RATE = float(os.environ.get('MOVIE_REFRESH_RATE', 5))  # OMDb calls per second
+MOVIE_REFRESH_WORKERS = 4
+MOVIE_REFRESH_BATCH_SIZE = 100
+
+# Local cache of resolved movie titles (in front of OMDb)
+
+TITLE_CACHE_SIZE = int(os.environ.get('TITLE_CACHE_SIZE', 1024))
+TITLE_CACHE_NEGATIVE_TTL = int(os.environ.get('TITLE_CACHE_NEGATIVE_TTL', 3600))
+
+# Titles not stored exactly are matched against stored ones by trigram
+# similarity (0..1, FUZZY_TITLE_THRESHOLD) before asking OMDb. Every worker
+# keeps an in-memory index of stored titles, updated from the change feed at
+# most every FUZZY_INDEX_SYNC_INTERVAL seconds.
+
+# Off by default: a similar title may well be another film ("Aliens").
+FUZZY_TITLE_MATCHING = os.environ.get('FUZZY_TITLE_MATCHING', '0').lower() in ('1', 'true', 'yes', 'on')
+FUZZY_TITLE_THRESHOLD = float(os.environ.get('FUZZY_TITLE_THRESHOLD', 0.8))
+FUZZY_INDEX_SYNC_INTERVAL = 1
+
+# Full movie listings join the JSON stored with every movie (Movie.payload)
+# instead of serializing rows. Payloads are kept current either way; after
+# upgrading, fill them in with `manage.py rebuild_movie_payloads`.
+
+MOVIE_PAYLOADS = os.environ.get('MOVIE_PAYLOADS', '1').lower() in ('1', 'true', 'yes', 'on')
+
+# Coalescing of concurrent lookups of the same title (seconds)
+
+OMDB_LOOKUP_LEASE_TIMEOUT = 30
+OMDB_LOOKUP_RESULT_TTL = 5
+OMDB_LOOKUP_POLL_INTERVAL = 0.05
+
+# Response cache of GET /api/movies and /api/comments. Entries are keyed by
+# table versions, so the timeout only bounds memory; point CACHE_BACKEND at a
+# shared backend (memcached, redis) to share entries between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'omdb-api-bridge'),
+    }
+}
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 3600))
+
+# Response compression (gzip, or brotli when the brotli package is installed):
+# smallest body worth compressing (bytes) and brotli quality (0-11).
+
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_BROTLI_QUALITY = 5
+
 import django_heroku
 django_heroku.settings(locals(), test_runner=False)
 
+# Persistent database connections (seconds a connection is kept; 0: one per
+# request), checked at the start of a request at most every
+# DATABASE_HEALTH_CHECK_INTERVAL seconds. Read replicas are given as
+# comma-separated database URLs in DATABASE_REPLICA_URLS (f.e.
+# sqlite:////tmp/replica.sqlite3 locally); GET requests read from them in
+# turn, see OMDB_API_bridge/db_router.py. A replica that fails a health check
+# is skipped for REPLICA_RETRY_INTERVAL seconds; a client that wrote reads
+# from default for REPLICA_PIN_SECONDS.
+
+import dj_database_url
+
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 600))
+DATABASE_HEALTH_CHECK_INTERVAL = 10
+DATABASE_REPLICAS = []
+for number, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), 1):
+    DATABASES[f'replica_{number}'] = dict(dj_database_url.parse(url.strip()), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica_{number}')
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = DATABASE_CONN_MAX_AGE
+DATABASE_ROUTERS = ['OMDB_API_bridge.db_router.ReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+REPLICA_RETRY_INTERVAL = 10
+
 import psycopg2
 #
 # DATABASE_URL = os.environ['DATABASE_URL']
@@ -1,10 +1,12 @@
 from django.contrib import admin
 from django.urls import path
 from django.conf.urls import include
+from movie_api.metrics import metrics_view
 from movie_api.views import welcomehome
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include("movie_api.urls")),
+    path('metrics', metrics_view, name="metrics"),
     path("", welcomehome, name="welcome" )
 ]
@@ -0,0 +1,145 @@
+"""Throughput of POST /api/movies against a slow OMDb: sync worker vs. async (ASGI) mode.
+
+A local fake OMDb answers every lookup after --latency seconds. The same
+burst of lookups for distinct titles is sent to
+
+* "sync": the WSGI application on --threads threads, like one gunicorn
+  worker with that many threads (the Procfile setup),
+* "async": OMDB_API_bridge/asgi.py, one process with the same thread counts,
+
+while another client keeps reading GET /api/comments. Requests are made
+in-process through the ASGI interface, so no HTTP server is needed. The fake
+OMDb doesn't know the titles, so every lookup is a full upstream round-trip
+but writes nothing: the scratch SQLite database takes one writer at a time
+and would measure lock waits instead of upstream waits.
+
+    python benchmarks/async_lookups.py --requests 400 --concurrency 200 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from common import percentiles, seed_movies, setup_django, synthetic_movie
+
+
+def build_apps(threads):
+    from django.conf import settings
+    from django.core.wsgi import get_wsgi_application
+    from movie_api.asgi import MovieApiAsgi, WsgiBridge, read_body
+
+    settings.ASGI_WSGI_THREADS = settings.ASGI_DB_THREADS = threads
+    wsgi = get_wsgi_application()
+    bridge = WsgiBridge(wsgi, threads)
+
+    async def sync_app(scope, receive, send):
+        await bridge(scope, await read_body(receive), send)
+
+    return {"sync": sync_app, "async": MovieApiAsgi(wsgi, threads)}
+
+
+async def call(app, method, path, body=b""):
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"", "http_version": "1.1",
+             "scheme": "http", "server": ("localhost", 80), "client": ("127.0.0.1", 1),
+             "headers": [(b"host", b"localhost"), (b"content-type", b"application/json"),
+                         (b"accept", b"application/json")]}
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+async def load(app, titles, concurrency):
+    queue = list(titles)
+    lookups, reads, statuses = [], [], {}
+    done = asyncio.Event()
+
+    async def client():
+        while queue:
+            body = json.dumps({"title": queue.pop()}).encode("utf-8")
+            started = time.perf_counter()
+            status = await call(app, "POST", "/api/movies", body)
+            lookups.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    async def reader():
+        while not done.is_set():
+            started = time.perf_counter()
+            await call(app, "GET", "/api/comments")
+            reads.append(time.perf_counter() - started)
+            await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    reading = asyncio.ensure_future(reader())
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    done.set()
+    await reading
+    return elapsed, lookups, reads, statuses
+
+
+def run(requests, concurrency, latency, threads, database):
+    setup_django(database)
+    from django.test.utils import override_settings
+    from movie_api.async_omdb import close_async_client
+    from movie_api.fake_omdb import FakeOmdbServer
+
+    seed_movies(0, 100, comments_per_movie=1)
+    modes = ("sync", "async")
+    titles = [synthetic_movie(number)["Title"] for number in range(100, 100 + requests * len(modes))]
+    results = []
+    with FakeOmdbServer(latency=latency) as omdb, override_settings(OMDB_API_URL=omdb.url):
+        apps = build_apps(threads)
+        loop = asyncio.get_event_loop()
+        for index, mode in enumerate(modes):
+            batch = titles[index * requests:(index + 1) * requests]
+            elapsed, lookups, reads, statuses = loop.run_until_complete(load(apps[mode], batch, concurrency))
+            lookup_stats, read_stats = percentiles(lookups), percentiles(reads)
+            results.append({
+                "mode": mode, "requests": requests, "concurrency": concurrency, "threads": threads,
+                "upstream_latency_s": latency, "elapsed_s": round(elapsed, 3),
+                "throughput_rps": round(requests / elapsed, 1), "statuses": statuses,
+                "lookup_ms": {key: round(value * 1000, 1) for key, value in lookup_stats.items()},
+                "comments_read_ms": {key: round(value * 1000, 1) for key, value in read_stats.items()},
+            })
+            print(f"{mode:>5}: {requests / elapsed:8.1f} lookups/s  lookup p50 {lookup_stats['p50'] * 1000:8.1f} ms  "
+                  f"p95 {lookup_stats['p95'] * 1000:8.1f} ms  GET /api/comments p95 {read_stats['p95'] * 1000:8.1f} ms")
+        loop.run_until_complete(close_async_client())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400, help="lookups per mode, each for a different title")
+    parser.add_argument("--concurrency", type=int, default=200, help="clients sending lookups at the same time")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the fake OMDb takes to answer")
+    parser.add_argument("--threads", type=int, default=10, help="threads of the worker (and DB threads in async mode)")
+    parser.add_argument("--database", help="SQLite file to use (default: temporary file)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    database = args.database
+    if not database:
+        handle, database = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+    try:
+        results = run(args.requests, args.concurrency, args.latency, args.threads, database)
+    finally:
+        if not args.database and os.path.exists(database):
+            os.remove(database)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
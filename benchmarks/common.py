@@ -0,0 +1,93 @@
+"""Shared helpers of the benchmark scripts: Django setup on a scratch database and synthetic data."""
+import os
+import random
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GENRES = ["Action", "Adventure", "Comedy", "Crime", "Drama", "Fantasy", "Horror", "Sci-Fi", "Thriller", "Western"]
+WORDS = ["night", "dark", "return", "last", "city", "star", "lost", "king", "storm", "shadow", "iron", "blue",
+         "dragon", "river", "ghost", "silent", "red", "empire", "code", "planet", "heart", "fire", "glass", "wolf"]
+
+
+def setup_django(database):
+    """Configure Django to use a scratch SQLite file (instead of db.sqlite3) and migrate it."""
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "OMDB_API_bridge.settings")
+    from django.conf import settings
+    # SQLite's busy handler sleeps coarsely; concurrent writers need a long timeout.
+    settings.DATABASES["default"] = {"ENGINE": "django.db.backends.sqlite3", "NAME": database,
+                                     "OPTIONS": {"timeout": 60}}
+    settings.ALLOWED_HOSTS = ["*"]
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command("migrate", verbosity=0)
+
+
+def synthetic_movie(number):
+    """OMDb-shaped payload of a made-up movie; the same number always gives the same movie."""
+    rnd = random.Random(number)
+    title = " ".join(rnd.sample(WORDS, rnd.randint(1, 3))).title() + f" {number}"
+    year = rnd.randint(1930, 2020)
+    rating = round(rnd.uniform(1, 9.5), 1)
+    metascore = rnd.randint(10, 99)
+    return {
+        "Title": title, "Year": str(year), "Rated": rnd.choice(["G", "PG", "PG-13", "R"]),
+        "Released": f"{rnd.randint(1, 28):02d} Jun {year}", "Runtime": f"{rnd.randint(80, 180)} min",
+        "Genre": ", ".join(rnd.sample(GENRES, 2)), "Director": f"Director {rnd.randint(1, 5000)}",
+        "Writer": f"Writer {rnd.randint(1, 9000)}", "Actors": ", ".join(f"Actor {rnd.randint(1, 50000)}" for _ in range(4)),
+        "Plot": " ".join(rnd.choice(WORDS) for _ in range(25)).capitalize() + ".",
+        "Language": "English", "Country": "USA", "Awards": "N/A", "Poster": "N/A",
+        "Ratings": [{"Source": "Internet Movie Database", "Value": f"{rating}/10"},
+                    {"Source": "Metacritic", "Value": f"{metascore}/100"}],
+        "Metascore": str(metascore), "imdbRating": str(rating), "imdbVotes": f"{rnd.randint(100, 2000000):,}",
+        "imdbID": f"tt{number:08d}", "Type": "movie", "DVD": "N/A",
+        "BoxOffice": f"${rnd.randint(10000, 900000000):,}" if rnd.random() < 0.7 else "N/A",
+        "Production": "N/A", "Website": "N/A", "Response": "True",
+    }
+
+
+def seed_movies(start, stop, comments_per_movie=0, batch_size=5000):
+    """Insert synthetic movies number start..stop-1 with their ratings (and comments)."""
+    from django.db import transaction
+    from movie_api.models import Movie, Rating, Comment
+
+    for batch_start in range(start, stop, batch_size):
+        numbers = range(batch_start, min(batch_start + batch_size, stop))
+        payloads = [synthetic_movie(number) for number in numbers]
+        with transaction.atomic():
+            movies = []
+            for payload in payloads:
+                movie = Movie(**{field: value for field, value in payload.items() if field not in ("Ratings", "Response")})
+                movie.fill_derived_fields()
+                movies.append(movie)
+            Movie.objects.bulk_create(movies)
+            ids = dict(Movie.objects.filter(imdbID__in=[movie.imdbID for movie in movies]).values_list("imdbID", "id"))
+            Rating.objects.bulk_create([Rating(Movie_id=ids[payload["imdbID"]], **rating)
+                                        for payload in payloads for rating in payload["Ratings"]])
+            Comment.objects.bulk_create([Comment(movie_id_id=ids[payload["imdbID"]], comment_body=f"Comment {number}")
+                                         for payload in payloads for number in range(comments_per_movie)])
+
+
+def percentiles(samples):
+    """p50/p95/p99 and mean of samples (in the unit they were taken)."""
+    ordered = sorted(samples)
+
+    def pick(share):
+        return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "mean": statistics.mean(ordered)}
+
+
+def timed(fn, repeat):
+    """Run fn repeat times; return the per-call durations in microseconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - started) * 1e6)
+    return durations
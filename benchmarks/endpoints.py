@@ -0,0 +1,267 @@
+"""Latency, throughput, queries and memory of the API endpoints at growing catalogue sizes.
+
+For every catalogue size the scratch SQLite database is seeded with
+synthetic movies (with ratings and comments), the app is served over HTTP
+on localhost (threaded wsgiref server, OMDb replaced by a local fake with
+--latency and --error-rate) and every endpoint is driven by --concurrency
+clients:
+
+* GET /api/movies (first pages of filtered listings),
+* GET /api/comments?movie_id=...,
+* POST /api/movies, half for stored titles and half for titles only the
+  fake OMDb knows (upstream lookup and insert),
+* POST /api/comments.
+
+Results (p50/p95/p99 latency, throughput, SQL queries per request and peak
+RSS of the process, which serves and drives the load) are printed and can be
+written as JSON with --output. With --baseline, they are compared with an
+earlier --output file and the script exits with status 1 when p95 latency
+or throughput got worse by more than --tolerance.
+
+    python benchmarks/endpoints.py --sizes 1000 100000 1000000 --concurrency 1 8 32 --output results.json
+    python benchmarks/endpoints.py --sizes 1000 --baseline results.json
+
+Seeding a million movies takes a while; pass --database to keep the
+scratch database between runs (movies already in it are not seeded again).
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import requests
+
+from common import percentiles, seed_movies, setup_django, synthetic_movie
+
+
+ENDPOINTS = ("GET /api/movies", "GET /api/comments", "POST /api/movies", "POST /api/comments")
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QueryCounter:
+    """WSGI middleware counting the SQL queries of every request."""
+
+    def __init__(self, application):
+        self.application = application
+        self.counts = []
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        from django.db import connection
+        count = [0]
+
+        def counter(execute, sql, params, many, context):
+            count[0] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(counter):
+            result = self.application(environ, start_response)
+            try:
+                body = b"".join(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        with self.lock:
+            self.counts.append(count[0])
+        return [body]
+
+
+def request_factory(endpoint, size, omdb):
+    """Function making the next request of endpoint (a requests.Session call) for a catalogue of size movies."""
+    rnd = random.Random(endpoint)
+    new_numbers = itertools.count(10 ** 8 + size)
+
+    if endpoint == "GET /api/movies":
+        def make(session, url):
+            params = {"year_min": rnd.randint(1930, 2020), "sort": rnd.choice(["id", "rating", "votes"])}
+            return session.get(url + "api/movies", params=params)
+    elif endpoint == "GET /api/comments":
+        def make(session, url):
+            return session.get(url + "api/comments", params={"movie_id": rnd.randint(1, size)})
+    elif endpoint == "POST /api/movies":
+        def make(session, url):
+            if rnd.random() < 0.5:
+                title = synthetic_movie(rnd.randrange(size))["Title"]
+            else:
+                movie = synthetic_movie(next(new_numbers))
+                omdb.add(movie)
+                title = movie["Title"]
+            return session.post(url + "api/movies", json={"title": title})
+    else:
+        def make(session, url):
+            return session.post(url + "api/comments", json={"movie_id": rnd.randint(1, size), "comment_body": "Benchmark"})
+    return make
+
+
+def drive(make, url, requests_count, concurrency):
+    """Send requests_count requests from concurrency clients; return (elapsed s, latencies s, statuses)."""
+    remaining = iter(range(requests_count))
+    lock = threading.Lock()
+    latencies, statuses = [], Counter()
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    break
+            started = time.perf_counter()
+            response = make(session, url)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] += 1
+        session.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(client) for _ in range(concurrency)]:
+            future.result()
+    return time.perf_counter() - started, latencies, statuses
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run(sizes, concurrency_levels, requests_count, warmup, latency, error_rate, comments_per_movie, database):
+    setup_django(database)
+    from django.core.wsgi import get_wsgi_application
+    from django.test.utils import override_settings
+    from movie_api.fake_omdb import FakeOmdbServer
+    from movie_api.models import Movie
+
+    results = []
+    for size in sorted(sizes):
+        seeded = Movie.objects.count()
+        if seeded < size:
+            print(f"seeding {size - seeded} movies ...", flush=True)
+            seed_movies(seeded, size, comments_per_movie=comments_per_movie)
+
+        with FakeOmdbServer(latency=latency, error_rate=error_rate) as omdb, \
+                override_settings(OMDB_API_URL=omdb.url, OMDB_API_KEYS=list(omdb.api_keys),
+                                  OMDB_KEY_RATE=10 ** 6, OMDB_KEY_DAILY_LIMIT=10 ** 9):
+            application = QueryCounter(get_wsgi_application())
+            server = make_server("127.0.0.1", 0, application, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            url = f"http://127.0.0.1:{server.server_port}/"
+            try:
+                for endpoint in ENDPOINTS:
+                    make = request_factory(endpoint, size, omdb)
+                    for concurrency in concurrency_levels:
+                        drive(make, url, warmup, concurrency)
+                        application.counts = []
+                        elapsed, latencies, statuses = drive(make, url, requests_count, concurrency)
+                        stats = percentiles(latencies)
+                        result = {
+                            "rows": size, "endpoint": endpoint, "concurrency": concurrency,
+                            "requests": requests_count, "statuses": {str(code): count for code, count in sorted(statuses.items())},
+                            "latency_ms": {key: round(value * 1000, 2) for key, value in stats.items()},
+                            "throughput_rps": round(requests_count / elapsed, 1),
+                            "queries_per_request": {"mean": round(sum(application.counts) / max(1, len(application.counts)), 2),
+                                                    "max": max(application.counts, default=0)},
+                            "peak_rss_mb": peak_rss_mb(),
+                        }
+                        results.append(result)
+                        print(f"{size:>9} rows  {endpoint:<18} c={concurrency:<4} {result['throughput_rps']:>8.1f} req/s  "
+                              f"p50 {result['latency_ms']['p50']:>8.2f} ms  p95 {result['latency_ms']['p95']:>8.2f} ms  "
+                              f"p99 {result['latency_ms']['p99']:>8.2f} ms  queries {result['queries_per_request']['mean']:>5.1f}  "
+                              f"rss {result['peak_rss_mb']} MB", flush=True)
+            finally:
+                server.shutdown()
+                server.server_close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Changes against baseline results of the same (rows, endpoint, concurrency); regressions are flagged."""
+    earlier = {(result["rows"], result["endpoint"], result["concurrency"]): result for result in baseline}
+    comparison = []
+    for result in results:
+        base = earlier.get((result["rows"], result["endpoint"], result["concurrency"]))
+        if base is None:
+            continue
+        p95 = result["latency_ms"]["p95"] / base["latency_ms"]["p95"] - 1 if base["latency_ms"]["p95"] else 0
+        throughput = result["throughput_rps"] / base["throughput_rps"] - 1 if base["throughput_rps"] else 0
+        comparison.append({
+            "rows": result["rows"], "endpoint": result["endpoint"], "concurrency": result["concurrency"],
+            "p95_change": round(p95, 3), "throughput_change": round(throughput, 3),
+            "queries_change": round(result["queries_per_request"]["mean"] - base["queries_per_request"]["mean"], 2),
+            "regression": p95 > tolerance or throughput < -tolerance,
+        })
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000], help="catalogue sizes (movies)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint and concurrency")
+    parser.add_argument("--warmup", type=int, default=20, help="requests sent before measuring")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the fake OMDb takes to answer")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of fake OMDb answers that are 500 errors")
+    parser.add_argument("--comments-per-movie", type=int, default=2)
+    parser.add_argument("--database", help="SQLite file to use and keep (default: temporary file)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed p95/throughput change against baseline")
+    args = parser.parse_args()
+
+    database = args.database
+    if not database:
+        handle, database = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+    try:
+        results = run(args.sizes, args.concurrency, args.requests, args.warmup, args.latency, args.error_rate,
+                      args.comments_per_movie, database)
+    finally:
+        if not args.database and os.path.exists(database):
+            os.remove(database)
+
+    import django
+    report = {
+        "meta": {"python": platform.python_version(), "django": django.get_version(), "platform": platform.platform(),
+                 "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "arguments": vars(args)},
+        "results": results,
+    }
+    regressions = False
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            report["comparison"] = compare(results, json.load(baseline)["results"], args.tolerance)
+        for change in report["comparison"]:
+            regressions = regressions or change["regression"]
+            print(f"{change['rows']:>9} rows  {change['endpoint']:<18} c={change['concurrency']:<4} "
+                  f"p95 {change['p95_change']:+.1%}  throughput {change['throughput_change']:+.1%}  "
+                  f"queries {change['queries_change']:+.2f}{'  REGRESSION' if change['regression'] else ''}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Latency of the movie lookups used by POST /api/movies at growing catalogue sizes.
+
+Compares the old unindexed exists()+get() on Title with the indexed title_key
+and unique imdbID lookups, on a scratch SQLite database:
+
+    python benchmarks/lookups.py --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+
+from common import percentiles, seed_movies, setup_django, synthetic_movie, timed
+
+
+def run(sizes, repeat, database):
+    setup_django(database)
+    from movie_api.models import Movie, Comment
+    from movie_api.titles import normalize_title
+
+    results = []
+    seeded = 0
+    for size in sorted(sizes):
+        seed_movies(seeded, size, comments_per_movie=1)
+        seeded = size
+
+        numbers = iter([random.randrange(size) for _ in range(repeat * 4)])
+        payloads = {}
+
+        def target():
+            number = next(numbers)
+            if number not in payloads:
+                payloads[number] = synthetic_movie(number)
+            return number, payloads[number]
+
+        def by_title():
+            number, payload = target()
+            if Movie.objects.filter(Title=payload["Title"]).exists():
+                Movie.objects.get(Title=payload["Title"])
+
+        def by_title_key():
+            number, payload = target()
+            Movie.objects.filter(title_key=normalize_title(payload["Title"])).first()
+
+        def by_imdb_id():
+            number, payload = target()
+            Movie.objects.filter(imdbID=payload["imdbID"]).first()
+
+        def comments_of_movie():
+            number, payload = target()
+            list(Comment.objects.filter(movie_id=number + 1))
+
+        for name, fn in (("Title exists()+get() (old)", by_title), ("title_key", by_title_key),
+                         ("imdbID", by_imdb_id), ("Comment.movie_id", comments_of_movie)):
+            stats = percentiles(timed(fn, repeat))
+            results.append(dict(rows=size, lookup=name, **{key: round(value, 1) for key, value in stats.items()}))
+            print(f"{size:>9} rows  {name:<28} p50 {stats['p50']:>10.1f} us   p95 {stats['p95']:>10.1f} us")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=200, help="lookups timed per size and query")
+    parser.add_argument("--database", help="SQLite file to use (default: temporary file)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    database = args.database
+    if not database:
+        handle, database = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+    try:
+        results = run(args.sizes, args.repeat, database)
+    finally:
+        if not args.database and os.path.exists(database):
+            os.remove(database)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+default_app_config = 'movie_api.apps.MovieApiConfig'
@@ -1,7 +1,9 @@
 from django.contrib import admin
-from .models import Movie, Comment, Rating
+from .models import Movie, Comment, Rating, UpstreamUsage, Change
 
 # Register your models here.
 admin.site.register(Movie)
 admin.site.register(Comment)
-admin.site.register(Rating)
\ No newline at end of file
+admin.site.register(Rating)
+admin.site.register(UpstreamUsage)
+admin.site.register(Change)
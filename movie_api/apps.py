@@ -1,5 +1,20 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def install_search_index(sender, using, **kwargs):
+    # Table rebuilds in later migrations (SQLite) drop the FTS triggers; put them back.
+    from .search import install_index
+    install_index(connections[using])
 
 
 class MovieApiConfig(AppConfig):
     name = 'movie_api'
+
+    def ready(self):
+        post_migrate.connect(install_search_index, sender=self)
+        from . import changes, payloads, response_cache
+        response_cache.connect_signals()
+        changes.connect_signals()
+        payloads.connect_signals()
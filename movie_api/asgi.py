@@ -0,0 +1,168 @@
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+from django.urls import resolve, Resolver404
+
+from . import async_views
+from .async_omdb import close_async_client
+from .comment_buffer import close_comment_buffer
+from .metrics import track_request, EARLIER_TIMINGS
+from .resolver import TITLE_LOOKUP
+from .views import MoviesView
+
+
+class MovieApiAsgi:
+    """ASGI application for the async deployment mode.
+
+    Requests are handed to the Django WSGI application on a pool of
+    ASGI_WSGI_THREADS threads. Before a POST /api/movies with a JSON or form
+    body gets there, its OMDb lookup runs as a coroutine
+    (async_views.lookup_title), so slow OMDb answers don't tie up threads;
+    MoviesView.post then answers from its outcome, through the same
+    middleware (metrics, replica pinning, compression) as every request.
+    """
+
+    def __init__(self, wsgi_application, threads=None):
+        self.wsgi = WsgiBridge(wsgi_application, threads or settings.ASGI_WSGI_THREADS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+        body = await read_body(receive)
+        title = self.lookup_title(scope, body)
+        extra = {}
+        if title is not None:
+            started = time.perf_counter()
+            with track_request() as timings:
+                extra[TITLE_LOOKUP] = await async_views.lookup_title(title)
+            extra[EARLIER_TIMINGS] = (started, timings)
+        await self.wsgi(scope, body, send, extra)
+
+    def lookup_title(self, scope, body):
+        """Title that MoviesView.post will look up for this request, otherwise None."""
+        if scope["method"] != "POST":
+            return None
+        try:
+            view = resolve(scope["path"]).func
+        except Resolver404:
+            return None
+        if getattr(view, "view_class", None) is not MoviesView:
+            return None
+
+        headers = dict(scope["headers"])
+        content_type = headers.get(b"content-type", b"").split(b";")[0].strip()
+        if content_type == b"application/json":
+            try:
+                data = json.loads(body.decode("utf-8"))
+            except ValueError:
+                return None  # DRF answers with its parse error
+        elif content_type == b"application/x-www-form-urlencoded":
+            data = dict(parse_qsl(body.decode("latin-1"), keep_blank_values=True))
+        else:
+            return None
+        title = data.get("title") if isinstance(data, dict) else None
+        return title if title and isinstance(title, str) else None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await close_async_client()
+                async_views.shutdown()
+                self.wsgi.shutdown()
+                close_comment_buffer()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+class WsgiBridge:
+    """Runs a WSGI application for ASGI http requests on a thread pool."""
+
+    def __init__(self, application, threads):
+        self.application = application
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi-wsgi")
+
+    async def __call__(self, scope, body, send, extra=None):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.executor, self.run, scope, body, send, loop, extra or {})
+
+    def run(self, scope, body, send, loop, extra):
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        start = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            start.update(status=int(status.split(" ", 1)[0]), headers=[
+                (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response_headers])
+
+        result = self.application(dict(wsgi_environ(scope, body), **extra), start_response)
+        try:
+            started = False
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not started:
+                    send_sync({"type": "http.response.start", **start})
+                    started = True
+                send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not started:
+                send_sync({"type": "http.response.start", **start})
+            send_sync({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def wsgi_environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            key = name
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    environ["CONTENT_LENGTH"] = str(len(body))  # the body has been read in full (also chunked ones)
+    return environ
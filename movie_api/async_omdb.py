@@ -0,0 +1,158 @@
+import asyncio
+import random
+import time
+import weakref
+
+import aiohttp
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .omdb import OmdbError, RETRY_STATUSES
+
+
+class AsyncOmdbClient:
+    """asyncio counterpart of OmdbClient for the ASGI deployment.
+
+    Waiting for OMDb doesn't hold a thread, so one process can keep hundreds
+    of lookups in flight over a pool of up to pool_size keep-alive
+    connections. Timeouts and retries work as in OmdbClient. Must be created
+    and used inside one running event loop.
+
+    Keys come from key_pool as in OmdbClient; its database reservations go
+    through run_in_thread(fn) so they don't block the loop. Calls are
+    reported to hooks and go through breaker as in OmdbClient; the breaker
+    works in the Django cache (maybe a network round trip), so it's called
+    through run_in_thread too.
+    """
+
+    def __init__(self, api_key, url='http://www.omdbapi.com/', connect_timeout=3.05, read_timeout=5,
+                 max_retries=2, backoff=0.2, pool_size=200, key_pool=None,
+                 run_in_thread=None, hooks=(), breaker=None):
+        self.api_key = api_key
+        self.hooks = tuple(hooks)
+        self.breaker = breaker
+        self.key_pool = key_pool
+        self.run_in_thread = run_in_thread
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+        )
+
+    async def get_movie(self, title):
+        """Return OMDb's parsed answer for title (with "Response": "True" or "False")."""
+        return await self._get({"t": title, "type": "movie"})
+
+    async def _get(self, params):
+        attempt = 0
+        while True:
+            probe = await self._in_thread(self.breaker.before_call) if self.breaker is not None else False
+            key = None
+            try:
+                if self.key_pool is not None:
+                    key = await self.key_pool.acquire_async(self.run_in_thread)
+            except Exception:
+                # No call is made; let another one probe.
+                if probe:
+                    await self._in_thread(self.breaker.cancel_probe)
+                raise
+            params["apikey"] = key.value if key is not None else self.api_key
+            started, outcome = time.perf_counter(), "error"
+            try:
+                async with self.session.get(self.url, params=params) as response:
+                    outcome = response.status
+                    if response.status == 401 and key is not None:
+                        await self._reject(key, response)
+                        if attempt >= self.max_retries:
+                            raise OmdbError("OMDb rejected the API keys")
+                        attempt += 1
+                        continue
+                    if response.status not in RETRY_STATUSES:
+                        return await self._parse(response)
+                    error = OmdbError(f"OMDb answered with status {response.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                outcome = "error"
+                error = OmdbError(f"OMDb request failed: {exc!r}")
+            finally:
+                await self._report(started, outcome, probe)
+
+            if attempt >= self.max_retries:
+                raise error
+            attempt += 1
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    async def _parse(self, response):
+        if response.status != 200:
+            raise OmdbError(f"OMDb answered with status {response.status}")
+        try:
+            return await response.json(content_type=None)
+        except ValueError:
+            raise OmdbError("OMDb answered with invalid JSON")
+
+    async def _report(self, started, outcome, probe):
+        seconds = time.perf_counter() - started
+        for hook in self.hooks:
+            hook(seconds, outcome)
+        if self.breaker is not None:
+            await self._in_thread(self.breaker.record, seconds, outcome, probe)
+
+    async def _in_thread(self, fn, *args):
+        if self.run_in_thread is None:
+            return fn(*args)
+        return await self.run_in_thread(fn, *args)
+
+    async def _reject(self, key, response):
+        try:
+            answer = await response.json(content_type=None)
+        except ValueError:
+            answer = None
+        if self.key_pool.rejected(key, answer):
+            await self.run_in_thread(self.key_pool.persist_exhausted, key)
+
+    async def close(self):
+        await self.session.close()
+
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the AsyncOmdbClient of the running event loop, configured from settings."""
+    from .async_views import run_in_db_thread
+    from .breaker import get_breaker
+    from .keys import get_key_pool
+    from .metrics import observe_omdb_call
+    loop = asyncio.get_event_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncOmdbClient(
+            api_key=settings.OMDB_API_KEY,
+            url=settings.OMDB_API_URL,
+            connect_timeout=settings.OMDB_CONNECT_TIMEOUT,
+            read_timeout=settings.OMDB_READ_TIMEOUT,
+            max_retries=settings.OMDB_MAX_RETRIES,
+            backoff=settings.OMDB_RETRY_BACKOFF,
+            pool_size=settings.OMDB_ASYNC_POOL_SIZE,
+            key_pool=get_key_pool(),
+            run_in_thread=run_in_db_thread,
+            hooks=(observe_omdb_call,),
+            breaker=get_breaker(),
+        )
+    return client
+
+
+async def close_async_client():
+    client = _clients.pop(asyncio.get_event_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+@receiver(setting_changed)
+def reset_async_clients(setting, **kwargs):
+    # Sessions belong to their loops and can't be closed from here; tests
+    # that change OMDB_* settings run a new loop anyway.
+    if setting.startswith("OMDB_"):
+        _clients.clear()
@@ -0,0 +1,73 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .async_omdb import get_async_client
+from .cache import title_cache, NOT_FOUND
+from .metrics import counting_queries
+from .resolver import stored_movie, store_lookup, TitleLookup
+from .singleflight import async_lookups
+from .titles import normalize_title
+
+
+_db_executor = None
+
+
+def _db_call(fn, *args):
+    # Same connection housekeeping Django does around a request.
+    close_old_connections()
+    try:
+        with counting_queries():
+            return fn(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_in_db_thread(fn, *args):
+    """Run ORM code for a coroutine on the bounded pool of ASGI_DB_THREADS threads,
+    in the coroutine's context (its queries count in the request's metrics)."""
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(settings.ASGI_DB_THREADS, thread_name_prefix="asgi-db")
+    context = contextvars.copy_context()
+    return await asyncio.get_event_loop().run_in_executor(_db_executor, context.run, partial(_db_call, fn, *args))
+
+
+async def resolve_title_async(title):
+    """resolve_title for the event loop: waiting for OMDb doesn't hold a thread.
+
+    Concurrent lookups of one title in this process share one upstream call;
+    the insert goes through the same cross-worker coalescing as resolve_title.
+    """
+    cached = title_cache.get(title)
+    if cached is NOT_FOUND:
+        return None
+    movie = await run_in_db_thread(stored_movie, title, cached)
+    if movie is not None:
+        return movie
+    return await async_lookups.do(f"title:{normalize_title(title)}", partial(_fetch_title_async, title))
+
+
+async def _fetch_title_async(title):
+    data = await get_async_client().get_movie(title)
+    return await run_in_db_thread(store_lookup, title, data)
+
+
+async def lookup_title(title):
+    """resolve_title_async(title) as a TitleLookup, which MoviesView.post answers from."""
+    try:
+        return TitleLookup(title, movie=await resolve_title_async(title))
+    except Exception as exc:
+        # Raised again in the view, so Django maps (or logs) it as for resolve_title.
+        return TitleLookup(title, error=exc)
+
+
+def shutdown():
+    global _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=False)
+        _db_executor = None
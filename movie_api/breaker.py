@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+from .omdb import OmdbError, RETRY_STATUSES
+
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATES = (CLOSED, HALF_OPEN, OPEN)
+COUNTS = ("calls", "failures", "slow")
+KEEP_TRANSITIONS = 20
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_STATE = metrics.Gauge("omdb_circuit_state", "State of the OMDb circuit breaker (1 for the current one).",
+                              ("state",))
+CIRCUIT_TRANSITIONS = metrics.Counter("omdb_circuit_transitions_total",
+                                      "OMDb circuit breaker state changes made by this worker.", ("from_state", "to_state"))
+CIRCUIT_REJECTED = metrics.Counter("omdb_circuit_rejected_total", "OMDb calls not made because the circuit was open.")
+
+
+class CircuitOpen(OmdbError):
+    """The OMDb circuit breaker doesn't let calls through; retry_after tells when it may again (seconds)."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class CircuitBreaker:
+    """Stops calling OMDb while it fails or is slow, so lookups fail fast instead of piling up.
+
+    Calls are counted in a sliding window of the last `window` seconds (in
+    `buckets` slices). When at least min_calls were made in it and
+    failure_rate of them failed (connection errors, timeouts, 429 and 5xx)
+    or slow_call_rate of them took slow_call_seconds or more, the circuit
+    opens: before_call() raises CircuitOpen for open_seconds. Then it's half
+    open: one call at a time, across workers, goes through as a probe; a
+    fast answer closes the circuit, a failed or slow one opens it again.
+
+    State and counts are kept in a Django cache, so with a shared backend
+    (memcached, redis) every worker sees the same circuit; with the default
+    in-memory cache each worker has its own.
+    """
+
+    def __init__(self, cache_alias="default", name="omdb", window=60, buckets=6, min_calls=10, failure_rate=0.5,
+                 slow_call_seconds=2.5, slow_call_rate=0.5, open_seconds=30, probe_timeout=10, clock=time.time):
+        self.cache = caches[cache_alias]
+        self.prefix = f"circuit:{name}:"
+        self.window = window
+        self.buckets = buckets
+        self.bucket_seconds = window / buckets
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self.clock = clock
+
+    def _key(self, *parts):
+        return self.prefix + ":".join(map(str, parts))
+
+    def current(self):
+        """{"state", "since", "until"} as stored (since/until: clock() times or None)."""
+        return self.cache.get(self._key("state")) or {"state": CLOSED, "since": None, "until": None}
+
+    def is_open(self):
+        """Whether calls are refused now (not counting the wait for a half-open probe)."""
+        current = self.current()
+        return current["state"] == OPEN and self.clock() < current["until"]
+
+    def before_call(self):
+        """Let a call to OMDb go ahead, or raise CircuitOpen.
+
+        Returns True when the call is the half-open probe; if it isn't made
+        after all, call cancel_probe() so another one can be.
+        """
+        current = self.current()
+        if current["state"] == CLOSED:
+            return False
+        now = self.clock()
+        if current["state"] == OPEN and now < current["until"]:
+            CIRCUIT_REJECTED.inc()
+            raise CircuitOpen("OMDb is not available, lookups of new titles are paused", current["until"] - now)
+        # Half open: the worker that takes the probe lease makes the one call.
+        if not self.cache.add(self._key("probe"), now, self.probe_timeout):
+            CIRCUIT_REJECTED.inc()
+            raise CircuitOpen("OMDb is not available, checking whether it's back", 1)
+        if current["state"] == OPEN:
+            self._switch(current, HALF_OPEN, now)
+        return True
+
+    def cancel_probe(self):
+        """Give back the probe taken by before_call() for a call that wasn't made."""
+        self.cache.delete(self._key("probe"))
+
+    def record(self, seconds, outcome, probe=False):
+        """Count a finished call; outcome is the status code or "error" (see OmdbClient hooks),
+        probe what before_call() returned for it. Half open, only the probe's outcome counts."""
+        failed = outcome == "error" or outcome in RETRY_STATUSES
+        slow = seconds >= self.slow_call_seconds
+        current = self.current()
+        now = self.clock()
+        if current["state"] == HALF_OPEN:
+            if not probe:
+                # Started before the circuit opened; the probe decides.
+                return
+            self.cache.delete(self._key("probe"))
+            self._switch(current, OPEN if failed or slow else CLOSED, now)
+            return
+        if current["state"] == OPEN:
+            # Started before the circuit opened.
+            return
+        bucket = int(now // self.bucket_seconds)
+        self._incr(bucket, "calls")
+        if failed:
+            self._incr(bucket, "failures")
+        if slow:
+            self._incr(bucket, "slow")
+        if (failed or slow) and self._tripped(self.window_counts(now)):
+            self._switch(current, OPEN, now)
+
+    def _incr(self, bucket, name):
+        key = self._key(bucket, name)
+        self.cache.add(key, 0, self.window * 2)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # Expired in between.
+            self.cache.set(key, 1, self.window * 2)
+
+    def _window_keys(self, now):
+        last = int(now // self.bucket_seconds)
+        return [(bucket, name) for bucket in range(last - self.buckets + 1, last + 1) for name in COUNTS]
+
+    def window_counts(self, now=None):
+        """Calls, failures and slow calls in the window."""
+        keys = self._window_keys(self.clock() if now is None else now)
+        values = self.cache.get_many([self._key(bucket, name) for bucket, name in keys])
+        counts = dict.fromkeys(COUNTS, 0)
+        for bucket, name in keys:
+            counts[name] += values.get(self._key(bucket, name), 0)
+        return counts
+
+    def _tripped(self, counts):
+        calls = counts["calls"]
+        return calls >= self.min_calls and (counts["failures"] >= self.failure_rate * calls
+                                            or counts["slow"] >= self.slow_call_rate * calls)
+
+    def _switch(self, current, state, now):
+        until = now + self.open_seconds if state == OPEN else None
+        self.cache.set(self._key("state"), {"state": state, "since": now, "until": until}, None)
+        if state == CLOSED:
+            # The calls that opened it mustn't open it again right away.
+            self.cache.delete_many([self._key(bucket, name) for bucket, name in self._window_keys(now)])
+        self._log_transition({"from": current["state"], "to": state, "at": _timestamp(now)})
+        CIRCUIT_TRANSITIONS.inc(from_state=current["state"], to_state=state)
+        logger.warning("OMDb circuit breaker: %s -> %s", current["state"], state)
+
+    def _log_transition(self, transition):
+        # Numbered by incr() into a ring of KEEP_TRANSITIONS entries, so
+        # transitions of concurrent workers don't overwrite each other.
+        key = self._key("transitions", "count")
+        self.cache.add(key, 0, None)
+        try:
+            number = self.cache.incr(key)
+        except ValueError:
+            # Evicted in between.
+            number = 1
+            self.cache.set(key, number, None)
+        self.cache.set(self._key("transitions", number % KEEP_TRANSITIONS), dict(transition, number=number), None)
+
+    def transitions(self):
+        """The last KEEP_TRANSITIONS transitions, oldest first."""
+        entries = self.cache.get_many([self._key("transitions", slot) for slot in range(KEEP_TRANSITIONS)])
+        return [{name: value for name, value in entry.items() if name != "number"}
+                for entry in sorted(entries.values(), key=lambda entry: entry["number"])]
+
+    def status(self):
+        """State, counts of the window and recent transitions, for monitoring."""
+        current = self.current()
+        now = self.clock()
+        state = current["state"]
+        if state == OPEN and now >= current["until"]:
+            state = HALF_OPEN  # the next call is a probe
+        return {
+            "state": state,
+            "since": _timestamp(current["since"]),
+            "retry_after": max(0, round(current["until"] - now, 1)) if state == OPEN else None,
+            "window_seconds": self.window,
+            "window": self.window_counts(now),
+            "transitions": self.transitions(),
+        }
+
+
+def _timestamp(seconds):
+    if seconds is None:
+        return None
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_breaker():
+    """Return the CircuitBreaker of OMDb calls configured from settings, or None when OMDB_BREAKER is off."""
+    global _breaker
+    if not settings.OMDB_BREAKER:
+        return None
+    with _breaker_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                cache_alias=settings.OMDB_BREAKER_CACHE_ALIAS,
+                window=settings.OMDB_BREAKER_WINDOW,
+                min_calls=settings.OMDB_BREAKER_MIN_CALLS,
+                failure_rate=settings.OMDB_BREAKER_FAILURE_RATE,
+                slow_call_seconds=settings.OMDB_BREAKER_SLOW_CALL_SECONDS,
+                slow_call_rate=settings.OMDB_BREAKER_SLOW_CALL_RATE,
+                open_seconds=settings.OMDB_BREAKER_OPEN_SECONDS,
+                probe_timeout=settings.OMDB_BREAKER_PROBE_TIMEOUT,
+            )
+        return _breaker
+
+
+@receiver(setting_changed)
+def reset_breaker(setting, **kwargs):
+    global _breaker
+    if setting.startswith("OMDB_"):
+        with _breaker_lock:
+            _breaker = None
+
+
+def _collect_state():
+    breaker = get_breaker()
+    if breaker is None:
+        return
+    state = breaker.status()["state"]
+    for name in STATES:
+        CIRCUIT_STATE.set(1 if name == state else 0, state=name)
+
+
+metrics.COLLECTORS.append(_collect_state)
@@ -0,0 +1,182 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .changes import record_changes
+from .models import Change, Comment, Movie, Rating
+from .response_cache import bump_version, COMMENTS, MOVIES
+from .serializers import INTERNAL_MOVIE_FIELDS, MovieReadSerializer
+from .streaming import _dumps
+
+
+DERIVED_FIELDS = tuple(field for field in INTERNAL_MOVIE_FIELDS if field not in ("fetched_at", "payload"))
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bulk_create_movies(movies_data, chunk_size=None, fetched=True):
+    """Insert movies with their Ratings, one transaction and one INSERT per table for each chunk.
+
+    movies_data are MovieSerializer.validated_data dicts of movies not stored
+    yet, each with an imdbID. Movies not just fetched from OMDb (fetched=False)
+    are left for the refresher. Returns the created Movie objects (with ids),
+    in the same order.
+    """
+    chunk_size = chunk_size or settings.MOVIE_BULK_CHUNK_SIZE
+    created = []
+    fetched_at = timezone.now() if fetched else None
+    for chunk in chunked(list(movies_data), chunk_size):
+        with transaction.atomic():
+            movies = [Movie(fetched_at=fetched_at, **{field: value for field, value in data.items() if field != "Ratings"})
+                      for data in chunk]
+            for movie in movies:
+                movie.fill_derived_fields()
+            Movie.objects.bulk_create(movies)
+            if not connection.features.can_return_ids_from_bulk_insert:
+                _fetch_ids(movies)
+            Rating.objects.bulk_create([
+                Rating(Movie_id=movie.id, **rating)
+                for movie, data in zip(movies, chunk) for rating in data.get("Ratings", ())
+            ])
+            refresh_payloads([movie.id for movie in movies])
+            bump_version(MOVIES)
+            record_changes(Change.MOVIE, [movie.id for movie in movies])
+        created.extend(movies)
+    return created
+
+
+def _fetch_ids(movies):
+    ids = dict(Movie.objects.filter(imdbID__in=[movie.imdbID for movie in movies]).values_list("imdbID", "id"))
+    for movie in movies:
+        movie.id = ids[movie.imdbID]
+
+
+def bulk_update_movies(updates):
+    """Save new data over stored movies, writing only the columns and Ratings that changed.
+
+    updates are (Movie, MovieSerializer.validated_data) pairs. Uses a few bulk
+    statements for all of them; call inside a transaction. Returns the ids of
+    the movies that changed.
+    """
+    changed_movies, changed_fields = [], set()
+    for movie, data in updates:
+        changes = {field: value for field, value in data.items()
+                   if field != "Ratings" and getattr(movie, field) != value}
+        if changes:
+            for field, value in changes.items():
+                setattr(movie, field, value)
+            movie.fill_derived_fields()
+            changed_movies.append(movie)
+            changed_fields.update(changes)
+
+    rating_changes = _diff_ratings(updates)
+    changed = {movie.id for movie in changed_movies} | rating_changes["movie_ids"]
+    if changed_movies:
+        bulk_update(Movie, changed_movies, sorted(changed_fields) + list(DERIVED_FIELDS))
+    if rating_changes["changed"]:
+        bulk_update(Rating, rating_changes["changed"], ["Value"])
+    if rating_changes["created"]:
+        Rating.objects.bulk_create(rating_changes["created"])
+    if rating_changes["deleted"]:
+        Rating.objects.filter(id__in=rating_changes["deleted"]).delete()
+    if changed:
+        refresh_payloads(changed)
+        bump_version(MOVIES)
+        record_changes(Change.MOVIE, sorted(changed))
+    return changed
+
+
+def _diff_ratings(updates):
+    stored = defaultdict(dict)
+    for rating in Rating.objects.filter(Movie_id__in=[movie.id for movie, data in updates]):
+        stored[rating.Movie_id][rating.Source] = rating
+
+    changes = {"changed": [], "created": [], "deleted": [], "movie_ids": set()}
+    for movie, data in updates:
+        current = stored[movie.id]
+        fresh = {rating["Source"]: rating["Value"] for rating in data.get("Ratings", ())}
+        for source, value in fresh.items():
+            rating = current.get(source)
+            if rating is None:
+                changes["created"].append(Rating(Movie_id=movie.id, Source=source, Value=value))
+            elif rating.Value != value:
+                rating.Value = value
+                changes["changed"].append(rating)
+            else:
+                continue
+            changes["movie_ids"].add(movie.id)
+        for source, rating in current.items():
+            if source not in fresh:
+                changes["deleted"].append(rating.id)
+                changes["movie_ids"].add(movie.id)
+    return changes
+
+
+def render_payloads(movies):
+    """Listing JSON (MovieReadSerializer) of each movie, as text; prefetch their Ratings."""
+    return [_dumps(data).decode("utf-8") for data in MovieReadSerializer(movies, many=True).data]
+
+
+def refresh_payloads(ids):
+    """Render and store Movie.payload of the movies with ids, a few statements per 500 movies.
+
+    Call in the transaction that changed them.
+    """
+    for chunk in chunked(sorted(set(ids)), 500):
+        movies = list(Movie.objects.filter(id__in=chunk).prefetch_related("Ratings"))
+        for movie, payload in zip(movies, render_payloads(movies)):
+            movie.payload = payload
+        bulk_update(Movie, movies, ["payload"])
+
+
+def bulk_create_comments(comments):
+    """Insert (movie_id, comment_body) pairs with one existence check and one INSERT, in one transaction
+    (one INSERT per comment on databases that don't return ids of bulk inserts, other than SQLite).
+
+    Returns the created Comment for each pair, or None where no movie has that id.
+    """
+    movie_ids = set(Movie.objects.filter(id__in={movie_id for movie_id, body in comments}).values_list("id", flat=True))
+    created = [Comment(movie_id_id=movie_id, comment_body=body) if movie_id in movie_ids else None
+               for movie_id, body in comments]
+    new = [comment for comment in created if comment is not None]
+    if not new:
+        return created
+    with transaction.atomic():
+        if not (connection.features.can_return_ids_from_bulk_insert or connection.vendor == "sqlite"):
+            # The ids of a bulk INSERT can't be told here (f.e. MySQL): one INSERT
+            # per comment, its change recorded by the signals.
+            for comment in new:
+                comment.save()
+            return created
+        Comment.objects.bulk_create(new)
+        if not connection.features.can_return_ids_from_bulk_insert:
+            _assign_sequential_ids(Comment, new)
+        bump_version(COMMENTS)
+        record_changes(Change.COMMENT, [comment.id for comment in new])
+    return created
+
+
+def _assign_sequential_ids(model, objects):
+    # SQLite: the transaction holds the write lock since the INSERT, so the rows
+    # just inserted are the ones with the highest ids, numbered in order.
+    last = model.objects.order_by("-id").values_list("id", flat=True).first()
+    for offset, obj in enumerate(objects, start=last - len(objects) + 1):
+        obj.id = offset
+
+
+def bulk_update(model, objects, fields, chunk_size=100):
+    """Save fields of objects with one UPDATE ... CASE statement per chunk
+    (QuerySet.bulk_update only arrived in Django 2.2). Call inside a transaction."""
+    for chunk in chunked(list(objects), chunk_size):
+        updates = {}
+        for name in fields:
+            field = model._meta.get_field(name)
+            updates[name] = Case(*[When(pk=obj.pk, then=Value(getattr(obj, name), output_field=field))
+                                   for obj in chunk], output_field=field)
+        model.objects.filter(pk__in=[obj.pk for obj in chunk]).update(**updates)
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from . import metrics
+from .titles import normalize_title
+
+
+NOT_FOUND = object()
+
+CachedMovie = namedtuple("CachedMovie", ("movie_id", "title_key"))
+
+TITLE_CACHE_LOOKUPS = metrics.Counter("title_cache_lookups_total",
+                                      "Title cache lookups by result (hit, negative_hit, miss).", ("result",))
+TITLE_CACHE_EVICTIONS = metrics.Counter("title_cache_evictions_total",
+                                        "Titles dropped from the title cache to keep it within its size.")
+TITLE_CACHE_ENTRIES = metrics.Gauge("title_cache_entries", "Titles in the title cache, by cache (movies, missing).",
+                                    ("cache",))
+
+
+class TitleResolutionCache:
+    """Maps normalized request titles to stored Movie rows, so repeated
+    POST /api/movies for a known title don't go to OMDb at all.
+
+    Titles OMDb answered with "Response": "False" are kept in a separate
+    negative cache for negative_ttl seconds. Both maps are LRU-bounded by maxsize.
+    """
+
+    def __init__(self, maxsize=1024, negative_ttl=3600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._movies = OrderedDict()
+        self._missing = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, title):
+        """Return a CachedMovie, NOT_FOUND for a known miss or None when OMDb has to be asked."""
+        key = normalize_title(title)
+        with self._lock:
+            entry = self._movies.get(key)
+            if entry is not None:
+                self._movies.move_to_end(key)
+                self.hits += 1
+                return entry
+            expires = self._missing.get(key)
+            if expires is not None:
+                if expires > self._clock():
+                    self.negative_hits += 1
+                    return NOT_FOUND
+                del self._missing[key]
+            self.misses += 1
+            return None
+
+    def add(self, title, movie):
+        """Remember that title resolves to the stored movie."""
+        key = normalize_title(title)
+        entry = CachedMovie(movie.id, normalize_title(movie.Title))
+        with self._lock:
+            self._missing.pop(key, None)
+            self._movies[key] = entry
+            self._movies.move_to_end(key)
+            self._evict(self._movies)
+
+    def add_missing(self, title):
+        """Remember that OMDb has no movie with this title."""
+        key = normalize_title(title)
+        with self._lock:
+            self._movies.pop(key, None)
+            self._missing[key] = self._clock() + self.negative_ttl
+            self._missing.move_to_end(key)
+            self._evict(self._missing)
+
+    def discard(self, title):
+        key = normalize_title(title)
+        with self._lock:
+            self._movies.pop(key, None)
+            self._missing.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._movies.clear()
+            self._missing.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._movies),
+                "negative_size": len(self._missing),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _evict(self, entries):
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+
+title_cache = TitleResolutionCache(
+    maxsize=getattr(settings, "TITLE_CACHE_SIZE", 1024),
+    negative_ttl=getattr(settings, "TITLE_CACHE_NEGATIVE_TTL", 3600),
+)
+
+
+def _collect_stats():
+    stats = title_cache.stats()
+    for result, total in (("hit", "hits"), ("negative_hit", "negative_hits"), ("miss", "misses")):
+        TITLE_CACHE_LOOKUPS.set_total(stats[total], result=result)
+    TITLE_CACHE_EVICTIONS.set_total(stats["evictions"])
+    TITLE_CACHE_ENTRIES.set(stats["size"], cache="movies")
+    TITLE_CACHE_ENTRIES.set(stats["negative_size"], cache="missing")
+
+
+metrics.COLLECTORS.append(_collect_stats)
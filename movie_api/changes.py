@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_delete, post_save
+
+from .models import Change, Comment, Movie, Rating
+from .response_cache import bump_version
+from .serializers import CommentSerializer, MovieReadSerializer
+
+
+# TableVersion row every writer of the feed locks until it commits.
+FEED = "changes"
+
+_changed = threading.Condition()
+
+
+def record_changes(kind, ids, deleted=False):
+    """Append writes of the kind ("movie", "comment") objects with ids to the change feed.
+
+    Runs in the writer's transaction, so the change shows up when the write does.
+    Writers take the feed's lock row first and hold it until they commit, so
+    changes become visible in the order of their ids: a consumer that has read
+    up to a sequence number can't miss a lower one committed later. Bump
+    table versions before, as the signals do, so writers lock rows in one order.
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    with transaction.atomic(savepoint=False):
+        bump_version(FEED)
+        Change.objects.bulk_create([Change(kind=kind, object_id=pk, deleted=deleted) for pk in ids])
+    transaction.on_commit(_notify)
+
+
+def _notify():
+    with _changed:
+        _changed.notify_all()
+
+
+def latest_sequence():
+    change = Change.objects.order_by("-id").first()
+    return change.id if change is not None else 0
+
+
+def wait_for_changes(since, timeout):
+    """Block until there are changes after since or timeout seconds pass; return whether there are.
+
+    Commits in this process wake waiters at once; changes of other workers
+    are seen within CHANGE_FEED_POLL_INTERVAL.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if Change.objects.filter(id__gt=since).exists():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        with _changed:
+            _changed.wait(min(remaining, settings.CHANGE_FEED_POLL_INTERVAL))
+
+
+def change_feed(since, limit):
+    """Up to limit changes after since: the current state of every changed object (data is
+    None for deleted ones), each once at its latest change, and the cursor to continue from."""
+    changes = list(Change.objects.filter(id__gt=since).order_by("id")[:limit + 1])
+    more = len(changes) > limit
+    changes = changes[:limit]
+
+    latest = OrderedDict()
+    for change in changes:
+        latest.pop((change.kind, change.object_id), None)
+        latest[(change.kind, change.object_id)] = change
+    movies = _serialized(Movie.objects.prefetch_related("Ratings"), MovieReadSerializer,
+                         [pk for kind, pk in latest if kind == Change.MOVIE])
+    comments = _serialized(Comment.objects.all(), CommentSerializer,
+                           [pk for kind, pk in latest if kind == Change.COMMENT])
+
+    results = []
+    for (kind, pk), change in latest.items():
+        data = (movies if kind == Change.MOVIE else comments).get(pk)
+        results.append(OrderedDict([
+            ("seq", change.id),
+            ("type", kind),
+            ("id", pk),
+            ("deleted", data is None),
+            ("data", data),
+        ]))
+    return OrderedDict([
+        ("since", since),
+        ("next", changes[-1].id if changes else since),
+        ("more", more),
+        ("changes", results),
+    ])
+
+
+def prune_changes(before, chunk_size=1000):
+    """Delete changes made before `before` that consumers don't need; return how many.
+
+    Those are changes followed by a later change of the same object (the feed
+    serves an object's current data at its latest change anyway) and deletions.
+    The latest change is kept, so sequence numbers go on from it.
+    """
+    old = Change.objects.filter(at__lt=before).exclude(id=latest_sequence())
+    later = Change.objects.filter(kind=OuterRef("kind"), object_id=OuterRef("object_id"), id__gt=OuterRef("id"))
+    superseded = old.annotate(superseded=Exists(later)).filter(superseded=True)
+    # Superseded ones first: older changes of a deleted object go before its deletion.
+    return _delete_in_chunks(superseded, chunk_size) + _delete_in_chunks(old.filter(deleted=True), chunk_size)
+
+
+def _delete_in_chunks(queryset, chunk_size):
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by("id").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += Change.objects.filter(id__in=ids).delete()[0]
+
+
+def _serialized(queryset, serializer_class, ids):
+    if not ids:
+        return {}
+    objects = list(queryset.filter(id__in=ids))
+    return {obj.id: data for obj, data in zip(objects, serializer_class(objects, many=True).data)}
+
+
+def _movie_saved(sender, instance, **kwargs):
+    record_changes(Change.MOVIE, [instance.id])
+
+
+def _movie_deleted(sender, instance, **kwargs):
+    record_changes(Change.MOVIE, [instance.id], deleted=True)
+
+
+def _rating_changed(sender, instance, **kwargs):
+    record_changes(Change.MOVIE, [instance.Movie_id])
+
+
+def _comment_saved(sender, instance, **kwargs):
+    record_changes(Change.COMMENT, [instance.id])
+
+
+def _comment_deleted(sender, instance, **kwargs):
+    record_changes(Change.COMMENT, [instance.id], deleted=True)
+
+
+def connect_signals():
+    """Record single-row writes (API, admin, shell). Bulk writers call record_changes themselves."""
+    post_save.connect(_movie_saved, sender=Movie)
+    post_delete.connect(_movie_deleted, sender=Movie)
+    post_save.connect(_rating_changed, sender=Rating)
+    post_delete.connect(_rating_changed, sender=Rating)
+    post_save.connect(_comment_saved, sender=Comment)
+    post_delete.connect(_comment_deleted, sender=Comment)
@@ -0,0 +1,132 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+from .bulk import bulk_create_comments
+
+
+class BufferFull(Exception):
+    """The comment buffer had no room within the timeout (or is closed)."""
+
+
+_STOP = object()
+
+
+class CommentBuffer:
+    """Write-behind buffer for POST /api/comments.
+
+    Requests put their comment in a bounded queue and wait for its Future; a
+    background thread writes the queue in batches of up to flush_size, at
+    most interval seconds after the first comment of a batch arrived, with
+    one movie existence check and one INSERT per batch. When the queue is
+    full, submit() waits up to timeout seconds and then raises BufferFull.
+    close() writes what is left (also at exit).
+    """
+
+    def __init__(self, max_size=10000, flush_size=500, interval=0.005, timeout=1.0):
+        self.flush_size = flush_size
+        self.interval = interval
+        self.timeout = timeout
+        self._queue = queue.Queue(max_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="comment-buffer", daemon=True)
+        self._thread.start()
+
+    def submit(self, movie_id, comment_body):
+        """Queue a comment; the Future gives the created Comment, or None when no movie has movie_id."""
+        if self._closed:
+            raise BufferFull("Comment buffer is closed")
+        future = Future()
+        try:
+            self._queue.put((movie_id, comment_body, future), timeout=self.timeout)
+        except queue.Full:
+            raise BufferFull("Comment buffer is full")
+        return future
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        # Comments that came in while closing.
+        left = []
+        while True:
+            try:
+                left.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(left), self.flush_size):
+            self._write(left[start:start + self.flush_size])
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.flush_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        close_old_connections()
+        try:
+            created = bulk_create_comments([(movie_id, body) for movie_id, body, future in batch])
+        except Exception as exc:
+            for movie_id, body, future in batch:
+                future.set_exception(exc)
+        else:
+            for (movie_id, body, future), comment in zip(batch, created):
+                future.set_result(comment)
+        finally:
+            close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_comment_buffer():
+    """Return the CommentBuffer of this worker, configured from settings."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = CommentBuffer(
+                max_size=settings.COMMENT_BUFFER_SIZE,
+                flush_size=settings.COMMENT_FLUSH_SIZE,
+                interval=settings.COMMENT_FLUSH_INTERVAL,
+                timeout=settings.COMMENT_BUFFER_TIMEOUT,
+            )
+        return _buffer
+
+
+@atexit.register
+def close_comment_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is not None:
+            _buffer.close()
+        _buffer = None
+
+
+@receiver(setting_changed)
+def reset_comment_buffer(setting, **kwargs):
+    if setting.startswith("COMMENT_"):
+        close_comment_buffer()
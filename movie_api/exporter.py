@@ -0,0 +1,160 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import time
+from collections import defaultdict
+
+from .models import Comment, Movie, Rating
+from .serializers import INTERNAL_MOVIE_FIELDS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+MOVIE_COLUMNS = tuple(field.attname for field in Movie._meta.concrete_fields if field.name not in INTERNAL_MOVIE_FIELDS)
+FORMATS = ("ndjson", "csv", "parquet")
+
+
+def available_formats():
+    return FORMATS if pyarrow is not None else FORMATS[:-1]
+
+
+class CatalogExporter:
+    """Writes stored movies with their Ratings (and Comments) to a file, in id order.
+
+    Movies are read through a cursor in chunks of chunk_size rows; Ratings and
+    Comments of each chunk come from one range query each (by movie id), so
+    the export is one pass over every table in bounded memory. Every movie is
+    one record: a JSON object per line (ndjson), a CSV row with Ratings and
+    Comments as JSON columns (csv) or a row group of a Parquet file (parquet,
+    needs pyarrow). ndjson and csv output is gzipped when the file name ends
+    with .gz. Only movies with an id above since_id are exported.
+    """
+
+    def __init__(self, path, fmt="ndjson", since_id=0, chunk_size=2000, comments=True):
+        if fmt not in available_formats():
+            raise ValueError(f"Unsupported format: {fmt}" + (" (install pyarrow)" if fmt == "parquet" else ""))
+        self.path = path
+        self.format = fmt
+        self.since_id = since_id or 0
+        self.chunk_size = chunk_size
+        self.comments = comments
+
+    def run(self):
+        """Write the file; return the number of movies, the last exported id, bytes written and time taken."""
+        started = time.monotonic()
+        stats = {"movies": 0, "last_id": self.since_id}
+        writer = self.writer()
+        try:
+            for chunk in self.chunks():
+                writer.write(chunk)
+                stats["movies"] += len(chunk)
+                stats["last_id"] = chunk[-1]["id"]
+        finally:
+            stats["bytes"] = writer.close()
+        elapsed = time.monotonic() - started
+        stats["seconds"] = round(elapsed, 1)
+        stats["rows_per_second"] = round(stats["movies"] / max(elapsed, 1e-9))
+        return stats
+
+    def chunks(self):
+        """Lists of movie dicts (with Ratings and Comments), chunk_size at a time."""
+        rows = (Movie.objects.filter(id__gt=self.since_id).order_by("id")
+                .values_list(*MOVIE_COLUMNS).iterator(chunk_size=self.chunk_size))
+        while True:
+            movies = [dict(zip(MOVIE_COLUMNS, row)) for row in itertools.islice(rows, self.chunk_size)]
+            if not movies:
+                return
+            first, last = movies[0]["id"], movies[-1]["id"]
+            ratings = self.related(Rating.objects.filter(Movie_id__gte=first, Movie_id__lte=last)
+                                   .order_by("Movie_id", "id").values_list("Movie_id", "Source", "Value"),
+                                   ("Source", "Value"))
+            if self.comments:
+                comments = self.related(Comment.objects.filter(movie_id__gte=first, movie_id__lte=last)
+                                        .order_by("movie_id", "id").values_list("movie_id", "id", "comment_body"),
+                                        ("id", "comment_body"))
+            for movie in movies:
+                movie["Ratings"] = ratings.get(movie["id"], [])
+                if self.comments:
+                    movie["Comments"] = comments.get(movie["id"], [])
+            yield movies
+
+    @staticmethod
+    def related(rows, fields):
+        grouped = defaultdict(list)
+        for movie_id, *values in rows:
+            grouped[movie_id].append(dict(zip(fields, values)))
+        return grouped
+
+    def writer(self):
+        if self.format == "parquet":
+            return ParquetWriter(self.path, self.comments)
+        output = gzip.open(self.path, "wb") if self.path.endswith(".gz") else open(self.path, "wb")
+        if self.format == "csv":
+            return CsvWriter(self.path, output, self.comments)
+        return NdjsonWriter(self.path, output)
+
+
+class NdjsonWriter:
+
+    def __init__(self, path, output):
+        self.path = path
+        self.output = output
+
+    def write(self, movies):
+        self.output.write("".join(json.dumps(movie, ensure_ascii=False, separators=(",", ":")) + "\n"
+                                  for movie in movies).encode("utf-8"))
+
+    def close(self):
+        """Close the file; return its size."""
+        self.output.close()
+        return os.path.getsize(self.path)
+
+
+class CsvWriter(NdjsonWriter):
+
+    def __init__(self, path, output, comments):
+        super().__init__(path, output)
+        self.text = io.TextIOWrapper(output, encoding="utf-8", newline="")
+        self.columns = MOVIE_COLUMNS + ("Ratings",) + (("Comments",) if comments else ())
+        self.csv = csv.writer(self.text)
+        self.csv.writerow(self.columns)
+
+    def write(self, movies):
+        self.csv.writerows(
+            [movie[column] if column in MOVIE_COLUMNS else json.dumps(movie[column], ensure_ascii=False)
+             for column in self.columns]
+            for movie in movies)
+
+    def close(self):
+        self.text.close()
+        return os.path.getsize(self.path)
+
+
+class ParquetWriter:
+    """One row group per chunk; Ratings and Comments are list<struct> columns."""
+
+    def __init__(self, path, comments):
+        self.path = path
+        fields = [(column, pyarrow.int64() if column == "id" else pyarrow.string()) for column in MOVIE_COLUMNS]
+        fields.append(("Ratings", pyarrow.list_(pyarrow.struct([("Source", pyarrow.string()),
+                                                                ("Value", pyarrow.string())]))))
+        if comments:
+            fields.append(("Comments", pyarrow.list_(pyarrow.struct([("id", pyarrow.int64()),
+                                                                     ("comment_body", pyarrow.string())]))))
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, movies):
+        columns = {name: [movie[name] for movie in movies] for name in self.schema.names}
+        self.writer.write_table(pyarrow.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+        return os.path.getsize(self.path)
@@ -0,0 +1,115 @@
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _OmdbHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server.omdb
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        key = params.get("apikey")
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            server.key_calls[key] += 1
+            over_limit = key in server.daily_limits and server.key_calls[key] > server.daily_limits[key]
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.error_rate and random.random() < server.error_rate:
+            self._send(500, {"Response": "False", "Error": "Internal error"})
+        elif key not in server.api_keys:
+            self._send(401, {"Response": "False", "Error": "Invalid API key!"})
+        elif over_limit:
+            self._send(401, {"Response": "False", "Error": "Request limit reached!"})
+        else:
+            if "i" in params:
+                movie = server.by_id.get(params["i"])
+            else:
+                movie = server.movies.get(params.get("t", "").strip().lower())
+            if movie is None:
+                self._send(200, {"Response": "False", "Error": "Movie not found!"})
+            else:
+                self._send(200, movie)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _OmdbHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # load tests open hundreds of connections at once
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up waiting (timeout tests) are expected.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeOmdbServer:
+    """Stand-in for omdbapi.com on localhost, for tests and benchmarks.
+
+    Serves the given OMDb-shaped movies by (case-insensitive) title or imdbID, with
+    optional latency (seconds) and error_rate (share of 500 answers). Only
+    api_keys are accepted, each for at most daily_limits[key] calls if given.
+    """
+
+    def __init__(self, movies=(), latency=0, error_rate=0, api_keys=("28cb1743",), daily_limits=None):
+        self.movies = {}
+        self.by_id = {}
+        for movie in movies:
+            self.add(movie)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.api_keys = set(api_keys)
+        self.daily_limits = dict(daily_limits or {})
+        self.key_calls = Counter()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = set()
+        self._httpd = None
+        self._thread = None
+
+    def add(self, movie):
+        """Serve movie (or its new version) from now on."""
+        self.movies[movie["Title"].lower()] = movie
+        if movie.get("imdbID"):
+            self.by_id[movie["imdbID"]] = movie
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._httpd = _OmdbHTTPServer(("127.0.0.1", 0), _OmdbHandler)
+        self._httpd.omdb = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
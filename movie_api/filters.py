@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .models import Comment, Movie
+from .pagination import get_param
+from .serializers import INTERNAL_MOVIE_FIELDS
+
+
+# query parameter: (Movie column, lookup, type of value)
+RANGE_FILTERS = {
+    "year_min": ("year_value", "gte", int),
+    "year_max": ("year_value", "lte", int),
+    "rating_gte": ("imdb_rating_value", "gte", float),
+    "rating_lte": ("imdb_rating_value", "lte", float),
+    "votes_gte": ("imdb_votes_value", "gte", int),
+    "votes_lte": ("imdb_votes_value", "lte", int),
+    "metascore_gte": ("metascore_value", "gte", int),
+    "metascore_lte": ("metascore_value", "lte", int),
+    "box_office_gte": ("box_office_value", "gte", int),
+    "box_office_lte": ("box_office_value", "lte", int),
+}
+
+SORT_FIELDS = {
+    "id": "id",
+    "year": "year_value",
+    "rating": "imdb_rating_value",
+    "votes": "imdb_votes_value",
+    "metascore": "metascore_value",
+    "box_office": "box_office_value",
+}
+
+
+# Movie fields a client can pick with ?fields=; Ratings and Comments are related rows.
+MOVIE_COLUMNS = tuple(field.name for field in Movie._meta.concrete_fields if field.name not in INTERNAL_MOVIE_FIELDS)
+EXPANSIONS = ("Ratings", "Comments")
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def filter_movies(request, queryset):
+    """Apply range filters and sorting from the request to a Movie queryset.
+
+    Returns (queryset, sort column). Movies without a value in the sort
+    column are left out, so they don't break keyset pagination.
+    """
+    for name, (column, lookup, cast) in RANGE_FILTERS.items():
+        value = get_param(request, name)
+        if value is None or value == "":
+            continue
+        try:
+            value = cast(str(value).replace(",", ""))
+        except ValueError:
+            raise InvalidFilter(f"Parameter {name} must be a number")
+        queryset = queryset.filter(**{f"{column}__{lookup}": value})
+
+    sort = get_param(request, "sort") or "id"
+    if sort not in SORT_FIELDS:
+        raise InvalidFilter(f"You can only sort by one of: {', '.join(SORT_FIELDS)}")
+    column = SORT_FIELDS[sort]
+    if column != "id":
+        queryset = queryset.exclude(**{column: None})
+    return queryset, column
+
+
+def select_fields(request, queryset, sort_column="id"):
+    """Narrow a Movie queryset to the comma-separated ?fields= of the request.
+
+    Returns (queryset, fields for MovieReadSerializer, None for the full
+    movie). Only the asked columns (and id and the sort column) are selected,
+    Ratings and Comments are fetched only when asked for. Full movies are just
+    their stored payloads with MOVIE_PAYLOADS on (see payloads.StoredPayloads).
+    """
+    value = get_param(request, "fields")
+    if value is None or str(value).strip() == "":
+        if settings.MOVIE_PAYLOADS:
+            return queryset.only("id", sort_column, "payload"), None
+        return queryset.prefetch_related("Ratings"), None
+    fields = [name.strip() for name in str(value).split(",") if name.strip()]
+    unknown = [name for name in fields if name not in MOVIE_COLUMNS + EXPANSIONS]
+    if unknown:
+        raise InvalidFilter(f"Unknown fields: {', '.join(unknown)}. Fields are: {', '.join(MOVIE_COLUMNS + EXPANSIONS)}")
+    queryset = queryset.only(*{"id", sort_column}.union(name for name in fields if name in MOVIE_COLUMNS))
+    if "Ratings" in fields:
+        queryset = queryset.prefetch_related("Ratings")
+    if "Comments" in fields:
+        queryset = queryset.prefetch_related(Prefetch("Comments", queryset=Comment.objects.order_by("id")))
+    return queryset, fields
+
@@ -0,0 +1,298 @@
+import bisect
+import itertools
+import logging
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+from .bulk import chunked
+from .models import Change, Movie
+from .titles import normalize_title
+
+
+_YEAR_SUFFIX = re.compile(r"^(.*\S)\s+((?:18|19|20)\d\d)$")
+_NUMBER = re.compile(r"\d+")
+_ROMAN = re.compile(r"^x{0,3}(ix|iv|v?i{0,3})$")
+# Words that tell sequels and parts apart ("part 2", "chapter two").
+SEQUEL_WORDS = frozenset({"part", "chapter", "episode", "volume", "vol", "returns", "reloaded", "revisited"})
+_EMPTY = array("i")
+# Catalogues up to this size are indexed in the request that needs the index
+# first; bigger ones in the background (no fuzzy matches until it's done).
+SYNCHRONOUS_LOAD_ROWS = 50000
+SYNC_MAX_CHANGES = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def trigrams(key):
+    """Trigrams of a normalized title, padded so short words and word starts count."""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(key, other):
+    """Share of trigrams two normalized titles have in common (0..1)."""
+    grams, other_grams = trigrams(key), trigrams(other)
+    return len(grams & other_grams) / len(grams | other_grams)
+
+
+def split_year(key):
+    """(title, year) of a normalized title ending in a year ("batman begins 2005"), else (key, None)."""
+    match = _YEAR_SUFFIX.match(key)
+    if match is None:
+        return key, None
+    return match.group(1), int(match.group(2))
+
+
+def _short_year(year):
+    """year as kept in the index: 0 (no year) when missing or out of the array's range."""
+    return year if year is not None and 0 < year <= 32767 else 0
+
+
+class TitleIndex:
+    """In-memory trigram index of stored movie titles (title_key) and years.
+
+    Built from the database by load() and kept current by sync(), which
+    applies movie changes from the change feed, so movies inserted by other
+    workers and bulk writers are found too. search() only counts trigrams of
+    titles that share one of the query's rarest trigrams (enough of them
+    that every title over the threshold does), so it looks at few titles
+    even in a large catalogue.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._keys = []
+        self._years = array("h")
+        self._sizes = array("B")
+        self._lock = threading.Lock()
+        self.sequence = 0
+        self._synced_at = time.monotonic()
+
+    def __len__(self):
+        return sum(1 for size in self._sizes if size)
+
+    def load(self):
+        """Index every stored movie; call before the index is used."""
+        # Changes from here on are applied by sync(); applying one twice is harmless.
+        change = Change.objects.order_by("-id").first()
+        self.sequence = change.id if change is not None else 0
+        postings = defaultdict(list)
+        rows = Movie.objects.order_by("id").values_list("id", "title_key", "year_value").iterator(chunk_size=10000)
+        for movie_id, key, year in rows:
+            grams = trigrams(key)
+            grow = movie_id + 1 - len(self._keys)
+            if grow > 0:
+                self._keys.extend([None] * grow)
+                self._years.extend([0] * grow)
+                self._sizes.extend([0] * grow)
+            self._keys[movie_id] = key
+            self._years[movie_id] = _short_year(year)
+            self._sizes[movie_id] = min(len(grams), 255)
+            for gram in grams:
+                postings[gram].append(movie_id)
+        self._postings = {gram: array("i", ids) for gram, ids in postings.items()}
+        return self
+
+    def add(self, movie_id, key, year):
+        """Index (or re-index) a movie."""
+        with self._lock:
+            if movie_id >= len(self._keys):
+                grow = movie_id + 1 - len(self._keys)
+                self._keys.extend([None] * grow)
+                self._years.extend([0] * grow)
+                self._sizes.extend([0] * grow)
+            self._years[movie_id] = _short_year(year)
+            if self._keys[movie_id] == key:
+                return
+            grams = trigrams(key)
+            self._keys[movie_id] = key
+            self._sizes[movie_id] = min(len(grams), 255)
+            for gram in grams:
+                ids = self._postings.get(gram)
+                if ids is None:
+                    ids = self._postings[gram] = array("i")
+                if not ids or ids[-1] < movie_id:
+                    ids.append(movie_id)
+                elif not _contains(ids, movie_id):
+                    ids.insert(bisect.bisect_left(ids, movie_id), movie_id)
+
+    def remove(self, movie_id):
+        with self._lock:
+            if movie_id < len(self._keys):
+                # Postings keep the id; a size of 0 rules it out.
+                self._keys[movie_id] = None
+                self._sizes[movie_id] = 0
+
+    def sync(self, interval=None):
+        """Apply movie changes since the last sync (at most every interval seconds).
+
+        Returns False when the index has to be built again: the change feed
+        went back (database restored or rolled back) or is too far ahead.
+        """
+        interval = settings.FUZZY_INDEX_SYNC_INTERVAL if interval is None else interval
+        if time.monotonic() - self._synced_at < interval:
+            return True
+        self._synced_at = time.monotonic()
+        changes = list(Change.objects.filter(id__gt=self.sequence, kind=Change.MOVIE)
+                       .order_by("id").values_list("id", "object_id")[:SYNC_MAX_CHANGES + 1])
+        if not changes:
+            latest = Change.objects.order_by("-id").values_list("id", flat=True).first() or 0
+            return latest >= self.sequence
+        if len(changes) > SYNC_MAX_CHANGES:
+            # Far behind (f.e. after an import): building again is quicker.
+            return False
+        changed = {movie_id for _, movie_id in changes}
+        for ids in chunked(sorted(changed), 500):
+            rows = Movie.objects.filter(id__in=ids).values_list("id", "title_key", "year_value")
+            for movie_id, key, year in rows:
+                self.add(movie_id, key, year)
+                changed.discard(movie_id)
+        for movie_id in changed:
+            self.remove(movie_id)
+        self.sequence = changes[-1][0]
+        return True
+
+    def search(self, key, year=None, threshold=0.8, limit=5, max_candidates=20000):
+        """Up to limit (movie id, similarity) of indexed titles at least threshold similar
+        to the normalized key (and of year, if given), most similar first.
+
+        Gives up (no matches) when more than max_candidates titles would have to
+        be compared, which only happens for titles made of very common trigrams.
+        """
+        grams = trigrams(key)
+        size = len(grams)
+        need = max(1, math.ceil(threshold * size))
+        with self._lock:
+            postings = sorted((self._postings.get(gram, _EMPTY) for gram in grams), key=len)
+            # A title with `need` of the query's trigrams has one of these.
+            probe, rest = postings[:size - need + 1], postings[size - need + 1:]
+            if sum(len(ids) for ids in probe) > max_candidates:
+                return []
+            counts = Counter(itertools.chain.from_iterable(probe))
+            matches = []
+            for movie_id, count in counts.items():
+                other = self._sizes[movie_id]
+                # similarity can't reach threshold for titles much shorter or longer
+                if not threshold * size <= other <= size / threshold:
+                    continue
+                if year is not None and self._years[movie_id] != year:
+                    continue
+                if count + len(rest) < need:
+                    continue
+                overlap = count + sum(1 for ids in rest if _contains(ids, movie_id))
+                score = overlap / (size + other - overlap)
+                if score >= threshold:
+                    matches.append((movie_id, score))
+        matches.sort(key=lambda match: -match[1])
+        return matches[:limit]
+
+
+def same_work(key, other):
+    """Whether two similar normalized titles may name the same film: as many words,
+    the same numbers (digits or Roman numerals) and sequel words, and no word that
+    is the other's plural ("aliens" isn't "alien")."""
+    words, other_words = key.split(), other.split()
+    if len(words) != len(other_words):
+        return False
+    if _markers(words) != _markers(other_words):
+        return False
+    return not any(word != other_word and (word + "s" == other_word or other_word + "s" == word)
+                   for word, other_word in zip(words, other_words))
+
+
+def _markers(words):
+    return ({word for word in words if word in SEQUEL_WORDS or _ROMAN.match(word)}
+            | set(_NUMBER.findall(" ".join(words))))
+
+
+def _contains(ids, movie_id):
+    position = bisect.bisect_left(ids, movie_id)
+    return position < len(ids) and ids[position] == movie_id
+
+
+_index = None
+_loading = False
+_index_lock = threading.Lock()
+
+
+def get_title_index():
+    """The process-wide TitleIndex kept in sync with the database, or None while it's being built."""
+    global _index, _loading
+    with _index_lock:
+        if _index is not None and _index.sync():
+            return _index
+        _index = None
+        if _loading:
+            return None
+        if Movie.objects.count() <= SYNCHRONOUS_LOAD_ROWS:
+            _index = TitleIndex().load()
+            return _index
+        _loading = True
+    threading.Thread(target=_load_in_background, name="title-index", daemon=True).start()
+    return None
+
+
+def _load_in_background():
+    global _index, _loading
+    try:
+        index = TitleIndex().load()
+    except Exception:
+        logger.exception("Building the title index failed")
+        index = None
+    finally:
+        connection.close()
+    with _index_lock:
+        _index, _loading = index, False
+
+
+def reset_title_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def match_title(title, threshold=None):
+    """Stored Movie whose title is similar to title, or None.
+
+    A trailing year ("Batman Begins (2005)") has to match the movie's year.
+    Titles have to pass same_work(), so sequels aren't mixed up.
+    """
+    threshold = settings.FUZZY_TITLE_THRESHOLD if threshold is None else threshold
+    key = normalize_title(title)
+    if not key:
+        return None
+    index = get_title_index()
+    if index is None:
+        return None
+    name, year = split_year(key)
+    # With a year, only titles of that year (or ending in it, "Blade Runner 2049").
+    queries = [(key, None)] + ([(name, year)] if year is not None else [])
+    candidates = {}
+    for query, query_year in queries:
+        for movie_id, score in index.search(query, query_year, threshold):
+            if score > candidates.get(movie_id, (0, None))[0]:
+                candidates[movie_id] = (score, query)
+    if not candidates:
+        return None
+
+    best, best_score = None, threshold
+    # The index may lag behind the database; check the stored titles.
+    for movie in Movie.objects.filter(id__in=list(candidates)):
+        query = candidates[movie.id][1]
+        if not same_work(query, movie.title_key):
+            continue
+        if query != key and movie.year_value != year:
+            continue
+        if query == key and year is not None and split_year(movie.title_key)[1] != year:
+            continue
+        score = similarity(query, movie.title_key)
+        if score >= best_score and (best is None or score > best_score or movie.id < best.id):
+            best, best_score = movie, score
+    return best
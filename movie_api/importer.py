@@ -0,0 +1,165 @@
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import connections, transaction
+from rest_framework.exceptions import ValidationError
+
+from .bulk import bulk_create_movies, bulk_update_movies, chunked
+from .models import Movie
+from .serializers import MovieSerializer
+
+
+def parse_lines(batch):
+    """MovieSerializer.validated_data of every JSON line in batch (None for invalid records).
+
+    Doesn't touch the database, so it also runs in worker processes.
+    """
+    lines, offset, line_number = batch
+    # One serializer for the whole batch: DRF builds a serializer's fields on first
+    # use, which costs more than validating a record.
+    serializer = MovieSerializer()
+    records = []
+    for line in lines:
+        try:
+            data = json.loads(line)
+        except ValueError:
+            records.append(None)
+            continue
+        if not isinstance(data, dict) or data.get("Response", "True") != "True" or not data.get("imdbID"):
+            records.append(None)
+            continue
+        try:
+            records.append(serializer.run_validation(data))
+        except ValidationError:
+            records.append(None)
+    return records, offset, line_number
+
+
+def _init_worker():
+    # Processes started with "spawn" (macOS, Windows) come up without Django.
+    import django
+    django.setup()
+
+
+def open_source(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+class MovieImporter:
+    """Imports OMDb-shaped movies from a JSON Lines file (optionally gzipped), one movie per line.
+
+    The file is read line by line in chunks of chunk_size; records are
+    validated like POST /api/movies answers (in workers processes when more
+    than one) and every chunk is upserted by imdbID in one transaction: new
+    movies with bulk INSERTs, stored ones with only what changed. After each
+    chunk the position in the file is written to the checkpoint file, so an
+    interrupted import resumes where it stopped.
+    """
+
+    def __init__(self, path, chunk_size=1000, workers=1, checkpoint=None, progress=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.checkpoint = checkpoint or path + ".checkpoint"
+        self.progress = progress
+
+    def run(self, resume=True):
+        """Import the file; return counts of lines read, created, updated, unchanged and invalid
+        records, and the time taken (of this run only)."""
+        position = self.load_checkpoint() if resume else None
+        offset, line_number = (position["offset"], position["line"]) if position else (0, 0)
+        stats = Counter(position["stats"] if position else {})
+        started = time.monotonic()
+        imported = 0
+        for records, offset, line_number in self.parse(self.read(offset, line_number)):
+            self.write(records, stats)
+            imported += len(records)
+            self.save_checkpoint(offset, line_number, stats)
+            if self.progress is not None:
+                self.progress(line_number, imported / max(time.monotonic() - started, 1e-9))
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        elapsed = time.monotonic() - started
+        stats["lines"] = line_number
+        stats["seconds"] = round(elapsed, 1)
+        stats["rows_per_second"] = round(imported / max(elapsed, 1e-9))
+        return stats
+
+    def read(self, offset, line_number):
+        """Chunks of (lines, offset after them, number of the last line), starting at offset."""
+        with open_source(self.path) as source:
+            source.seek(offset)
+            lines = []
+            for line in source:
+                offset += len(line)
+                line_number += 1
+                if line.strip():
+                    lines.append(line)
+                if len(lines) >= self.chunk_size:
+                    yield lines, offset, line_number
+                    lines = []
+            yield lines, offset, line_number
+
+    def parse(self, batches):
+        if self.workers <= 1:
+            yield from map(parse_lines, batches)
+            return
+        # Workers mustn't inherit open database connections.
+        connections.close_all()
+        with multiprocessing.Pool(self.workers, initializer=_init_worker) as pool:
+            pending = deque()
+            for batch in batches:
+                pending.append(pool.apply_async(parse_lines, (batch,)))
+                # Only a few chunks in flight, the file is never read ahead into memory.
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+    def write(self, records, stats):
+        """Upsert the valid records by imdbID (the last of duplicates wins)."""
+        latest = {}
+        for data in records:
+            if data is None:
+                stats["invalid"] += 1
+            else:
+                latest[data["imdbID"]] = data
+        batch_size = settings.MOVIE_BULK_CHUNK_SIZE
+        with transaction.atomic():
+            stored = {}
+            for imdb_ids in chunked(list(latest), batch_size):
+                stored.update((movie.imdbID, movie) for movie in Movie.objects.filter(imdbID__in=imdb_ids))
+            new = [data for imdb_id, data in latest.items() if imdb_id not in stored]
+            bulk_create_movies(new, chunk_size=batch_size, fetched=False)
+            updated = 0
+            for movies in chunked(list(stored.values()), batch_size):
+                updated += len(bulk_update_movies([(movie, latest[movie.imdbID]) for movie in movies]))
+        stats["created"] += len(new)
+        stats["updated"] += updated
+        stats["unchanged"] += len(stored) - updated
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint) as checkpoint:
+                position = json.load(checkpoint)
+        except FileNotFoundError:
+            return None
+        if position.get("path") != os.path.abspath(self.path):
+            return None
+        return position
+
+    def save_checkpoint(self, offset, line_number, stats):
+        # Chunks are committed before the checkpoint moves past them; upserts being
+        # idempotent, a chunk written again after a crash changes nothing.
+        position = {"path": os.path.abspath(self.path), "offset": offset, "line": line_number, "stats": stats}
+        temporary = self.checkpoint + ".tmp"
+        with open(temporary, "w") as checkpoint:
+            json.dump(position, checkpoint)
+        os.replace(temporary, self.checkpoint)
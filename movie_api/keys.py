@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .omdb import OmdbError
+from .ratelimit import TokenBucket
+from .usage import calls_today, exhaust_calls, record_calls, reserve_calls, today, usage_today
+
+
+class KeysExhausted(OmdbError):
+    """No OMDb API key can make a call now; retry_after tells when one may again (seconds)."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class ApiKey:
+
+    def __init__(self, value, rate, daily_limit, clock):
+        self.value = value
+        # Usage rows are named by a hash, the key itself doesn't go to the database.
+        self.name = "key:" + hashlib.sha1(value.encode("utf-8")).hexdigest()[:12]
+        self.bucket = TokenBucket(rate, clock=clock)
+        self.daily_limit = daily_limit
+        self.day = None
+        self.allowance = 0       # calls reserved in the database and not made yet
+        self.quota_used = 0      # calls reserved by all workers as of our last reservation
+        self.made = 0            # calls made here and not recorded in the database yet
+        self.exhausted = False
+        self.quarantined_until = 0
+
+    def load(self):
+        return self.quota_used - self.allowance
+
+
+class KeyPool:
+    """OMDb API keys with per-second token buckets and a shared daily quota.
+
+    Daily usage is counted in the database (UpstreamUsage), shared by all
+    workers: calls are reserved in blocks of reserve_block, and the calls
+    actually made are recorded with the next reservation, so most calls
+    don't touch the database. Calls go to the least used key that has a
+    token. A key is taken out when OMDb rejects it: for the rest of the day
+    on "Request limit reached!", for quarantine seconds otherwise (401).
+
+    Only reserve() and persist_exhausted() touch the database, so code that
+    fans out to threads should reserve() the calls it needs first.
+    """
+
+    def __init__(self, keys, rate=10, daily_limit=1000, quarantine=3600, reserve_block=10, max_wait=1.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.keys = [ApiKey(value, rate, daily_limit, clock) for value in dict.fromkeys(keys)]
+        self.quarantine_seconds = quarantine
+        self.reserve_block = reserve_block
+        self.max_wait = max_wait
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._reserve_lock = threading.Lock()
+
+    def _usable(self, key, now, day):
+        if key.day != day:
+            key.day, key.allowance, key.quota_used, key.exhausted = day, 0, 0, False
+        return not key.exhausted and key.quarantined_until <= now
+
+    def try_acquire(self):
+        """Take one call of a key without waiting or touching the database.
+
+        Returns (key, 0); (None, seconds) when keys with reserved calls are
+        out of tokens for that long; (None, None) when no usable key has
+        reserved calls left.
+        """
+        now, day = self._clock(), today()
+        with self._lock:
+            keys = sorted((key for key in self.keys if self._usable(key, now, day) and key.allowance > 0),
+                          key=ApiKey.load)
+            for key in keys:
+                if key.bucket.try_acquire():
+                    key.allowance -= 1
+                    key.made += 1
+                    return key, 0
+            if not keys:
+                return None, None
+            return None, min(key.bucket.wait_time() for key in keys)
+
+    def reserve(self, count=None):
+        """Make sure this worker has count calls reserved (reserve_block per key by default),
+        spread over the least used keys.
+
+        Returns how many calls are reserved now (0: the daily quota of every key is used up).
+        """
+        # One reservation at a time: callers that waited usually find their calls reserved already.
+        with self._reserve_lock:
+            self.record_usage()
+            now, day = self._clock(), today()
+            with self._lock:
+                keys = sorted((key for key in self.keys if self._usable(key, now, day)), key=ApiKey.load)
+            count = count or self.reserve_block * len(keys)
+            reserved = 0
+            for position, key in enumerate(keys):
+                share = max(self.reserve_block, -(-(count - reserved) // (len(keys) - position)))
+                wanted = share - key.allowance
+                if wanted > 0:
+                    got = reserve_calls(key.name, wanted, key.daily_limit)
+                    quota_used = calls_today(key.name)
+                    with self._lock:
+                        key.allowance += got
+                        key.quota_used = quota_used
+                        if not key.allowance:
+                            key.exhausted = True
+                reserved += key.allowance
+                if reserved >= count:
+                    break
+            return reserved
+
+    def record_usage(self):
+        """Record the calls made with each key since the last time in the database (UpstreamUsage.used)."""
+        with self._lock:
+            made = [(key, key.made) for key in self.keys if key.made]
+            for key, count in made:
+                key.made = 0
+        for key, count in made:
+            record_calls(key.name, count)
+
+    def acquire(self):
+        """Take one call of a key, reserving more calls or waiting for a token (up to max_wait) if needed."""
+        deadline = self._clock() + self.max_wait
+        while True:
+            key, wait = self.try_acquire()
+            if key is not None:
+                return key
+            if wait is None:
+                if not self.reserve():
+                    raise self.exhausted_error()
+                continue
+            if self._clock() + wait > deadline:
+                raise KeysExhausted("All OMDb API keys are at their rate limit", wait)
+            self._sleep(wait)
+
+    async def acquire_async(self, run_in_thread):
+        """acquire() for coroutines: reservations run through run_in_thread(fn), waits don't block the loop."""
+        deadline = self._clock() + self.max_wait
+        while True:
+            key, wait = self.try_acquire()
+            if key is not None:
+                return key
+            if wait is None:
+                if not await run_in_thread(self.reserve):
+                    raise self.exhausted_error()
+                continue
+            if self._clock() + wait > deadline:
+                raise KeysExhausted("All OMDb API keys are at their rate limit", wait)
+            await asyncio.sleep(wait)
+
+    def rejected(self, key, answer):
+        """OMDb answered 401 to key. Returns True when it was the daily limit; persist that with persist_exhausted."""
+        error = answer.get("Error", "") if isinstance(answer, dict) else ""
+        with self._lock:
+            key.allowance = 0
+            if "limit" in error.lower():
+                key.exhausted = True
+                return True
+            key.quarantined_until = self._clock() + self.quarantine_seconds
+            return False
+
+    def persist_exhausted(self, key):
+        """Tell the other workers OMDb refuses key for the rest of the day."""
+        exhaust_calls(key.name, key.daily_limit)
+
+    def exhausted_error(self):
+        now = self._clock()
+        quarantined = [key.quarantined_until - now for key in self.keys
+                       if not key.exhausted and key.quarantined_until > now]
+        if quarantined:
+            return KeysExhausted("All OMDb API keys are rejected by OMDb", min(quarantined))
+        return KeysExhausted("Daily quota of all OMDb API keys is used up", _seconds_to_next_day())
+
+    def status(self):
+        """Usage of every key (by its usage name) for monitoring: calls made and quota
+        reserved today by all workers, calls reserved by this one and not made yet."""
+        self.record_usage()
+        usage = {key.name: usage_today(key.name) for key in self.keys}
+        now, day = self._clock(), today()
+        with self._lock:
+            return [{"name": key.name, "calls_today": usage[key.name][1], "quota_used_today": usage[key.name][0],
+                     "daily_limit": key.daily_limit, "reserved": key.allowance if key.day == day else 0,
+                     "exhausted": key.exhausted and key.day == day,
+                     "quarantined": key.quarantined_until > now} for key in self.keys]
+
+
+def _seconds_to_next_day():
+    now = timezone.now()
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=now.tzinfo)
+    return (tomorrow - now).total_seconds()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool():
+    """Return the KeyPool of this worker, configured from settings."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = KeyPool(
+                settings.OMDB_API_KEYS,
+                rate=settings.OMDB_KEY_RATE,
+                daily_limit=settings.OMDB_KEY_DAILY_LIMIT,
+                quarantine=settings.OMDB_KEY_QUARANTINE,
+                reserve_block=settings.OMDB_KEY_RESERVE_BLOCK,
+                max_wait=settings.OMDB_KEY_MAX_WAIT,
+            )
+        return _pool
+
+
+@receiver(setting_changed)
+def reset_key_pool(setting, **kwargs):
+    global _pool
+    if setting.startswith("OMDB_"):
+        with _pool_lock:
+            _pool = None
@@ -0,0 +1,41 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movie_api.exporter import available_formats, CatalogExporter
+
+
+class Command(BaseCommand):
+    help = ("Export stored movies with their ratings and comments to an NDJSON, CSV or (with pyarrow) "
+            "Parquet file; .gz file names are gzipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=available_formats(), help="default: from the file name, else ndjson")
+        parser.add_argument("--since-id", type=int, default=0, help="export only movies with a higher id")
+        parser.add_argument("--state", help="JSON file with the last exported id; export only newer movies "
+                                            "and update it (incremental snapshots)")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument("--no-comments", action="store_true", help="leave comments out")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        name = path[:-3] if path.endswith(".gz") else path
+        fmt = options["format"] or next((fmt for fmt in available_formats() if name.endswith("." + fmt)), "ndjson")
+        since_id = options["since_id"]
+        state = options["state"]
+        if state and os.path.exists(state):
+            with open(state) as state_file:
+                since_id = max(since_id, json.load(state_file)["last_id"])
+        try:
+            exporter = CatalogExporter(path, fmt, since_id=since_id, chunk_size=options["chunk_size"],
+                                       comments=not options["no_comments"])
+        except ValueError as error:
+            raise CommandError(str(error))
+        stats = exporter.run()
+        if state:
+            with open(state, "w") as state_file:
+                json.dump({"last_id": stats["last_id"]}, state_file)
+        self.stdout.write(f"Exported {stats['movies']} movies (last id {stats['last_id']}) to {path} "
+                          f"in {stats['seconds']:.1f} s: {stats['rows_per_second']} rows/s, {stats['bytes']} bytes.")
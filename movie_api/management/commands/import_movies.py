@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from movie_api.importer import MovieImporter
+
+
+class Command(BaseCommand):
+    help = ("Import OMDb-shaped movies from a JSON Lines file (.jsonl or .jsonl.gz, one movie per line), "
+            "creating new movies and updating stored ones by imdbID. Resumes an interrupted import.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--workers", type=int, default=1, help="processes validating records")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="records written per transaction")
+        parser.add_argument("--checkpoint", help="progress file (default: PATH.checkpoint)")
+        parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the top")
+
+    def handle(self, *args, **options):
+        last_report = [0.0]
+
+        def progress(line_number, rate):
+            if time.monotonic() - last_report[0] >= 5:
+                last_report[0] = time.monotonic()
+                self.stdout.write(f"line {line_number}: {rate:.0f} rows/s")
+
+        importer = MovieImporter(options["path"], chunk_size=options["chunk_size"], workers=options["workers"],
+                                 checkpoint=options["checkpoint"], progress=progress)
+        stats = importer.run(resume=not options["restart"])
+        seconds, rate = stats.pop("seconds"), stats.pop("rows_per_second")
+        summary = ", ".join(f"{key}: {value}" for key, value in sorted(stats.items()))
+        self.stdout.write(f"Imported movies in {seconds:.1f} s, {rate} rows/s ({summary}).")
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from movie_api.changes import prune_changes
+
+
+class Command(BaseCommand):
+    help = ("Delete change feed entries older than CHANGE_FEED_RETENTION_DAYS that consumers don't need: "
+            "changes followed by a later one of the same object, and deletions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None,
+                            help="keep this many days instead of CHANGE_FEED_RETENTION_DAYS")
+
+    def handle(self, *args, **options):
+        days = settings.CHANGE_FEED_RETENTION_DAYS if options["days"] is None else options["days"]
+        deleted = prune_changes(timezone.now() - timedelta(days=days))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} changes older than {days} days."))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from movie_api.bulk import refresh_payloads
+from movie_api.models import Movie
+from movie_api.payloads import check_payloads
+from movie_api.response_cache import bump_version, MOVIES
+
+
+class Command(BaseCommand):
+    help = "Render the stored listing JSON (Movie.payload) of every movie again, or check it with --check."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true",
+                            help="only compare stored payloads with the serializer output; fail on differences")
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options["check"]:
+            stale = check_payloads(options["chunk_size"])
+            if stale:
+                shown = ", ".join(map(str, stale[:10])) + (", ..." if len(stale) > 10 else "")
+                raise CommandError(f"{len(stale)} movie payloads differ from the serializer output (ids {shown}); "
+                                   f"run rebuild_movie_payloads.")
+            self.stdout.write(self.style.SUCCESS("Every movie payload matches the serializer output."))
+            return
+
+        rebuilt, last = 0, 0
+        while True:
+            ids = list(Movie.objects.filter(id__gt=last).order_by("id").values_list("id", flat=True)[:options["chunk_size"]])
+            if not ids:
+                break
+            with transaction.atomic():
+                refresh_payloads(ids)
+            rebuilt += len(ids)
+            last = ids[-1]
+        bump_version(MOVIES)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {rebuilt} movie payloads in {time.monotonic() - started:.1f} s."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from movie_api.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text index used by GET /api/movies/search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        kind = rebuild_index(connections[options["database"]])
+        if kind is None:
+            self.stdout.write("This database has no text index; search scans the movie table.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Search index rebuilt ({kind})."))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from movie_api.refresh import MovieRefresher
+
+
+class Command(BaseCommand):
+    help = ("Re-fetch stale movies from OMDb (most popular first) and save what changed, "
+            "within MOVIE_REFRESH_DAILY_QUOTA calls a day.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="refresh at most this many movies per round")
+        parser.add_argument("--loop", action="store_true", help="keep running, one round every --interval seconds")
+        parser.add_argument("--interval", type=float, default=600)
+
+    def handle(self, *args, **options):
+        refresher = MovieRefresher()
+        while True:
+            started = time.monotonic()
+            stats = refresher.run(limit=options["limit"])
+            elapsed = time.monotonic() - started
+            summary = ", ".join(f"{key}: {value}" for key, value in sorted(stats.items())) or "nothing stale"
+            self.stdout.write(f"Refreshed movies in {elapsed:.1f} s ({summary}).")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,261 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._samples(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Take a total counted elsewhere (from a collector)."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self, key, value):
+        return [f"{self.name}{self._label_text(key)} {_number(value)}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self, key, value):
+        return [f"{self.name}{self._label_text(key)} {_number(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # per-bucket counts (last one: above every bucket), sum
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def _samples(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _number(bound)
+            lines.append(f"{self.name}_bucket{self._label_text(key, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_number(total)}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = []
+# Functions render() calls first, to set gauges of state kept elsewhere.
+COLLECTORS = []
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNTS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to answer a request.", SECONDS, ("route", "method"))
+RESPONSE_BYTES = Histogram("http_response_size_bytes", "Size of response bodies (streamed ones not included).",
+                           (100, 1000, 10000, 100000, 1000000, 10000000), ("route",))
+DB_QUERIES = Histogram("http_request_db_queries", "SQL queries made by a request.", COUNTS, ("route",))
+DB_SECONDS = Histogram("http_request_db_duration_seconds", "Time a request spent in SQL queries.", SECONDS, ("route",))
+UPSTREAM_SECONDS = Histogram("http_request_omdb_duration_seconds", "Time a request spent waiting for OMDb.",
+                             SECONDS, ("route",))
+SERIALIZE_SECONDS = Histogram("http_request_serialize_duration_seconds", "Time a request spent in serializers.",
+                              SECONDS, ("route",))
+OMDB_CALLS = Counter("omdb_requests_total", "HTTP calls to OMDb by outcome (status code or error).", ("outcome",))
+OMDB_SECONDS = Histogram("omdb_request_duration_seconds", "Duration of HTTP calls to OMDb.", SECONDS)
+
+
+class RequestTimings:
+    """What one request spent its time on (seconds)."""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+def observe_omdb_call(seconds, outcome):
+    """OMDb client hook: one HTTP call to OMDb took seconds and ended with outcome."""
+    OMDB_CALLS.inc(outcome=outcome)
+    OMDB_SECONDS.observe(seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.upstream_calls += 1
+        timings.upstream_seconds += seconds
+
+
+@contextmanager
+def serializing():
+    """Count the time of the block as serialization of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serialize_seconds += time.perf_counter() - started
+
+
+# WSGI environ key of (perf_counter() start, RequestTimings) of work done on a
+# request before it reached Django (the OMDb lookup in ASGI mode).
+EARLIER_TIMINGS = "movie_api.request_timings"
+
+
+@contextmanager
+def track_request(timings=None):
+    """Collect RequestTimings of the code (and its SQL queries on this thread) in the block,
+    adding to timings when given."""
+    timings = timings or RequestTimings()
+    token = _current.set(timings)
+    try:
+        with counting_queries():
+            yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def counting_queries():
+    """Count the SQL queries of this thread in the current request's timings. For code
+    run on other threads with the request's context (contextvars.copy_context())."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with ExitStack() as stack:
+        # Every database: reads of GET requests go to replicas.
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timings.execute_wrapper))
+        yield
+
+
+def observe_request(timings, route, method, status, seconds, size=None):
+    REQUESTS.inc(route=route, method=method, status=status)
+    REQUEST_SECONDS.observe(seconds, route=route, method=method)
+    DB_QUERIES.observe(timings.db_queries, route=route)
+    DB_SECONDS.observe(timings.db_seconds, route=route)
+    UPSTREAM_SECONDS.observe(timings.upstream_seconds, route=route)
+    SERIALIZE_SECONDS.observe(timings.serialize_seconds, route=route)
+    if size is not None:
+        RESPONSE_BYTES.observe(size, route=route)
+
+
+def server_timing(timings, seconds):
+    """Server-Timing header value for a request."""
+    return ", ".join([
+        f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.db_queries} queries"',
+        f'omdb;dur={timings.upstream_seconds * 1000:.1f};desc="{timings.upstream_calls} calls"',
+        f"serialize;dur={timings.serialize_seconds * 1000:.1f}",
+        f"total;dur={seconds * 1000:.1f}",
+    ])
+
+
+class MetricsMiddleware:
+    """Records time, SQL queries, OMDb calls, serialization and response size of every
+    request in the metrics served by /metrics; with METRICS_SERVER_TIMING also sends
+    them to the client in a Server-Timing header."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started, timings = request.META.get(EARLIER_TIMINGS, (time.perf_counter(), None))
+        with track_request(timings) as timings:
+            response = self.get_response(request)
+        seconds = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        route = match.url_name if match is not None and match.url_name else "unmatched"
+        size = None if response.streaming else len(response.content)
+        observe_request(timings, route, request.method, response.status_code, seconds, size)
+        if settings.METRICS_SERVER_TIMING:
+            response["Server-Timing"] = server_timing(timings, seconds)
+        return response
+
+
+def render():
+    """All metrics in Prometheus text format."""
+    for collect in COLLECTORS:
+        collect()
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+def metrics_view(request):
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,25 @@
+# Generated by Django 2.0.8 on 2026-10-18 08:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LookupLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('token', models.CharField(max_length=32)),
+                ('expires_at', models.DateTimeField()),
+                ('completed', models.BooleanField(default=False)),
+                ('movie', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='movie_api.Movie')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.8 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0002_lookuplease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='title_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='imdbID',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
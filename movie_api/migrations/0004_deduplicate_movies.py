@@ -0,0 +1,33 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+from movie_api.titles import normalize_title
+
+
+def deduplicate_movies(apps, schema_editor):
+    """Fill title_key and merge movies stored more than once under the same imdbID
+    (kept: the oldest row; comments of the others are moved to it)."""
+    Movie = apps.get_model('movie_api', 'Movie')
+    Comment = apps.get_model('movie_api', 'Comment')
+
+    Movie.objects.filter(imdbID='').update(imdbID=None)
+    for movie in Movie.objects.only('id', 'Title').iterator():
+        Movie.objects.filter(id=movie.id).update(title_key=normalize_title(movie.Title)[:100])
+
+    duplicated = (Movie.objects.exclude(imdbID=None).values('imdbID')
+                  .annotate(copies=Count('id'), keep_id=Min('id')).filter(copies__gt=1))
+    for row in duplicated:
+        copies = Movie.objects.filter(imdbID=row['imdbID']).exclude(id=row['keep_id'])
+        Comment.objects.filter(movie_id__in=copies).update(movie_id=row['keep_id'])
+        copies.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0003_movie_title_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_movies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.8 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0004_deduplicate_movies'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movie',
+            name='imdbID',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.0.13 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0005_unique_imdbid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='box_office_value',
+            field=models.BigIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='imdb_rating_value',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='imdb_votes_value',
+            field=models.IntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='metascore_value',
+            field=models.IntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='year_value',
+            field=models.IntegerField(db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+from movie_api.parsing import parse_number
+
+
+def backfill_numeric_columns(apps, schema_editor):
+    Movie = apps.get_model('movie_api', 'Movie')
+    fields = ('id', 'Year', 'imdbRating', 'imdbVotes', 'Metascore', 'BoxOffice')
+    for movie in Movie.objects.only(*fields).iterator():
+        Movie.objects.filter(id=movie.id).update(
+            year_value=parse_number(movie.Year),
+            imdb_rating_value=parse_number(movie.imdbRating, float),
+            imdb_votes_value=parse_number(movie.imdbVotes),
+            metascore_value=parse_number(movie.Metascore),
+            box_office_value=parse_number(movie.BoxOffice),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0006_movie_numeric_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_numeric_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from movie_api.search import install_index, rebuild_index, drop_index
+
+
+def create_search_index(apps, schema_editor):
+    install_index(schema_editor.connection)
+    rebuild_index(schema_editor.connection)
+
+
+def remove_search_index(apps, schema_editor):
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0007_backfill_numeric_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.0.13 on 2026-10-18 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0009_tableversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpstreamUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('name', models.CharField(max_length=100)),
+                ('calls', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='fetched_at',
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='upstreamusage',
+            unique_together={('day', 'name')},
+        ),
+    ]
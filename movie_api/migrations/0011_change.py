@@ -0,0 +1,37 @@
+# Generated by Django 2.0.13 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+def record_existing_rows(apps, schema_editor):
+    # The feed starts with every stored row, so consumers can sync from since=0.
+    Change = apps.get_model('movie_api', 'Change')
+    for kind, model in (('movie', 'Movie'), ('comment', 'Comment')):
+        ids = apps.get_model('movie_api', model).objects.order_by('id').values_list('id', flat=True)
+        batch = []
+        for pk in ids.iterator():
+            batch.append(Change(kind=kind, object_id=pk))
+            if len(batch) == 1000:
+                Change.objects.bulk_create(batch)
+                batch = []
+        Change.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0010_movie_fetched_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.RunPython(record_existing_rows, migrations.RunPython.noop),
+    ]
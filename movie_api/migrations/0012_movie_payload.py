@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0011_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='payload',
+            field=models.TextField(editable=False, null=True),
+        ),
+    ]
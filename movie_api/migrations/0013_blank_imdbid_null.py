@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def blank_imdbid_null(apps, schema_editor):
+    """Movies saved with a blank imdbID since 0004 get NULL, like the rest."""
+    Movie = apps.get_model('movie_api', 'Movie')
+    Movie.objects.filter(imdbID='').update(imdbID=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0012_movie_payload'),
+    ]
+
+    operations = [
+        migrations.RunPython(blank_imdbid_null, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+from movie_api.search import reinstall_triggers
+
+
+def update_search_triggers(apps, schema_editor):
+    """The update trigger fires for the indexed columns only (not fetched_at, payload)."""
+    reinstall_triggers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0013_blank_imdbid_null'),
+    ]
+
+    operations = [
+        migrations.RunPython(update_search_triggers, migrations.RunPython.noop),
+    ]
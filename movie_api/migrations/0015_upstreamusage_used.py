@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0014_search_update_trigger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upstreamusage',
+            name='used',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:43
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_api', '0015_upstreamusage_used'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='change',
+            name='at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AlterIndexTogether(
+            name='change',
+            index_together={('kind', 'object_id')},
+        ),
+    ]
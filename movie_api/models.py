@@ -2,6 +2,10 @@ from django.db import models
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .parsing import parse_number
+from .titles import normalize_title
 
 
 class Movie(models.Model):
@@ -22,16 +26,43 @@ class Movie(models.Model):
     Metascore = models.CharField(max_length=100)
     imdbRating = models.CharField(max_length=100)
     imdbVotes = models.CharField(max_length=100)
-    imdbID = models.CharField(max_length=100)
+    imdbID = models.CharField(max_length=100, unique=True, null=True, blank=True)
     Type = models.CharField(max_length=100)
     DVD = models.CharField(max_length=100)
     BoxOffice = models.CharField(max_length=100)
     Production = models.CharField(max_length=100)
     Website = models.CharField(max_length=100)
 
+    # Derived columns, kept out of the API. Filled by fill_derived_fields().
+    title_key = models.CharField(max_length=100, db_index=True, editable=False, default="")
+    year_value = models.IntegerField(null=True, db_index=True, editable=False)
+    imdb_rating_value = models.FloatField(null=True, db_index=True, editable=False)
+    imdb_votes_value = models.IntegerField(null=True, db_index=True, editable=False)
+    metascore_value = models.IntegerField(null=True, db_index=True, editable=False)
+    box_office_value = models.BigIntegerField(null=True, db_index=True, editable=False)
+    # Last time the row was fetched from OMDb (NULL: unknown), for the background refresh.
+    fetched_at = models.DateTimeField(null=True, db_index=True, editable=False)
+    # The movie's JSON in listings (with Ratings), kept current by the writers (see payloads.py).
+    payload = models.TextField(null=True, editable=False)
+
     def __str__(self):
         return f"{self.Title} (id: {self.id})"
 
+    def fill_derived_fields(self):
+        """Compute derived columns; bulk_create() skips save(), so bulk writers call this themselves."""
+        # Blank imdbIDs are stored as NULL: the column is unique, NULL isn't.
+        self.imdbID = self.imdbID or None
+        self.title_key = normalize_title(self.Title)[:100]
+        self.year_value = parse_number(self.Year)
+        self.imdb_rating_value = parse_number(self.imdbRating, float)
+        self.imdb_votes_value = parse_number(self.imdbVotes)
+        self.metascore_value = parse_number(self.Metascore)
+        self.box_office_value = parse_number(self.BoxOffice)
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
+        super().save(*args, **kwargs)
+
 
 class Rating(models.Model):
     Source = models.CharField(max_length=100)
@@ -49,3 +80,59 @@ class Comment(models.Model):
 
     def __str__(self):
         return f" Comment for {self.movie_id} (id: {self.movie_id.id}): {self.comment_body}"
+
+
+class LookupLease(models.Model):
+    """Cross-worker lease on one in-flight OMDb lookup. After the lookup
+    finishes the row keeps its result for a few seconds so waiting workers can reuse it."""
+    key = models.CharField(max_length=40, unique=True)
+    token = models.CharField(max_length=32)
+    expires_at = models.DateTimeField()
+    completed = models.BooleanField(default=False)
+    movie = models.ForeignKey(Movie, null=True, on_delete=models.SET_NULL, related_name="+")
+
+    def __str__(self):
+        return f"Lookup lease {self.key} (completed: {self.completed})"
+
+
+class TableVersion(models.Model):
+    """Version of a group of tables ("movies", "comments"), replaced by a new
+    random token on every write; keys cached responses and their ETags."""
+    table = models.CharField(max_length=30, unique=True)
+    version = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f"{self.table} version {self.version}"
+
+
+class UpstreamUsage(models.Model):
+    """OMDb calls of one day by one consumer (the refresher, an API key): calls
+    reserved against its daily quota, and the calls actually made (used)."""
+    day = models.DateField()
+    name = models.CharField(max_length=100)
+    calls = models.PositiveIntegerField(default=0)
+    used = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("day", "name")
+
+    def __str__(self):
+        return f"{self.name} on {self.day}: {self.used} calls made, {self.calls} reserved"
+
+
+class Change(models.Model):
+    """One write to a movie (or its ratings) or a comment. Ids number the
+    writes in order; GET /api/changes serves them as a change feed."""
+    MOVIE = "movie"
+    COMMENT = "comment"
+
+    kind = models.CharField(max_length=10)
+    object_id = models.IntegerField()
+    deleted = models.BooleanField(default=False)
+    at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        index_together = ("kind", "object_id")
+
+    def __str__(self):
+        return f"Change {self.id}: {self.kind} {self.object_id}{' deleted' if self.deleted else ''}"
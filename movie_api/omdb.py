@@ -0,0 +1,161 @@
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class OmdbError(Exception):
+    """OMDb could not be reached or didn't give a usable answer."""
+
+
+class OmdbClient:
+    """Keep-alive client for omdbapi.com.
+
+    One pooled requests.Session is shared by all threads of a worker. Every
+    call has connect/read timeouts and is retried a bounded number of times
+    (any requests error, 429 and 5xx) with jittered exponential backoff.
+
+    With a key_pool (keys.KeyPool) every call takes a key from the pool instead
+    of api_key, and a key OMDb rejects (401) is replaced by another one.
+    Every HTTP call is reported to hooks as hook(seconds, outcome), the
+    outcome being the status code or "error".
+
+    With a breaker (breaker.CircuitBreaker) every call, retries included,
+    first asks it for permission (raising CircuitOpen while OMDb is down)
+    and reports its outcome to it.
+    """
+
+    def __init__(self, api_key, url='http://www.omdbapi.com/', connect_timeout=3.05, read_timeout=5,
+                 max_retries=2, backoff=0.2, pool_size=10, key_pool=None, hooks=(), breaker=None):
+        self.api_key = api_key
+        self.key_pool = key_pool
+        self.hooks = tuple(hooks)
+        self.breaker = breaker
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_movie(self, title):
+        """Return OMDb's parsed answer for title (with "Response": "True" or "False")."""
+        return self._get({"t": title, "type": "movie"})
+
+    def get_movie_by_id(self, imdb_id):
+        """Return OMDb's parsed answer for the movie with imdb_id."""
+        return self._get({"i": imdb_id})
+
+    def _get(self, params):
+        attempt = 0
+        while True:
+            probe = self.breaker.before_call() if self.breaker is not None else False
+            try:
+                key = self.key_pool.acquire() if self.key_pool is not None else None
+            except Exception:
+                # No call is made; let another one probe.
+                if probe:
+                    self.breaker.cancel_probe()
+                raise
+            params["apikey"] = key.value if key is not None else self.api_key
+            started = time.perf_counter()
+            try:
+                response = self.session.get(self.url, params=params, timeout=self.timeout)
+            except requests.RequestException as exc:
+                self._report(started, "error", probe)
+                error = OmdbError(f"OMDb request failed: {exc}")
+            except Exception:
+                # The breaker hears of it all the same (a probe mustn't stay taken).
+                self._report(started, "error", probe)
+                raise
+            else:
+                self._report(started, response.status_code, probe)
+                if response.status_code == 401 and key is not None:
+                    if self.key_pool.rejected(key, self._answer(response)):
+                        self.key_pool.persist_exhausted(key)
+                    # Again with another key (acquire() raises KeysExhausted when none is
+                    # left), without backoff but within the retries.
+                    if attempt >= self.max_retries:
+                        raise OmdbError("OMDb rejected the API keys")
+                    attempt += 1
+                    continue
+                if response.status_code not in RETRY_STATUSES:
+                    return self._parse(response)
+                error = OmdbError(f"OMDb answered with status {response.status_code}")
+                response.close()
+
+            if attempt >= self.max_retries:
+                raise error
+            attempt += 1
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def _parse(self, response):
+        if response.status_code != requests.codes.ok:
+            raise OmdbError(f"OMDb answered with status {response.status_code}")
+        try:
+            return response.json()
+        except ValueError:
+            raise OmdbError("OMDb answered with invalid JSON")
+
+    def _report(self, started, outcome, probe):
+        seconds = time.perf_counter() - started
+        for hook in self.hooks:
+            hook(seconds, outcome)
+        if self.breaker is not None:
+            self.breaker.record(seconds, outcome, probe)
+
+    def _answer(self, response):
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the OmdbClient of this worker, configured from settings."""
+    from .breaker import get_breaker
+    from .keys import get_key_pool
+    from .metrics import observe_omdb_call
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OmdbClient(
+                api_key=settings.OMDB_API_KEY,
+                url=settings.OMDB_API_URL,
+                connect_timeout=settings.OMDB_CONNECT_TIMEOUT,
+                read_timeout=settings.OMDB_READ_TIMEOUT,
+                max_retries=settings.OMDB_MAX_RETRIES,
+                backoff=settings.OMDB_RETRY_BACKOFF,
+                pool_size=settings.OMDB_POOL_SIZE,
+                key_pool=get_key_pool(),
+                hooks=(observe_omdb_call,),
+                breaker=get_breaker(),
+            )
+        return _client
+
+
+@receiver(setting_changed)
+def reset_client(setting, **kwargs):
+    global _client
+    if setting.startswith("OMDB_"):
+        with _client_lock:
+            if _client is not None:
+                _client.close()
+            _client = None
@@ -0,0 +1,157 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def get_param(request, name):
+    """Read a listing parameter from the query string, or from the request body as before."""
+    value = request.query_params.get(name)
+    if value is None:
+        value = request.data.get(name)
+    return value
+
+
+def keyset_filter(field, value, pk, descending):
+    """Rows that come after (value, pk) when ordered by field and then id."""
+    op = "lt" if descending else "gt"
+    if field == "id":
+        return Q(**{f"id__{op}": pk})
+    return Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": pk})
+
+
+def keyset_ordering(field, descending):
+    prefix = "-" if descending else ""
+    if field == "id":
+        return (prefix + "id",)
+    return (prefix + field, prefix + "id")
+
+
+class KeysetPagination(BasePagination):
+    """Keyset (cursor) pagination on (field, id): every page is one
+    `WHERE (field, id) > cursor LIMIT n` query, however deep the client goes.
+    Cursors are opaque tokens in the next/previous links.
+
+    Rows with NULL in field must be filtered out by the caller.
+    """
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self, field="id", descending=False):
+        self.field = field
+        self.descending = descending
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        cursor = self.decode_cursor(request)
+        backwards = cursor is not None and cursor["r"]
+        descending = self.descending != backwards
+
+        if cursor is not None:
+            try:
+                queryset = queryset.filter(keyset_filter(self.field, cursor["v"], cursor["id"], descending))
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        rows = list(queryset.order_by(*keyset_ordering(self.field, descending))[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+
+        if backwards:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_page_size(self, request):
+        value = get_param(request, self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            return _positive_int(value, strict=True, cutoff=self.max_page_size)
+        except (TypeError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self.encode_cursor(self.page[-1], backwards=False)
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.page):
+            return None
+        return self.encode_cursor(self.page[0], backwards=True)
+
+    def encode_cursor(self, item, backwards):
+        position = {"v": getattr(item, self.field), "id": item.id, "r": backwards}
+        token = base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if token is None:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+            if not (isinstance(cursor, dict) and isinstance(cursor.get("id"), int) and "v" in cursor):
+                raise ValueError
+            cursor["r"] = bool(cursor.get("r"))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+
+def ranked_page_response(request, ranked_ids, fetch, serializer_class):
+    """Page of results in a fixed ranking (search), by ?page=&page_size= with next/previous links.
+
+    ranked_ids(limit, offset) returns ids in ranking order, fetch(ids) the matching
+    objects by id.
+    """
+    paginator = KeysetPagination()
+    page_size = paginator.get_page_size(request)
+    try:
+        page = _positive_int(request.query_params.get("page", 1), strict=True)
+    except ValueError:
+        raise NotFound("Invalid page")
+
+    ids = ranked_ids(page_size + 1, (page - 1) * page_size)
+    has_next = len(ids) > page_size
+    objects = fetch(ids[:page_size])
+    base_url = request.build_absolute_uri()
+    return Response(OrderedDict([
+        ("next", replace_query_param(base_url, "page", page + 1) if has_next else None),
+        ("previous", replace_query_param(base_url, "page", page - 1) if page > 1 else None),
+        ("results", serializer_class([objects[pk] for pk in ids[:page_size] if pk in objects], many=True).data),
+    ]))
+
+
+def paginated_response(request, view, queryset, serializer_class, descending=False, sort_field="id"):
+    """Serialize one page of queryset, or all of it when the client sends paginate=false."""
+    paginate = get_param(request, "paginate")
+    if paginate is not None and str(paginate).lower() in FALSE_VALUES:
+        queryset = queryset.order_by(*keyset_ordering(sort_field, descending))
+        return Response(serializer_class(queryset, many=True).data)
+
+    paginator = KeysetPagination(sort_field, descending=descending)
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    return paginator.get_paginated_response(serializer_class(page, many=True).data)
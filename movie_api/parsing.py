@@ -0,0 +1,16 @@
+import re
+
+
+_NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def parse_number(value, cast=int):
+    """Read the first number out of an OMDb text field: "1,150,889" -> 1150889,
+    "$204,100,000" -> 204100000, "2010–2014" -> 2010, "N/A" -> None."""
+    match = _NUMBER.search(value or "")
+    if match is None:
+        return None
+    try:
+        return cast(float(match.group().replace(",", "")))
+    except (OverflowError, ValueError):
+        return None
@@ -0,0 +1,99 @@
+"""Materialized listing JSON: every movie keeps its MovieReadSerializer output
+(with Ratings) in Movie.payload, so full listings join stored payloads instead
+of running the serializers.
+
+Writers keep payloads current: the bulk writers call refresh_payloads(), and
+single-row saves of movies and Ratings (API, admin, shell) refresh them
+through signals; MovieSerializer.save() refreshes once for the movie and all
+its Ratings. Movies without a payload (stored before it existed) are rendered
+on the spot; `manage.py rebuild_movie_payloads` fills them in.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save
+
+from .bulk import chunked, refresh_payloads, render_payloads
+from .metrics import serializing
+from .models import Movie, Rating
+from .streaming import RawJSON
+
+
+_local = threading.local()
+
+
+@contextmanager
+def deferred_payloads():
+    """Refresh the payloads of movies saved inside once, when the block ends."""
+    if getattr(_local, "pending", None) is not None:
+        yield
+        return
+    _local.pending = set()
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    if pending:
+        refresh_payloads(pending)
+
+
+def payload_changed(movie_id):
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending.add(movie_id)
+    else:
+        refresh_payloads([movie_id])
+
+
+def movie_payloads(movies):
+    """RawJSON of every movie: its stored payload, rendered for movies without one."""
+    missing = [movie.id for movie in movies if movie.payload is None]
+    rendered = {}
+    for ids in chunked(missing, 500):
+        fresh = list(Movie.objects.filter(id__in=ids).prefetch_related("Ratings"))
+        rendered.update(zip((movie.id for movie in fresh), render_payloads(fresh)))
+    return [RawJSON((movie.payload if movie.payload is not None else rendered[movie.id]).encode("utf-8"))
+            for movie in movies]
+
+
+class StoredPayloads:
+    """Stands in for MovieReadSerializer(movies, many=True) in listings: .data
+    are the movies' payloads as RawJSON, which the JSON and NDJSON renderers
+    output as they are. Pass it movies with only id, payload and the sort
+    column loaded."""
+
+    def __init__(self, movies, many=True):
+        self.movies = movies
+
+    @property
+    def data(self):
+        with serializing():
+            return movie_payloads(list(self.movies))
+
+
+def check_payloads(chunk_size=500):
+    """Ids of movies whose stored payload differs from what the serializer outputs now."""
+    stale = []
+    last = 0
+    while True:
+        movies = list(Movie.objects.filter(id__gt=last).order_by("id").prefetch_related("Ratings")[:chunk_size])
+        if not movies:
+            return stale
+        stale.extend(movie.id for movie, payload in zip(movies, render_payloads(movies)) if movie.payload != payload)
+        last = movies[-1].id
+
+
+def _movie_saved(sender, instance, **kwargs):
+    payload_changed(instance.id)
+
+
+def _rating_changed(sender, instance, **kwargs):
+    payload_changed(instance.Movie_id)
+
+
+def connect_signals():
+    """Refresh payloads on single-row writes. Bulk writers call refresh_payloads themselves."""
+    post_save.connect(_movie_saved, sender=Movie)
+    post_save.connect(_rating_changed, sender=Rating)
+    post_delete.connect(_rating_changed, sender=Rating)
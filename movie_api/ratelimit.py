@@ -0,0 +1,46 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket: refills rate tokens per second, holds at most capacity."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens=1):
+        """Seconds until tokens will be available."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def acquire(self, tokens=1):
+        """Take tokens, sleeping until they are available."""
+        while not self.try_acquire(tokens):
+            self._sleep(self.wait_time(tokens))
+
+    @property
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
@@ -0,0 +1,129 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .bulk import bulk_update_movies, chunked
+from .models import Movie
+from .omdb import get_client, OmdbError
+from .ratelimit import TokenBucket
+from .serializers import MovieSerializer
+from .usage import record_calls, release_calls, reserve_calls
+
+
+REFRESH_USAGE = "refresh"
+
+
+def stale_movies(max_age=None):
+    """Movies not fetched from OMDb for max_age (or never), most popular first:
+    by number of comments, then IMDb votes, then the oldest fetch."""
+    return (Movie.objects.filter(_stale(max_age))
+            .annotate(comment_count=Count("Comments"))
+            .order_by("-comment_count", F("imdb_votes_value").desc(nulls_last=True),
+                      F("fetched_at").asc(nulls_first=True), "id"))
+
+
+def _stale(max_age):
+    max_age = max_age if max_age is not None else timedelta(days=settings.MOVIE_REFRESH_MAX_AGE_DAYS)
+    return Q(fetched_at__isnull=True) | Q(fetched_at__lt=timezone.now() - max_age)
+
+
+class MovieRefresher:
+    """Re-fetches stale movies from OMDb and writes back what changed.
+
+    Works in batches: the calls of each batch are reserved from the daily
+    quota (shared through the database) before they are made, run on a few
+    threads and paced by a token bucket. Movie columns and Ratings that
+    changed are saved with bulk statements; rows are never deleted, so reads
+    keep serving the stored copy while the refresh runs.
+    """
+
+    def __init__(self, client=None, daily_quota=None, rate=None, workers=None, batch_size=None, max_age=None):
+        self.client = client or get_client()
+        self.daily_quota = daily_quota if daily_quota is not None else settings.MOVIE_REFRESH_DAILY_QUOTA
+        self.bucket = TokenBucket(rate or settings.MOVIE_REFRESH_RATE)
+        self.workers = workers or settings.MOVIE_REFRESH_WORKERS
+        self.batch_size = batch_size or settings.MOVIE_REFRESH_BATCH_SIZE
+        self.max_age = max_age
+
+    def run(self, limit=None):
+        """Refresh up to limit stale movies (all of them by default); return counters of what happened."""
+        stats = Counter()
+        # Ranked once per run: counting the comments of every stale movie costs more than a batch.
+        # Each movie is tried once, so failed ones don't come back within the run.
+        ranked = list(stale_movies(self.max_age).values_list("id", flat=True)[:limit])
+        with ThreadPoolExecutor(self.workers) as executor:
+            for ids in chunked(ranked, self.batch_size):
+                breaker = getattr(self.client, "breaker", None)
+                if breaker is not None and breaker.is_open():
+                    # OMDb is down; the next round tries again.
+                    stats["circuit_open"] = 1
+                    break
+                # Still stale: another run may have refreshed some meanwhile.
+                found = Movie.objects.filter(_stale(self.max_age), id__in=ids).in_bulk()
+                movies = [found[pk] for pk in ids if pk in found]
+                if not movies:
+                    continue
+                granted = reserve_calls(REFRESH_USAGE, len(movies), self.daily_quota)
+                if not granted:
+                    stats["quota_exhausted"] = 1
+                    break
+                quota_left = granted == len(movies)
+                movies = movies[:granted]
+                # Worker threads then take keys without touching the database.
+                keys = getattr(self.client, "key_pool", None)
+                if keys is not None and not keys.reserve(len(movies)):
+                    release_calls(REFRESH_USAGE, granted)
+                    stats["keys_exhausted"] = 1
+                    break
+                answers = list(executor.map(self._fetch, movies))
+                record_calls(REFRESH_USAGE, len(movies))
+                stats.update(self.apply(movies, answers))
+                if not quota_left:
+                    stats["quota_exhausted"] = 1
+                    break
+        return stats
+
+    def _fetch(self, movie):
+        self.bucket.acquire()
+        try:
+            if movie.imdbID:
+                return self.client.get_movie_by_id(movie.imdbID)
+            return self.client.get_movie(movie.Title)
+        except OmdbError:
+            return None
+        finally:
+            # The key pool may have touched the database from this thread.
+            connections.close_all()
+
+    def apply(self, movies, answers):
+        """Write back the changes between movies and OMDb's answers for them (None: failed call)."""
+        stats = Counter()
+        updates = []
+        for movie, answer in zip(movies, answers):
+            if answer is None:
+                stats["failed"] += 1
+                continue
+            stats["fetched"] += 1
+            if answer.get("Response") != "True":
+                stats["missing"] += 1
+                updates.append((movie, None))
+                continue
+            serializer = MovieSerializer(data=answer)
+            if not serializer.is_valid():
+                stats["invalid"] += 1
+                updates.append((movie, None))
+                continue
+            updates.append((movie, serializer.validated_data))
+
+        with transaction.atomic():
+            changed = bulk_update_movies([(movie, data) for movie, data in updates if data is not None])
+            Movie.objects.filter(id__in=[movie.id for movie, data in updates]).update(fetched_at=timezone.now())
+        stats["updated"] = len(changed)
+        # Answers without a usable movie are counted as missing or invalid.
+        stats["unchanged"] = stats["fetched"] - stats["updated"] - stats["missing"] - stats["invalid"]
+        return stats
@@ -0,0 +1,246 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, IntegrityError, transaction
+from django.utils import timezone
+
+from .bulk import bulk_create_movies, chunked
+from .cache import title_cache, NOT_FOUND
+from .fuzzy import match_title
+from .keys import KeysExhausted
+from .models import Movie
+from .omdb import get_client, OmdbError
+from .serializers import MovieSerializer
+from .singleflight import lookups
+from .titles import normalize_title
+
+
+UPSTREAM_ERROR = "OMDb is not available"
+
+
+class UpstreamDataError(Exception):
+    """OMDb answered with data that doesn't fit MovieSerializer."""
+
+
+def stored_movie(title, cached=None):
+    """Find an already stored movie for the requested title without asking OMDb:
+    by exact (normalized) title, then by similar title (FUZZY_TITLE_MATCHING)."""
+    if cached is not None:
+        movie = Movie.objects.filter(id=cached.movie_id).first()
+        if movie is not None and normalize_title(movie.Title) == cached.title_key:
+            return movie
+        title_cache.discard(title)
+    movie = Movie.objects.filter(title_key=normalize_title(title)).first()
+    if movie is None and settings.FUZZY_TITLE_MATCHING:
+        movie = match_title(title)
+    if movie is not None:
+        title_cache.add(title, movie)
+    return movie
+
+
+def resolve_title(title):
+    """Return the stored Movie for title, fetching and saving it from OMDb
+    when needed, or None when OMDb doesn't know the title.
+
+    Concurrent lookups of the same title are coalesced, so a burst of
+    requests makes one upstream call and one insert. Raises OmdbError when
+    OMDb can't answer now: KeysExhausted when no OMDb API key has calls
+    left, CircuitOpen while the circuit breaker keeps calls away from OMDb.
+    """
+    cached = title_cache.get(title)
+    if cached is NOT_FOUND:
+        return None
+    movie = stored_movie(title, cached)
+    if movie is not None:
+        return movie
+    return lookups.do(f"title:{normalize_title(title)}", lambda: _fetch_title(title))
+
+
+# WSGI environ key of a TitleLookup made before the request reached Django (ASGI mode).
+TITLE_LOOKUP = "movie_api.title_lookup"
+
+
+class TitleLookup:
+    """Outcome of a lookup of title done ahead of the view: the Movie (or None) or the error raised."""
+
+    def __init__(self, title, movie=None, error=None):
+        self.title = title
+        self.movie = movie
+        self.error = error
+
+    def result(self):
+        """What resolve_title(title) would have returned or raised."""
+        if self.error is not None:
+            raise self.error
+        return self.movie
+
+
+def _fetch_title(title):
+    # Whoever held the lease before us may have stored the movie already.
+    movie = stored_movie(title)
+    if movie is not None:
+        return movie
+
+    # OmdbError goes up: "not available" isn't "no such movie".
+    data = get_client().get_movie(title)
+    return store_lookup(title, data)
+
+
+def store_lookup(title, data):
+    """Store OMDb's answer for title and return the Movie, or None (remembered) when OMDb doesn't know it."""
+    if data.get('Response') == 'True':
+        movie = lookups.do(f"movie:{data.get('imdbID') or normalize_title(data['Title'])}", lambda: _store_movie(data))
+        title_cache.add(title, movie)
+        return movie
+    title_cache.add_missing(title)
+    return None
+
+
+def _store_movie(data):
+    """Return the stored movie with OMDb's imdbID, inserting it first if needed."""
+    movie = _stored_by_imdb_id(data)
+    if movie is not None:
+        return movie
+    serializer = MovieSerializer(data=data)
+    if not serializer.is_valid():
+        raise UpstreamDataError(serializer.errors)
+    try:
+        with transaction.atomic():
+            return serializer.save(fetched_at=timezone.now())
+    except IntegrityError:
+        # Another worker inserted it between our lookup and the insert.
+        movie = _stored_by_imdb_id(data)
+        if movie is None:
+            raise
+        return movie
+
+
+def _stored_by_imdb_id(data):
+    if data.get('imdbID'):
+        return Movie.objects.filter(imdbID=data['imdbID']).first()
+    return Movie.objects.filter(Title=data['Title']).first()
+
+
+def resolve_titles(titles):
+    """Batch variant of resolve_title.
+
+    Titles already stored are found with one IN query, the missing ones are
+    fetched from OMDb concurrently and saved with bulk inserts. Returns one
+    result dict per distinct title, in request order.
+    """
+    results = {}
+    pending = []
+    for title in dict.fromkeys(titles):
+        cached = title_cache.get(title)
+        if cached is NOT_FOUND:
+            results[title] = {"title": title, "status": "not_found"}
+        else:
+            pending.append(title)
+
+    stored = {movie.title_key: movie for movie in
+              Movie.objects.filter(title_key__in={normalize_title(title) for title in pending}).order_by("-id")}
+    missing = []
+    for title in pending:
+        movie = stored.get(normalize_title(title))
+        if movie is None:
+            missing.append(title)
+        else:
+            title_cache.add(title, movie)
+            results[title] = _movie_result(title, movie, "existing")
+
+    fetched = _fetch_many(missing)
+    to_create = {}
+    for title in missing:
+        data = fetched[title]
+        if isinstance(data, KeysExhausted):
+            results[title] = {"title": title, "status": "error", "Error": "OMDb quota exhausted"}
+        elif isinstance(data, OmdbError):
+            results[title] = {"title": title, "status": "error", "Error": UPSTREAM_ERROR}
+        elif data.get("Response") != "True":
+            title_cache.add_missing(title)
+            results[title] = {"title": title, "status": "not_found"}
+        elif not data.get("imdbID"):
+            results[title] = {"title": title, "status": "error",
+                              "Error": "Problem with serializing data from external API"}
+        else:
+            to_create.setdefault(data["imdbID"], (data, []))[1].append(title)
+
+    stored = {movie.imdbID: movie for movie in Movie.objects.filter(imdbID__in=list(to_create))}
+    valid = []
+    for imdb_id, (data, requested) in to_create.items():
+        movie = stored.get(imdb_id)
+        if movie is not None:
+            for title in requested:
+                title_cache.add(title, movie)
+                results[title] = _movie_result(title, movie, "existing")
+            continue
+        serializer = MovieSerializer(data=data)
+        if serializer.is_valid():
+            valid.append((serializer.validated_data, requested))
+        else:
+            for title in requested:
+                results[title] = {"title": title, "status": "error",
+                                  "Error": "Problem with serializing data from external API"}
+
+    for chunk in chunked(valid, settings.MOVIE_BULK_CHUNK_SIZE):
+        for movie, requested, status in _create_movies(chunk):
+            for title in requested:
+                title_cache.add(title, movie)
+                results[title] = _movie_result(title, movie, status)
+
+    return [results[title] for title in dict.fromkeys(titles)]
+
+
+def _create_movies(chunk):
+    """Insert a chunk of (validated_data, titles) and yield (movie, titles, status) for each.
+
+    Movies another worker inserted after our imdbID lookup come back as "existing".
+    """
+    while chunk:
+        try:
+            created = bulk_create_movies([validated_data for validated_data, requested in chunk])
+        except IntegrityError:
+            # The chunk was rolled back: take the rows stored meanwhile and insert the rest.
+            stored = {movie.imdbID: movie for movie in
+                      Movie.objects.filter(imdbID__in=[data["imdbID"] for data, requested in chunk])}
+            if not stored:
+                raise
+            for validated_data, requested in chunk:
+                if validated_data["imdbID"] in stored:
+                    yield stored[validated_data["imdbID"]], requested, "existing"
+            chunk = [item for item in chunk if item[0]["imdbID"] not in stored]
+            continue
+        for movie, (validated_data, requested) in zip(created, chunk):
+            yield movie, requested, "created"
+        return
+
+
+def _fetch_many(titles):
+    """OMDb's answer (or the OmdbError) for each of titles, with one call per normalized title."""
+    if not titles:
+        return {}
+    by_key = {}
+    for title in titles:
+        by_key.setdefault(normalize_title(title), title)
+    client = get_client()
+    # With the circuit open the calls fail at once; don't reserve quota for them.
+    if client.key_pool is not None and not (client.breaker is not None and client.breaker.is_open()):
+        # Worker threads then take keys without touching the database.
+        client.key_pool.reserve(len(by_key))
+
+    def fetch(title):
+        try:
+            return client.get_movie(title)
+        except OmdbError as exc:
+            return exc
+        finally:
+            # A key pool running out reserves from here; don't leave the thread's connection open.
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=settings.OMDB_BATCH_WORKERS) as executor:
+        answers = dict(zip(by_key, executor.map(fetch, by_key.values())))
+    return {title: answers[normalize_title(title)] for title in titles}
+
+
+def _movie_result(title, movie, status):
+    return {"title": title, "status": status, "id": movie.id, "Title": movie.Title}
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, post_delete
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.response import Response
+
+from .models import Movie, Rating, Comment, TableVersion
+
+
+MOVIES = "movies"
+COMMENTS = "comments"
+
+
+def bump_version(table):
+    """Invalidate every cached response built from table.
+
+    Call it in the transaction that writes, so the new version becomes
+    visible together with the new rows. Versions are random rather than a
+    counter, so a rolled back or restored database never reuses one.
+    """
+    version = uuid.uuid4().hex
+    if TableVersion.objects.filter(table=table).update(version=version):
+        return
+    try:
+        with transaction.atomic():
+            TableVersion.objects.create(table=table, version=version)
+    except IntegrityError:
+        TableVersion.objects.filter(table=table).update(version=version)
+
+
+def table_versions(tables):
+    versions = dict(TableVersion.objects.filter(table__in=tables).values_list("table", "version"))
+    return [versions.get(table, "") for table in tables]
+
+
+def response_etag(request, tables):
+    """Strong ETag of the response to request: changes with the URL, the accepted
+    format, GET parameters sent in the body and the versions of tables."""
+    data = request.data
+    body = sorted(data.lists()) if hasattr(data, "lists") else data
+    key = json.dumps([request.build_absolute_uri(), request.accepted_media_type, body, table_versions(tables)],
+                     sort_keys=True, default=str)
+    return quote_etag(hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+def cached_response(*tables, extra_tables=None):
+    """Decorator of APIView GET handlers whose output depends only on the request and tables
+    (and the tables extra_tables(request) returns, if given).
+
+    Answers 304 Not Modified when If-None-Match carries the current ETag and
+    otherwise serves the rendered body from the cache while the tables are
+    unchanged. Only 200 responses are cached; streamed ones get an ETag only.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            etag = response_etag(request, tables + tuple(extra_tables(request) if extra_tables else ()))
+            if_none_match = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+            # Compressed responses carry the weak form of the ETag.
+            if etag in if_none_match or "W/" + etag in if_none_match or "*" in if_none_match:
+                response = HttpResponseNotModified()
+                response["ETag"] = etag
+                return response
+
+            cache = caches[settings.RESPONSE_CACHE_ALIAS]
+            cached = cache.get(etag)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = handler(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                if isinstance(response, Response):
+                    def store(rendered):
+                        cache.set(etag, (rendered.content, rendered["Content-Type"]), settings.RESPONSE_CACHE_TIMEOUT)
+                    response.add_post_render_callback(store)
+            response["ETag"] = etag
+            return response
+        return wrapper
+    return decorator
+
+
+def _bump_movies(sender, **kwargs):
+    bump_version(MOVIES)
+
+
+def _bump_comments(sender, **kwargs):
+    bump_version(COMMENTS)
+
+
+def connect_signals():
+    """Bump versions on single-row writes (API, admin, shell). Bulk writers
+    (bulk_create, QuerySet.update) call bump_version themselves."""
+    for model in (Movie, Rating):
+        post_save.connect(_bump_movies, sender=model)
+        post_delete.connect(_bump_movies, sender=model)
+    post_save.connect(_bump_comments, sender=Comment)
+    post_delete.connect(_bump_comments, sender=Comment)
@@ -0,0 +1,136 @@
+import operator
+import re
+from functools import reduce
+
+from django.db import connection
+from django.db.models import Q
+
+
+SEARCH_FIELDS = ("Title", "Plot", "Actors", "Director", "Writer", "Genre")
+# bm25 weights of SEARCH_FIELDS (SQLite) - a hit in the title counts most.
+FIELD_WEIGHTS = (10.0, 1.0, 3.0, 3.0, 3.0, 2.0)
+
+FTS_TABLE = "movie_api_movie_fts"
+PG_INDEX = "movie_api_movie_search_idx"
+PG_VECTOR = "to_tsvector('english', {})".format(
+    " || ' ' || ".join(f'coalesce("{field}", \'\')' for field in SEARCH_FIELDS))
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+_SQLITE_TRIGGERS = {
+    "ai": "AFTER INSERT ON movie_api_movie BEGIN {insert} END",
+    "ad": "AFTER DELETE ON movie_api_movie BEGIN {delete} END",
+    # Only updates of indexed columns: fetched_at stamps and payload refreshes leave the index alone.
+    "au": "AFTER UPDATE OF {columns} ON movie_api_movie BEGIN {delete} {insert} END",
+}
+
+
+_backends = {}
+
+
+def backend(using=connection):
+    """Name of the text index used on this database: "fts5", "postgres" or None (plain LIKE scan)."""
+    if using.alias not in _backends:
+        if using.vendor == "postgresql":
+            _backends[using.alias] = "postgres"
+        elif using.vendor == "sqlite" and _has_fts5(using):
+            _backends[using.alias] = "fts5"
+        else:
+            _backends[using.alias] = None
+    return _backends[using.alias]
+
+
+def _has_fts5(using):
+    with using.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.movie_api_fts5_probe USING fts5(x)")
+            cursor.execute("DROP TABLE temp.movie_api_fts5_probe")
+        except Exception:
+            return False
+    return True
+
+
+def install_index(using=connection):
+    """Create the text index (idempotent). On SQLite the FTS5 table is kept in sync
+    with movie_api_movie by triggers, so bulk inserts are indexed too."""
+    kind = backend(using)
+    with using.cursor() as cursor:
+        if kind == "postgres":
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON movie_api_movie USING GIN (({PG_VECTOR}))")
+        elif kind == "fts5":
+            columns = ", ".join(SEARCH_FIELDS)
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                           f"{columns}, content='movie_api_movie', content_rowid='id')")
+            new_values = ", ".join(f"new.{field}" for field in SEARCH_FIELDS)
+            old_values = ", ".join(f"old.{field}" for field in SEARCH_FIELDS)
+            statements = {
+                "columns": columns,
+                "insert": f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});",
+                "delete": f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values});",
+            }
+            for suffix, body in _SQLITE_TRIGGERS.items():
+                cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_{suffix} " + body.format(**statements))
+    return kind
+
+
+def reinstall_triggers(using=connection):
+    """Replace the SQLite triggers with the current definitions (the index itself is kept)."""
+    if backend(using) == "fts5":
+        with using.cursor() as cursor:
+            for suffix in _SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        install_index(using)
+
+
+def drop_index(using=connection):
+    kind = backend(using)
+    with using.cursor() as cursor:
+        if kind == "postgres":
+            cursor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+        elif kind == "fts5":
+            for suffix in _SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def rebuild_index(using=connection):
+    """Re-index every stored movie."""
+    kind = install_index(using)
+    with using.cursor() as cursor:
+        if kind == "postgres":
+            cursor.execute(f"REINDEX INDEX {PG_INDEX}")
+        elif kind == "fts5":
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return kind
+
+
+def search_movie_ids(query, limit, offset=0, using=connection):
+    """Ids of movies matching every word of query in the database using, best matches first."""
+    words = _WORD.findall(query)
+    if not words:
+        return []
+    kind = backend(using)
+    with using.cursor() as cursor:
+        if kind == "fts5":
+            # Every word quoted (no FTS5 query syntax from users); the last one may be unfinished.
+            match = " ".join('"{}"'.format(word.replace('"', '""')) for word in words) + "*"
+            weights = ", ".join(str(weight) for weight in FIELD_WEIGHTS)
+            cursor.execute(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                           f"ORDER BY bm25({FTS_TABLE}, {weights}), rowid LIMIT %s OFFSET %s",
+                           [match, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+        if kind == "postgres":
+            cursor.execute(f"SELECT id FROM movie_api_movie, plainto_tsquery('english', %s) query "
+                           f"WHERE {PG_VECTOR} @@ query ORDER BY ts_rank({PG_VECTOR}, query) DESC, id "
+                           f"LIMIT %s OFFSET %s", [" ".join(words), limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    from .models import Movie
+    condition = Q()
+    for word in words:
+        condition &= reduce(operator.or_, (Q(**{f"{field}__icontains": word}) for field in SEARCH_FIELDS))
+    return list(Movie.objects.using(using.alias).filter(condition).order_by("id")
+                .values_list("id", flat=True)[offset:offset + limit])
@@ -1,23 +1,94 @@
 from rest_framework import serializers
+from .metrics import serializing
 from .models import Movie, Comment, Rating
 from drf_writable_nested import WritableNestedModelSerializer
 
 
+# Derived Movie columns that stay out of the API.
+INTERNAL_MOVIE_FIELDS = ('title_key', 'year_value', 'imdb_rating_value', 'imdb_votes_value',
+                         'metascore_value', 'box_office_value', 'fetched_at', 'payload')
+
+
+class TimedListSerializer(serializers.ListSerializer):
+
+    @property
+    def data(self):
+        with serializing():
+            return super().data
+
+
+class TimedDataMixin:
+    """Time spent in .data (also of many=True lists) counts as serialization in request metrics."""
+
+    @property
+    def data(self):
+        with serializing():
+            return super().data
+
+
 class RatingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rating
         fields = ("Source", "Value")
 
 
-class MovieSerializer(WritableNestedModelSerializer):
+class MovieSerializer(TimedDataMixin, WritableNestedModelSerializer):
     Ratings = RatingSerializer(many=True)
 
     class Meta:
         model = Movie
-        fields = '__all__'
+        exclude = INTERNAL_MOVIE_FIELDS
+        list_serializer_class = TimedListSerializer
+        # imdbID uniqueness is left to the database; writers look the movie up first
+        # and fall back to the stored row on IntegrityError.
+        extra_kwargs = {'imdbID': {'validators': []}}
+
+    def save(self, **kwargs):
+        # payloads imports this module.
+        from .payloads import deferred_payloads
+        # One payload refresh for the movie and its Ratings rather than one per row.
+        with deferred_payloads():
+            return super().save(**kwargs)
+
+
+class MovieCommentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Comment
+        fields = ("id", "comment_body")
+
+
+class SparseFieldsMixin:
+    """Takes fields=[names] to output only those fields (and id). Without it all
+    fields but the expansions are output."""
+    expansions = ()
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            dropped = set(self.expansions)
+        else:
+            dropped = set(self.fields) - set(fields) - {"id"}
+        for name in dropped:
+            self.fields.pop(name, None)
+
+
+class MovieReadSerializer(SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
+    """Read-only twin of MovieSerializer for listings. Gives the same JSON without
+    the nested-write machinery; pass it a queryset with prefetch_related("Ratings")
+    (see filters.select_fields). Comments are only output when asked for in fields."""
+    Ratings = RatingSerializer(many=True, read_only=True)
+    Comments = MovieCommentSerializer(many=True, read_only=True)
+    expansions = ("Comments",)
+
+    class Meta:
+        model = Movie
+        exclude = INTERNAL_MOVIE_FIELDS
+        read_only_fields = [field.name for field in Movie._meta.fields]
+        list_serializer_class = TimedListSerializer
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedDataMixin, serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = '__all__'
+        list_serializer_class = TimedListSerializer
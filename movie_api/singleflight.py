@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import LookupLease
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Makes sure only one lookup per key runs at a time.
+
+    Threads of the same process wait for the running call and share its result.
+    Other workers are coordinated through a LookupLease row: they poll it until
+    the holder stores its result, then reuse that instead of calling OMDb again.
+    Expired rows are deleted whenever a new lease is taken. fn must return a
+    Movie or None.
+    """
+
+    def __init__(self, lease_timeout=30, result_ttl=5, poll_interval=0.05):
+        self.lease_timeout = lease_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_leased(key, fn)
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _do_leased(self, key, fn):
+        lease_key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lease_timeout
+        while True:
+            lease = self._acquire(lease_key, token)
+            if lease is None:
+                break
+            if lease.completed:
+                return lease.movie
+            if time.monotonic() > deadline:
+                # The holder looks stuck; better a duplicate lookup than a hung request.
+                return fn()
+            time.sleep(self.poll_interval)
+
+        try:
+            result = fn()
+        except Exception:
+            LookupLease.objects.filter(key=lease_key, token=token).delete()
+            raise
+        LookupLease.objects.filter(key=lease_key, token=token).update(
+            completed=True, movie=result, expires_at=timezone.now() + timedelta(seconds=self.result_ttl))
+        return result
+
+    def _acquire(self, lease_key, token):
+        """Return None when the lease was taken by us, otherwise the current LookupLease row."""
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=self.lease_timeout)
+        try:
+            with transaction.atomic():
+                LookupLease.objects.create(key=lease_key, token=token, expires_at=expires_at)
+            # Every lookup of a new title leaves a row behind; a lookup is a
+            # good moment to drop the ones nobody can reuse any more.
+            LookupLease.objects.filter(expires_at__lte=now).delete()
+            return None
+        except IntegrityError:
+            pass
+        taken_over = LookupLease.objects.filter(key=lease_key, expires_at__lte=now).update(
+            token=token, expires_at=expires_at, completed=False, movie=None)
+        if taken_over:
+            return None
+        lease = LookupLease.objects.filter(key=lease_key).select_related("movie").first()
+        if lease is None:
+            return self._acquire(lease_key, token)
+        return lease
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines of one event loop: concurrent callers with
+    the same key await a single run of fn()."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = asyncio.ensure_future(fn())
+            call.add_done_callback(lambda done: self._calls.pop(key, None))
+        # One impatient client must not cancel the lookup the others wait for.
+        return await asyncio.shield(call)
+
+
+lookups = SingleFlight(
+    lease_timeout=getattr(settings, "OMDB_LOOKUP_LEASE_TIMEOUT", 30),
+    result_ttl=getattr(settings, "OMDB_LOOKUP_RESULT_TTL", 5),
+    poll_interval=getattr(settings, "OMDB_LOOKUP_POLL_INTERVAL", 0.05),
+)
+
+async_lookups = AsyncSingleFlight()
@@ -0,0 +1,125 @@
+import json
+from collections.abc import Mapping
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .pagination import get_param, keyset_filter, keyset_ordering, FALSE_VALUES
+
+
+NDJSON = "application/x-ndjson"
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Renders a list as newline-delimited JSON (one object per line)."""
+    media_type = NDJSON
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, list):
+            data = [data]
+        return b"".join(_json(item) + b"\n" for item in data)
+
+
+class RawJSON(Mapping):
+    """A JSON object rendered already (bytes), f.e. a stored movie payload.
+
+    The renderers here output it as it is; used as a mapping (tests, the
+    browsable API) it's parsed.
+    """
+    __slots__ = ("raw", "_parsed")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._parsed = None
+
+    def _data(self):
+        if self._parsed is None:
+            self._parsed = json.loads(self.raw.decode("utf-8"))
+        return self._parsed
+
+    def __getitem__(self, key):
+        return self._data()[key]
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __len__(self):
+        return len(self._data())
+
+
+class PrerenderedJSONRenderer(JSONRenderer):
+    """JSONRenderer that joins listings of RawJSON rows (as a list or the results
+    of a page) as they are, without encoding them again."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data.get("results") if isinstance(data, dict) else data
+        if not (isinstance(rows, list) and rows and isinstance(rows[0], RawJSON)):
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            # Indented (browsable API): JSONEncoder parses them.
+            return super().render(data, accepted_media_type, renderer_context)
+        joined = b"[" + b",".join(row.raw for row in rows) + b"]"
+        if rows is data:
+            return joined
+        # results comes last in pages: render the rest around an empty list.
+        page = super().render(dict(data, results=[]), accepted_media_type, renderer_context)
+        return page[:-len(b"[]}")] + joined + b"}"
+
+
+def stream_format(request):
+    """Return "ndjson" or "json" when the client asked for a streamed listing, otherwise None."""
+    if getattr(request, "accepted_renderer", None) is not None and request.accepted_renderer.format == "ndjson":
+        return "ndjson"
+    stream = get_param(request, "stream")
+    if stream is None or str(stream).lower() in FALSE_VALUES:
+        return None
+    return "ndjson" if str(stream).lower() == "ndjson" else "json"
+
+
+def streaming_response(queryset, serializer_class, fmt, descending=False, sort_field="id"):
+    """Stream the whole queryset as a JSON array or NDJSON, a chunk of rows at a time,
+    so memory use doesn't depend on the size of the table."""
+    rows = _serialized_rows(queryset, serializer_class, descending, sort_field, settings.STREAM_CHUNK_SIZE)
+    if fmt == "ndjson":
+        content = (b"".join(row + b"\n" for row in chunk) for chunk in rows)
+        return StreamingHttpResponse(content, content_type=NDJSON)
+    return StreamingHttpResponse(_json_array(rows), content_type="application/json")
+
+
+def _json_array(rows):
+    yield b"["
+    separator = b""
+    for chunk in rows:
+        yield separator + b",".join(chunk)
+        separator = b","
+    yield b"]"
+
+
+def _serialized_rows(queryset, serializer_class, descending, sort_field, chunk_size):
+    # Keyset chunks rather than a bare .iterator(): prefetch_related still
+    # applies per chunk and no cursor stays open between chunks.
+    queryset = queryset.order_by(*keyset_ordering(sort_field, descending))
+    last = None
+    while True:
+        chunk = queryset
+        if last is not None:
+            chunk = chunk.filter(keyset_filter(sort_field, getattr(last, sort_field), last.id, descending))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield [_json(row) for row in serializer_class(chunk, many=True).data]
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+
+
+def _json(item):
+    return item.raw if isinstance(item, RawJSON) else _dumps(item)
+
+
+def _dumps(item):
+    return json.dumps(item, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -1,12 +1,74 @@
-from django.test import TestCase
-from .models import Movie, Rating, Comment
-from .serializers import MovieSerializer, CommentSerializer
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, OperationalError, transaction
+from django.utils import timezone
+from datetime import timedelta
+from unittest import mock
+import asyncio
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from .models import Movie, Rating, Comment, LookupLease, UpstreamUsage, Change, TableVersion
+from .serializers import MovieSerializer, MovieReadSerializer, CommentSerializer
+from .cache import TitleResolutionCache, title_cache, NOT_FOUND
+from .titles import normalize_title
+from .resolver import resolve_title
+from .singleflight import SingleFlight
+from .omdb import OmdbClient, OmdbError
+from .fake_omdb import FakeOmdbServer
+from .asgi import MovieApiAsgi
+from .ratelimit import TokenBucket
+from .refresh import MovieRefresher, stale_movies
+from .usage import calls_today, reserve_calls
+from .keys import KeyPool, KeysExhausted
+from .breaker import CircuitBreaker, CircuitOpen
+from .bulk import bulk_create_movies, bulk_update_movies
+from .importer import MovieImporter
+from .exporter import CatalogExporter
+from .changes import latest_sequence, record_changes
+from .comment_buffer import CommentBuffer, BufferFull
+from . import metrics
+from .async_omdb import AsyncOmdbClient, close_async_client
+from .compression import choose_encoding
+from .fuzzy import match_title, reset_title_index, split_year, TitleIndex
+from django.core.wsgi import get_wsgi_application
 import requests
 from rest_framework.test import APIClient
 from movie_api.apps import MovieApiConfig
 from django.apps import apps
 
 
+OMDB_MOVIES = [
+    {"Title": "Batman", "Year": "1989", "Rated": "PG-13", "Released": "23 Jun 1989", "Runtime": "126 min", "Genre": "Action, Adventure", "Director": "Tim Burton", "Writer": "Bob Kane (Batman characters), Sam Hamm (story), Sam Hamm (screenplay), Warren Skaaren (screenplay)", "Actors": "Michael Keaton, Jack Nicholson, Kim Basinger, Robert Wuhl", "Plot": "The Dark Knight of Gotham City begins his war on crime with his first major enemy being the clownishly homicidal Joker.", "Language": "English, French, Spanish", "Country":"USA, UK", "Awards":"Won 1 Oscar. Another 8 wins & 26 nominations.", "Poster":"https://m.media-amazon.com/images/M/MV5BMTYwNjAyODIyMF5BMl5BanBnXkFtZTYwNDMwMDk2._V1_SX300.jpg", "Ratings":[{"Source": "Internet Movie Database", "Value": "7.6/10"}, {"Source": "Rotten Tomatoes", "Value": "72%"}, {"Source": "Metacritic", "Value": "69/100"}], "Metascore": "69", "imdbRating": "7.6", "imdbVotes": "303,988", "imdbID": "tt0096895", "Type": "movie", "DVD": "25 Mar 1997", "BoxOffice": "N/A", "Production": "Warner Bros. Pictures", "Website": "N/A", "Response": "True"},
+    {"Title": "Django", "Year": "1966", "Rated": "Not Rated", "Released": "01 Dec 1966", "Runtime": "91 min", "Genre": "Action, Western", "Director": "Sergio Corbucci", "Writer": "Sergio Corbucci (story), Bruno Corbucci (story), Franco Rossetti (screenplay)", "Actors": "Franco Nero, José Canalejas, José Bódalo, Loredana Nusciak", "Plot": "A drifter with a coffin in tow gets caught up in a feud between a band of Mexican revolutionaries and a gang of racist Klansmen.", "Language": "Italian", "Country": "Italy, Spain", "Awards": "N/A", "Poster": "N/A", "Ratings": [{"Source": "Internet Movie Database", "Value": "7.2/10"}, {"Source": "Rotten Tomatoes", "Value": "92%"}], "Metascore": "N/A", "imdbRating": "7.2", "imdbVotes": "25,417", "imdbID": "tt0060315", "Type": "movie", "DVD": "N/A", "BoxOffice": "N/A", "Production": "N/A", "Website": "N/A", "Response": "True"},
+]
+
+
+class FakeOmdbMixin:
+    """Points the app at a local FakeOmdbServer instead of omdbapi.com."""
+    omdb_latency = 0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.omdb = FakeOmdbServer(OMDB_MOVIES, latency=cls.omdb_latency).start()
+        cls.omdb_settings = override_settings(OMDB_API_URL=cls.omdb.url)
+        cls.omdb_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.omdb_settings.disable()
+        cls.omdb.stop()
+        super().tearDownClass()
+
+
 
 class ModelsCreateTestCase(TestCase):
     """This class defines tests for all models in app and dependencies."""
@@ -72,7 +134,7 @@ class ModelsCreateTestCase(TestCase):
         self.assertTrue(self.new_movie.Comments.filter(id=new_comment.id).get())
         self.assertNotEqual(old_count, new_count)
 
-class SerializersTestCase(TestCase):
+class SerializersTestCase(FakeOmdbMixin, TestCase):
 
     def setUp(self):
         self.local_data = {"Title": "Batman", "Year": "1989", "Rated": "PG-13", "Released": "23 Jun 1989", "Runtime": "126 min", "Genre": "Action, Adventure", "Director": "Tim Burton", "Writer": "Bob Kane (Batman characters), Sam Hamm (story), Sam Hamm (screenplay), Warren Skaaren (screenplay)", "Actors": "Michael Keaton, Jack Nicholson, Kim Basinger, Robert Wuhl", "Plot": "The Dark Knight of Gotham City begins his war on crime with his first major enemy being the clownishly homicidal Joker.", "Language": "English, French, Spanish", "Country":"USA, UK", "Awards":"Won 1 Oscar. Another 8 wins & 26 nominations.", "Poster":"https://m.media-amazon.com/images/M/MV5BMTYwNjAyODIyMF5BMl5BanBnXkFtZTYwNDMwMDk2._V1_SX300.jpg", "Ratings":[{"Source": "Internet Movie Database", "Value": "7.6/10"}, {"Source": "Rotten Tomatoes", "Value": "72%"}, {"Source": "Metacritic", "Value": "69/100"}], "Metascore": "69", "imdbRating": "7.6", "imdbVotes": "303,988", "imdbID": "tt0096895", "Type": "movie", "DVD": "25 Mar 1997", "BoxOffice": "N/A", "Production": "Warner Bros. Pictures", "Website": "N/A", "Response": "True"}
@@ -86,7 +148,7 @@ class SerializersTestCase(TestCase):
         self.assertNotEqual(old_count, new_count)
 
     def test_movie_serializer_with_ombdapi_data_remote(self):
-        remote_data = requests.get(f'http://www.omdbapi.com/?t=django&type=movie&apikey=28cb1743')
+        remote_data = requests.get(f'{self.omdb.url}?t=django&type=movie&apikey=28cb1743')
         old_count = Movie.objects.count()
         movie = MovieSerializer(data=remote_data.json())
         self.assertTrue(movie.is_valid())
@@ -107,11 +169,12 @@ class SerializersTestCase(TestCase):
         self.assertNotEqual(old_count, new_count)
 
 
-class MovieRemoteRequestsTestCase(TestCase):
+class MovieRemoteRequestsTestCase(FakeOmdbMixin, TestCase):
     """Test POST and GET methods on /movie"""
 
     def setUp(self):
         self.client = APIClient()
+        title_cache.clear()
         self.movie_1_data = {"Title": "Batman", "Year": "1989", "Rated": "PG-13", "Released": "23 Jun 1989", "Runtime": "126 min", "Genre": "Action, Adventure", "Director": "Tim Burton", "Writer": "Bob Kane (Batman characters), Sam Hamm (story), Sam Hamm (screenplay), Warren Skaaren (screenplay)", "Actors": "Michael Keaton, Jack Nicholson, Kim Basinger, Robert Wuhl", "Plot": "The Dark Knight of Gotham City begins his war on crime with his first major enemy being the clownishly homicidal Joker.", "Language": "English, French, Spanish", "Country":"USA, UK", "Awards":"Won 1 Oscar. Another 8 wins & 26 nominations.", "Poster":"https://m.media-amazon.com/images/M/MV5BMTYwNjAyODIyMF5BMl5BanBnXkFtZTYwNDMwMDk2._V1_SX300.jpg", "Ratings":[{"Source": "Internet Movie Database", "Value": "7.6/10"}, {"Source": "Rotten Tomatoes", "Value": "72%"}, {"Source": "Metacritic", "Value": "69/100"}], "Metascore": "69", "imdbRating": "7.6", "imdbVotes": "303,988", "imdbID": "tt0096895", "Type": "movie", "DVD": "25 Mar 1997", "BoxOffice": "N/A", "Production": "Warner Bros. Pictures", "Website": "N/A", "Response": "True"}
         self.movie_2_data = {"Title":"The Avengers","Year":"2012","Rated":"PG-13","Released":"04 May 2012","Runtime":"143 min","Genre":"Action, Adventure, Sci-Fi","Director":"Joss Whedon","Writer":"Joss Whedon (screenplay), Zak Penn (story), Joss Whedon (story)","Actors":"Robert Downey Jr., Chris Evans, Mark Ruffalo, Chris Hemsworth","Plot":"Earth's mightiest heroes must come together and learn to fight as a team if they are going to stop the mischievous Loki and his alien army from enslaving humanity.","Language":"English, Russian, Hindi","Country":"USA","Awards":"Nominated for 1 Oscar. Another 38 wins & 79 nominations.","Poster":"https://m.media-amazon.com/images/M/MV5BNDYxNjQyMjAtNTdiOS00NGYwLWFmNTAtNThmYjU5ZGI2YTI1XkEyXkFqcGdeQXVyMTMxODk2OTU@._V1_SX300.jpg","Ratings":[{"Source":"Internet Movie Database","Value":"8.1/10"},{"Source":"Rotten Tomatoes","Value":"92%"},{"Source":"Metacritic","Value":"69/100"}],"Metascore":"69","imdbRating":"8.1","imdbVotes":"1,132,357","imdbID":"tt0848228","Type":"movie","DVD":"25 Sep 2012","BoxOffice":"$623,279,547","Production":"Walt Disney Pictures","Website":"http://marvel.com/avengers_movie","Response":"True"}
 
@@ -123,7 +186,7 @@ class MovieRemoteRequestsTestCase(TestCase):
             movie_1.save()
         response = self.client.get('/api/movies')
         self.assertEqual(response.status_code, requests.codes.ok)
-        response_serialized = MovieSerializer(data=response.data, many=True)
+        response_serialized = MovieSerializer(data=response.data["results"], many=True)
         self.assertTrue(response_serialized.is_valid())
         self.assertEqual(len(response_serialized.data), 1)
         self.assertEqual(response_serialized.data[0]["Title"], self.movie_1_data["Title"])
@@ -135,7 +198,7 @@ class MovieRemoteRequestsTestCase(TestCase):
             movie_2.save()
         response = self.client.get('/api/movies')
         self.assertEqual(response.status_code, requests.codes.ok)
-        response_serialized = MovieSerializer(data=response.data, many=True)
+        response_serialized = MovieSerializer(data=response.data["results"], many=True)
         self.assertTrue(response_serialized.is_valid())
         self.assertEqual(len(response_serialized.data), 2)
         self.assertEqual(response_serialized.data[1]["Title"], self.movie_2_data["Title"])
@@ -245,7 +308,7 @@ class CommentsRequestsTestCase(TestCase):
         comment2_3 = Comment(comment_body='Movie2Test3', movie_id=Movie.objects.get(id=self.movie_2.data["id"]))
         comment2_3.save()
         response = self.client.get('/api/comments', format='json')
-        self.assertEqual(len(response.data), 5)
+        self.assertEqual(len(response.data["results"]), 5)
 
     def get_comments_with_movie_id(self):
         # not working - can't pass data with GET request, but working normally when server start
@@ -266,7 +329,1989 @@ class CommentsRequestsTestCase(TestCase):
         response = self.client.get('/api/comments', {"movie_id": self.movie_1.data["id"]}, format='json')
         self.assertEqual(response.status_code, 400)
 
+class CommentBatchTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.movie = Movie.objects.create(Title="Local movie")
+
+    def test_batch_is_written_with_constant_queries(self):
+        comments = [{"comment_body": f"Comment {number}", "movie_id": self.movie.id} for number in range(50)]
+        self.client.post('/api/comments/batch', {"comments": comments[:2]}, format="json")
+        etag = self.client.get('/api/comments')["ETag"]
+        # existence check, INSERT, last id, version bump, feed lock, change rows (+ savepoints, releases)
+        with self.assertNumQueries(10):
+            response = self.client.post('/api/comments/batch', {"comments": comments}, format="json")
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        self.assertEqual({result["status"] for result in results}, {"created"})
+        self.assertEqual([Comment.objects.get(id=result["id"]).comment_body for result in results],
+                         [comment["comment_body"] for comment in comments])
+        self.assertEqual(list(Change.objects.order_by("-id").values_list("object_id", flat=True)[:50]),
+                         [result["id"] for result in reversed(results)])
+        self.assertNotEqual(self.client.get('/api/comments')["ETag"], etag)
+
+    def test_invalid_comments_are_reported_per_item(self):
+        response = self.client.post('/api/comments/batch', {"comments": [
+            {"comment_body": "Fine", "movie_id": self.movie.id},
+            {"comment_body": "Lost", "movie_id": self.movie.id + 100},
+            {"comment_body": "x" * 101, "movie_id": self.movie.id},
+            "not a comment",
+        ]}, format="json")
+        self.assertEqual([result["status"] for result in response.data["results"]], ["created", "error", "error", "error"])
+        self.assertEqual(response.data["results"][1]["Error"], "No movie with that id")
+        self.assertEqual(list(Comment.objects.values_list("comment_body", flat=True)), ["Fine"])
+
+    def test_batch_without_bulk_insert_ids(self):
+        comments = [{"comment_body": f"Comment {number}", "movie_id": self.movie.id} for number in range(3)]
+        with mock.patch.object(connection, "vendor", "mysql"), \
+                mock.patch.object(connection.features, "can_return_ids_from_bulk_insert", False):
+            response = self.client.post('/api/comments/batch', {"comments": comments}, format="json")
+        results = response.data["results"]
+        self.assertEqual([Comment.objects.get(id=result["id"]).comment_body for result in results],
+                         [comment["comment_body"] for comment in comments])
+        self.assertEqual(Change.objects.filter(kind=Change.COMMENT).count(), 3)
+
+    @override_settings(COMMENT_FLUSH_SIZE=2)
+    def test_failed_chunk_saves_none_of_the_batch(self):
+        from . import views
+        comments = [{"comment_body": f"Comment {number}", "movie_id": self.movie.id} for number in range(4)]
+        before = Comment.objects.count()
+        bulk_create = views.bulk_create_comments
+        calls = []
+
+        def failing_second_chunk(chunk):
+            calls.append(chunk)
+            if len(calls) == 2:
+                raise OperationalError("disk I/O error")
+            return bulk_create(chunk)
+
+        with mock.patch.object(views, "bulk_create_comments", side_effect=failing_second_chunk):
+            response = self.client.post('/api/comments/batch', {"comments": comments}, format="json")
+        self.assertEqual((response.status_code, response["Retry-After"]), (503, "1"))
+        self.assertEqual(Comment.objects.count(), before)
+        response = self.client.post('/api/comments/batch', {"comments": comments}, format="json")
+        self.assertEqual(Comment.objects.count(), before + 4)
+
+    def test_bad_request(self):
+        self.assertEqual(self.client.post('/api/comments/batch', {"comments": []}, format="json").status_code, 400)
+        with override_settings(COMMENT_BATCH_MAX=1):
+            response = self.client.post('/api/comments/batch', {"comments": [{}, {}]}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(COMMENT_WRITE_BEHIND=True)
+class CommentWriteBehindTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.movie = Movie.objects.create(Title="Local movie")
+
+    def test_concurrent_comments_are_written_in_batches(self):
+        responses = []
+
+        def post(number):
+            responses.append(APIClient().post('/api/comments', {"comment_body": f"Comment {number}", "movie_id": self.movie.id}, format="json"))
+            connection.close()
+
+        from . import comment_buffer
+        with mock.patch.object(comment_buffer, "bulk_create_comments", wraps=comment_buffer.bulk_create_comments) as write:
+            with override_settings(COMMENT_FLUSH_INTERVAL=0.1):
+                threads = [threading.Thread(target=post, args=(number,)) for number in range(20)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len({response.data["id"] for response in responses}), 20)
+        self.assertEqual(Comment.objects.count(), 20)
+        self.assertLess(write.call_count, 20)
+
+    def test_errors_match_direct_writes(self):
+        client = APIClient()
+        unknown = client.post('/api/comments', {"comment_body": "Lost", "movie_id": self.movie.id + 100}, format="json")
+        self.assertEqual((unknown.status_code, unknown.data), (400, {"Error": "No movie with that id"}))
+        too_long = client.post('/api/comments', {"comment_body": "x" * 101, "movie_id": self.movie.id}, format="json")
+        self.assertEqual(too_long.status_code, 500)
+        self.assertEqual(Comment.objects.count(), 0)
+
+    def test_full_buffer_pushes_back(self):
+        from . import comment_buffer
+        release = threading.Event()
+
+        def slow_write(comments):
+            release.wait()
+            return [None] * len(comments)
+
+        with mock.patch.object(comment_buffer, "bulk_create_comments", slow_write):
+            buffer = CommentBuffer(max_size=1, flush_size=1, timeout=0.05)
+            futures = [buffer.submit(self.movie.id, "First")]
+            time.sleep(0.05)  # taken by the writer
+            futures.append(buffer.submit(self.movie.id, "Second"))
+            with self.assertRaises(BufferFull):
+                buffer.submit(self.movie.id, "Third")
+            release.set()
+            buffer.close()
+        self.assertTrue(all(future.done() for future in futures))
+
+    def test_slow_or_failed_writes_push_back(self):
+        from . import comment_buffer
+        from django.db import OperationalError
+        client = APIClient()
+        release = threading.Event()
+
+        def slow_write(comments):
+            release.wait()
+            return [None] * len(comments)
+
+        with mock.patch.object(comment_buffer, "bulk_create_comments", slow_write), \
+                override_settings(COMMENT_WRITE_TIMEOUT=0.05):
+            response = client.post('/api/comments', {"comment_body": "Slow", "movie_id": self.movie.id}, format="json")
+            release.set()
+        self.assertEqual((response.status_code, response["Retry-After"]), (503, "1"))
+
+        with mock.patch.object(comment_buffer, "bulk_create_comments", side_effect=OperationalError("database is locked")):
+            response = client.post('/api/comments', {"comment_body": "Locked", "movie_id": self.movie.id}, format="json")
+        self.assertEqual((response.status_code, response["Retry-After"]), (503, "1"))
+
+    def test_close_writes_pending_comments(self):
+        buffer = CommentBuffer(flush_size=100, interval=10)
+        futures = [buffer.submit(self.movie.id, body) for body in ("First", "Second")]
+        buffer.close()
+        self.assertEqual([future.result(timeout=0).comment_body for future in futures], ["First", "Second"])
+        with self.assertRaises(BufferFull):
+            buffer.submit(self.movie.id, "Late")
+
+
 class ReportsConfigTest(TestCase):
     def test_apps(self):
         self.assertEqual(MovieApiConfig.name, 'movie_api')
-        self.assertEqual(apps.get_app_config('movie_api').name, 'movie_api')
\ No newline at end of file
+        self.assertEqual(apps.get_app_config('movie_api').name, 'movie_api')
+
+
+class TitleResolutionCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = TitleResolutionCache(maxsize=2, negative_ttl=60, clock=lambda: self.now)
+        self.movie = Movie.objects.create(Title="Batman Begins")
+        title_cache.clear()
+
+    def test_normalize_title_folds_case_whitespace_and_punctuation(self):
+        self.assertEqual(normalize_title("  Batman:   BEGINS! "), "batman begins")
+        self.assertEqual(normalize_title("Schindler's List"), normalize_title("schindlers list"))
+        self.assertEqual(normalize_title("Amélie"), "amelie")
+
+    def test_cache_hit_for_equivalent_titles(self):
+        self.assertIsNone(self.cache.get("Batman Begins"))
+        self.cache.add("batman begins", self.movie)
+        self.assertEqual(self.cache.get("BATMAN - begins").movie_id, self.movie.id)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_lru_eviction(self):
+        self.cache.add("first", self.movie)
+        self.cache.add("second", self.movie)
+        self.cache.get("first")
+        self.cache.add("third", self.movie)
+        self.assertIsNone(self.cache.get("second"))
+        self.assertIsNotNone(self.cache.get("first"))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_negative_cache_expires(self):
+        self.cache.add_missing("SomeNonExistingMovie")
+        self.assertIs(self.cache.get("somenonexistingmovie"), NOT_FOUND)
+        self.now += 61
+        self.assertIsNone(self.cache.get("somenonexistingmovie"))
+        self.assertEqual(self.cache.stats()["negative_hits"], 1)
+
+    def test_post_for_stored_title_does_not_call_omdb(self):
+        client = APIClient()
+        hits_before = title_cache.stats()["hits"]
+        with mock.patch.object(OmdbClient, "get_movie", side_effect=AssertionError("OMDb called")):
+            first = client.post('/api/movies', {'title': 'batman begins'}, format='json')
+            second = client.post('/api/movies', {'title': 'Batman Begins'}, format='json')
+        self.assertEqual(first.data["id"], self.movie.id)
+        self.assertEqual(second.data["id"], self.movie.id)
+        self.assertEqual(title_cache.stats()["hits"] - hits_before, 1)
+
+    def test_post_for_unknown_title_is_negatively_cached(self):
+        client = APIClient()
+        upstream = {"Response": "False", "Error": "Movie not found!"}
+        with mock.patch.object(OmdbClient, "get_movie", return_value=upstream) as get:
+            client.post('/api/movies', {'title': 'SomeNonExistingMovie'}, format='json')
+            response = client.post('/api/movies', {'title': 'somenonexistingmovie'}, format='json')
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(response.status_code, requests.codes.no_content)
+
+
+class SingleFlightTestCase(TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight(lease_timeout=1, result_ttl=5, poll_interval=0.01)
+        self.movie = Movie.objects.create(Title="Batman")
+
+    def test_result_of_other_worker_is_reused(self):
+        """A lease completed by another worker answers without running the lookup."""
+        self.flight.do("title:batman", lambda: self.movie)
+        result = self.flight.do("title:batman", mock.Mock(side_effect=AssertionError("lookup repeated")))
+        self.assertEqual(result, self.movie)
+
+    def test_waits_for_lease_held_by_other_worker(self):
+        self.flight.do("title:batman", lambda: None)
+        lease = LookupLease.objects.get()
+        LookupLease.objects.filter(id=lease.id).update(
+            token="other-worker", completed=False, expires_at=timezone.now() + timedelta(seconds=30))
+
+        def finish(*args):
+            LookupLease.objects.filter(id=lease.id).update(completed=True, movie=self.movie)
+
+        with mock.patch("movie_api.singleflight.time.sleep", side_effect=finish) as sleep:
+            result = self.flight.do("title:batman", mock.Mock(side_effect=AssertionError("lookup repeated")))
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(result, self.movie)
+
+    def test_expired_lease_is_taken_over(self):
+        self.flight.do("title:batman", lambda: None)
+        LookupLease.objects.update(
+            token="dead-worker", completed=False, expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.flight.do("title:batman", lambda: self.movie), self.movie)
+
+    def test_new_lease_deletes_expired_rows(self):
+        self.flight.do("title:batman", lambda: self.movie)
+        LookupLease.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.flight.do("title:superman", lambda: None)
+        self.assertEqual(LookupLease.objects.count(), 1)
+
+    def test_failed_lookup_releases_lease(self):
+        with self.assertRaises(ValueError):
+            self.flight.do("title:batman", mock.Mock(side_effect=ValueError))
+        self.assertFalse(LookupLease.objects.exists())
+
+
+class ConcurrentLookupsTestCase(FakeOmdbMixin, TransactionTestCase):
+    omdb_latency = 0.2
+
+    def setUp(self):
+        title_cache.clear()
+
+    def test_burst_of_lookups_makes_one_upstream_call(self):
+        results = []
+
+        def lookup():
+            try:
+                results.append(resolve_title("batman"))
+            finally:
+                connection.close()
+
+        requests_before = self.omdb.requests
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.omdb.requests - requests_before, 1)
+        self.assertEqual(Movie.objects.filter(Title="Batman").count(), 1)
+        self.assertEqual({movie.id for movie in results}, {Movie.objects.get().id})
+
+
+class OmdbClientTestCase(TestCase):
+
+    def test_lookups_reuse_one_connection(self):
+        with FakeOmdbServer(OMDB_MOVIES) as omdb:
+            client = OmdbClient("28cb1743", url=omdb.url)
+            self.assertEqual(client.get_movie("Batman")["imdbID"], "tt0096895")
+            self.assertEqual(client.get_movie("batman")["imdbID"], "tt0096895")
+            self.assertEqual(client.get_movie("Nothing Like It")["Response"], "False")
+            client.close()
+        self.assertEqual(omdb.requests, 3)
+        self.assertEqual(len(omdb.connections), 1)
+
+    def test_server_errors_are_retried_within_budget(self):
+        with FakeOmdbServer(OMDB_MOVIES, error_rate=1) as omdb:
+            client = OmdbClient("28cb1743", url=omdb.url, max_retries=2, backoff=0.01)
+            with self.assertRaises(OmdbError):
+                client.get_movie("Batman")
+            client.close()
+        self.assertEqual(omdb.requests, 3)
+
+    def test_other_request_errors_are_retried_as_omdb_errors(self):
+        client = OmdbClient("28cb1743", max_retries=2, backoff=0.01)
+        failures = [requests.exceptions.ChunkedEncodingError("cut off"),
+                    requests.exceptions.ContentDecodingError("bad gzip"),
+                    requests.exceptions.TooManyRedirects("loop")]
+        with mock.patch.object(client.session, "get", side_effect=failures) as get:
+            with self.assertRaisesRegex(OmdbError, "loop"):
+                client.get_movie("Batman")
+        self.assertEqual(get.call_count, 3)
+        client.close()
+
+    def test_slow_upstream_times_out(self):
+        with FakeOmdbServer(OMDB_MOVIES, latency=0.5) as omdb:
+            client = OmdbClient("28cb1743", url=omdb.url, read_timeout=0.1, max_retries=0)
+            started = time.monotonic()
+            with self.assertRaises(OmdbError):
+                client.get_movie("Batman")
+            self.assertLess(time.monotonic() - started, 0.5)
+            client.close()
+
+    def test_invalid_api_key_is_not_a_missing_movie(self):
+        with FakeOmdbServer(OMDB_MOVIES) as omdb:
+            client = OmdbClient("bad-key", url=omdb.url)
+            with self.assertRaises(OmdbError):
+                client.get_movie("Batman")
+            client.close()
+        self.assertEqual(omdb.requests, 1)
+
+
+class MovieBatchTestCase(FakeOmdbMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        title_cache.clear()
+        self.stored = Movie.objects.create(Title="The Avengers", imdbID="tt0848228")
+
+    def test_batch_creates_missing_and_reuses_stored_movies(self):
+        requests_before = self.omdb.requests
+        response = self.client.post('/api/movies/batch', {'titles': ['Batman', 'The Avengers', 'django', 'SomeNonExistingMovie', 'Batman']}, format='json')
+        self.assertEqual(response.status_code, requests.codes.ok)
+        results = response.data["results"]
+        self.assertEqual([result["status"] for result in results], ["created", "existing", "created", "not_found"])
+        self.assertEqual(results[1]["id"], self.stored.id)
+        self.assertEqual(self.omdb.requests - requests_before, 3)
+        batman = Movie.objects.get(Title="Batman")
+        self.assertEqual(results[0]["id"], batman.id)
+        self.assertEqual(batman.Ratings.count(), 3)
+        self.assertEqual(Movie.objects.get(Title="Django").Ratings.count(), 2)
+
+        response = self.client.post('/api/movies/batch', {'titles': ['Batman', 'DJANGO']}, format='json')
+        self.assertEqual([result["status"] for result in response.data["results"]], ["existing", "existing"])
+        self.assertEqual(Movie.objects.filter(Title="Django").count(), 1)
+
+    def test_batch_asks_once_per_normalized_title_and_closes_worker_connections(self):
+        requests_before = self.omdb.requests
+        with mock.patch("movie_api.resolver.connections") as connections:
+            response = self.client.post('/api/movies/batch', {'titles': ['Batman', 'batman', 'BATMAN']}, format='json')
+        self.assertEqual(self.omdb.requests - requests_before, 1)
+        self.assertEqual(connections.close_all.call_count, 1)
+        results = response.data["results"]
+        self.assertEqual([result["title"] for result in results], ['Batman', 'batman', 'BATMAN'])
+        self.assertEqual(len({result["id"] for result in results}), 1)
+
+    def test_batch_reports_partial_failures(self):
+        get_movie = OmdbClient.get_movie
+
+        def flaky_get_movie(client, title):
+            if title == "Django":
+                raise OmdbError("timeout")
+            return get_movie(client, title)
+
+        with mock.patch.object(OmdbClient, "get_movie", autospec=True, side_effect=flaky_get_movie):
+            response = self.client.post('/api/movies/batch', {'titles': ['Batman', 'Django']}, format='json')
+        self.assertEqual([result["status"] for result in response.data["results"]], ["created", "error"])
+        self.assertFalse(Movie.objects.filter(Title="Django").exists())
+
+    def test_batch_reports_movies_inserted_meanwhile_as_existing(self):
+        from . import resolver
+        bulk_create = resolver.bulk_create_movies
+        raced = []
+
+        def racing_bulk_create(movies_data):
+            if not raced:
+                # Another worker stores Batman between our imdbID lookup and the INSERT.
+                raced.append(Movie.objects.create(Title="Batman", imdbID="tt0096895"))
+            return bulk_create(movies_data)
+
+        with mock.patch.object(resolver, "bulk_create_movies", side_effect=racing_bulk_create):
+            response = self.client.post('/api/movies/batch', {'titles': ['Batman', 'Django']}, format='json')
+        self.assertEqual(response.status_code, requests.codes.ok)
+        results = response.data["results"]
+        self.assertEqual([result["status"] for result in results], ["existing", "created"])
+        self.assertEqual(results[0]["id"], raced[0].id)
+        self.assertEqual(Movie.objects.filter(imdbID="tt0096895").count(), 1)
+        self.assertTrue(Movie.objects.filter(Title="Django").exists())
+
+    def test_batch_with_bad_data(self):
+        self.assertEqual(self.client.post('/api/movies/batch', {'title': 'Batman'}, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/movies/batch', {'titles': ['Batman', '']}, format='json').status_code, 400)
+        with self.settings(MOVIE_BATCH_MAX_TITLES=1):
+            self.assertEqual(self.client.post('/api/movies/batch', {'titles': ['Batman', 'Django']}, format='json').status_code, 400)
+
+
+class CursorPaginationTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.movies = [Movie.objects.create(Title=f"Movie {number}") for number in range(5)]
+        for movie in self.movies[:3]:
+            Comment.objects.create(comment_body=f"About {movie.Title}", movie_id=self.movies[0])
+        Comment.objects.create(comment_body="Other", movie_id=self.movies[1])
+
+    def collect_ids(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, requests.codes.ok)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            ids.extend(item["id"] for item in response.data["results"])
+            url = response.data["next"]
+        return ids
+
+    def test_movies_are_paged_with_cursor(self):
+        movie_ids = [movie.id for movie in self.movies]
+        self.assertEqual(self.collect_ids('/api/movies?page_size=2'), movie_ids)
+        self.assertEqual(self.collect_ids('/api/movies?page_size=2&order=dsc'), movie_ids[::-1])
+
+    def test_page_size_in_body(self):
+        response = self.client.generic("GET", '/api/movies', json.dumps({"page_size": 2, "order": "dsc"}),
+                                       content_type="application/json")
+        self.assertEqual([movie["id"] for movie in response.data["results"]],
+                         [movie.id for movie in reversed(self.movies)][:2])
+
+    def test_previous_link_goes_back(self):
+        first = self.client.get('/api/movies?page_size=2')
+        second = self.client.get(first.data["next"])
+        self.assertIsNone(first.data["previous"])
+        back = self.client.get(second.data["previous"])
+        self.assertEqual(back.data["results"], first.data["results"])
+
+    def test_page_is_a_single_query(self):
+        first = self.client.get('/api/comments?page_size=2')
+        # plus the table version read by the response cache
+        with self.assertNumQueries(2):
+            self.client.get(first.data["next"])
+
+    def test_comments_are_paged_within_movie_filter(self):
+        ids = self.collect_ids(f'/api/comments?page_size=2&movie_id={self.movies[0].id}')
+        self.assertEqual(ids, list(Comment.objects.filter(movie_id=self.movies[0]).values_list("id", flat=True)))
+
+    def test_unpaginated_listing_behind_flag(self):
+        response = self.client.get('/api/movies?paginate=false&order=dsc')
+        self.assertEqual([movie["id"] for movie in response.data], [movie.id for movie in reversed(self.movies)])
+        response = self.client.get('/api/comments?paginate=false')
+        self.assertEqual(len(response.data), 4)
+
+
+class MovieListingQueriesTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def add_movies(self, count):
+        for number in range(count):
+            movie = Movie.objects.create(Title=f"Movie {number}")
+            Rating.objects.create(Source="Internet Movie Database", Value="7.0/10", Movie=movie)
+            Rating.objects.create(Source="Metacritic", Value="70/100", Movie=movie)
+
+    def test_listing_query_count_does_not_grow_with_movies(self):
+        # movies (with their payloads) and the table version read by the response cache
+        self.add_movies(3)
+        with self.assertNumQueries(2):
+            self.client.get('/api/movies')
+        self.add_movies(30)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/movies?page_size=30')
+        self.assertEqual(len(response.data["results"]), 30)
+        with self.assertNumQueries(2):
+            self.client.get('/api/movies?paginate=false')
+        # serialized: movies, their ratings and the table version
+        with self.settings(MOVIE_PAYLOADS=False), self.assertNumQueries(3):
+            self.client.get('/api/movies?page_size=20')
+
+    def test_read_serializer_gives_same_json_as_movie_serializer(self):
+        data = dict(OMDB_MOVIES[0])
+        serializer = MovieSerializer(data=data)
+        self.assertTrue(serializer.is_valid())
+        movie = serializer.save()
+        movie = Movie.objects.prefetch_related("Ratings").get(id=movie.id)
+        self.assertEqual(MovieReadSerializer(movie).data, MovieSerializer(movie).data)
+
+
+@override_settings(STREAM_CHUNK_SIZE=2)
+class StreamingListingTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        for number in range(5):
+            movie = Movie.objects.create(Title=f"Movie {number}")
+            Rating.objects.create(Source="Metacritic", Value=f"{number}0/100", Movie=movie)
+            Comment.objects.create(comment_body=f"Comment {number}", movie_id=movie)
+
+    def test_stream_json_array_matches_full_listing(self):
+        expected = json.loads(self.client.get('/api/movies?paginate=false&order=dsc').content)
+        response = self.client.get('/api/movies?stream=1&order=dsc')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), expected)
+
+    def test_stream_runs_one_query_per_chunk(self):
+        response = self.client.get('/api/movies?stream=1')
+        with self.assertNumQueries(3):
+            body = b"".join(response.streaming_content)
+        self.assertEqual(len(json.loads(body)), 5)
+
+    @override_settings(MOVIE_PAYLOADS=False)
+    def test_serialized_stream_runs_one_query_pair_per_chunk(self):
+        response = self.client.get('/api/movies?stream=1')
+        with self.assertNumQueries(6):
+            body = b"".join(response.streaming_content)
+        self.assertEqual(len(json.loads(body)), 5)
+
+    def test_ndjson_stream_by_accept_header(self):
+        response = self.client.get('/api/comments', HTTP_ACCEPT="application/x-ndjson")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line)["comment_body"] for line in lines], [f"Comment {number}" for number in range(5)])
+
+    def test_empty_stream(self):
+        Movie.objects.all().delete()
+        response = self.client.get('/api/movies?stream=true')
+        self.assertEqual(b"".join(response.streaming_content), b"[]")
+
+
+class MovieLookupKeysTestCase(FakeOmdbMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        title_cache.clear()
+
+    def test_title_key_is_filled_on_save(self):
+        movie = Movie.objects.create(Title="Batman: The Movie!", imdbID="tt0060153")
+        self.assertEqual(movie.title_key, "batman the movie")
+        self.assertNotIn("title_key", MovieSerializer(movie).data)
+
+    def test_post_finds_stored_movie_by_imdb_id(self):
+        stored = Movie.objects.create(Title="Batman (1989)", imdbID="tt0096895")
+        response = self.client.post('/api/movies', {'title': 'Batman'}, format='json')
+        self.assertEqual(response.data["id"], stored.id)
+        self.assertEqual(Movie.objects.count(), 1)
+
+    def test_blank_imdb_ids_are_stored_as_null(self):
+        for title in ("Home Movie", "Another Home Movie"):
+            serializer = MovieSerializer(data=dict(OMDB_MOVIES[0], Title=title, imdbID="", Ratings=[]))
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            serializer.save()
+        self.assertEqual(Movie.objects.filter(imdbID=None).count(), 2)
+
+    def test_insert_race_returns_row_of_other_worker(self):
+        from .resolver import _store_movie
+        stored = Movie.objects.create(Title="Batman", imdbID="tt0096895")
+        # Not there yet on the first look, there when the INSERT fails.
+        with mock.patch("movie_api.resolver._stored_by_imdb_id", side_effect=[None, stored]):
+            self.assertEqual(_store_movie(dict(OMDB_MOVIES[0])), stored)
+        self.assertEqual(Movie.objects.count(), 1)
+
+
+class DeduplicateMoviesMigrationTestCase(TransactionTestCase):
+
+    def migrate(self, target=None):
+        from django.db.migrations.executor import MigrationExecutor
+        executor = MigrationExecutor(connection)
+        targets = [("movie_api", target)] if target else executor.loader.graph.leaf_nodes("movie_api")
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate()
+
+    def test_duplicated_movies_are_merged(self):
+        old_apps = self.migrate("0003_movie_title_key")
+        OldMovie = old_apps.get_model("movie_api", "Movie")
+        OldComment = old_apps.get_model("movie_api", "Comment")
+        keep = OldMovie.objects.create(Title="Batman", imdbID="tt0096895")
+        copy = OldMovie.objects.create(Title="Batman", imdbID="tt0096895")
+        OldMovie.objects.create(Title="No id", imdbID="")
+        OldMovie.objects.create(Title="No id either", imdbID="")
+        OldComment.objects.create(comment_body="On the copy", movie_id_id=copy.id)
+
+        new_apps = self.migrate("0005_unique_imdbid")
+        NewMovie = new_apps.get_model("movie_api", "Movie")
+        NewComment = new_apps.get_model("movie_api", "Comment")
+        self.assertEqual(list(NewMovie.objects.filter(imdbID="tt0096895").values_list("id", flat=True)), [keep.id])
+        self.assertEqual(NewComment.objects.get().movie_id_id, keep.id)
+        self.assertEqual(NewMovie.objects.filter(imdbID=None).count(), 2)
+        self.assertEqual(NewMovie.objects.get(id=keep.id).title_key, "batman")
+
+
+class MovieFilteringTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        rows = [
+            ("Goodfellas", "1990", "8.7", "1,000,000", "$46,836,394"),
+            ("Pulp Fiction", "1994", "8.9", "1,900,000", "$107,928,762"),
+            ("Fargo", "1996", "8.1", "600,000", "$24,611,975"),
+            ("Heat", "1995", "8.3", "580,000", "$67,436,818"),
+            ("Casino", "1995", "8.2", "480,000", "N/A"),
+            ("Se7en", "1995", "8.6", "1,500,000", "$100,125,643"),
+            ("Tie One", "1998", "8.2", "1,000", "N/A"),
+            ("Tie Two", "1999", "8.2", "2,000", "N/A"),
+            ("Unrated", "1997", "N/A", "N/A", "N/A"),
+            ("Batman Begins", "2005", "8.3", "1,150,889", "$204,100,000"),
+            ("Series", "2010–2014", "7.0", "10", "N/A"),
+        ]
+        for title, year, rating, votes, box_office in rows:
+            Movie.objects.create(Title=title, Year=year, imdbRating=rating, imdbVotes=votes, BoxOffice=box_office)
+
+    def titles(self, url):
+        titles = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, requests.codes.ok, response.data)
+            titles.extend(movie["Title"] for movie in response.data["results"])
+            url = response.data["next"]
+        return titles
+
+    def test_numeric_columns_are_parsed_on_save(self):
+        movie = Movie.objects.get(Title="Batman Begins")
+        self.assertEqual((movie.year_value, movie.imdb_rating_value, movie.imdb_votes_value, movie.box_office_value),
+                         (2005, 8.3, 1150889, 204100000))
+        unrated = Movie.objects.get(Title="Unrated")
+        self.assertIsNone(unrated.imdb_rating_value)
+        self.assertEqual(Movie.objects.get(Title="Series").year_value, 2010)
+        self.assertNotIn("imdb_rating_value", self.client.get('/api/movies').data["results"][0])
+
+    def test_top_rated_films_of_the_nineties(self):
+        titles = self.titles('/api/movies?year_min=1990&year_max=1999&sort=rating&order=dsc&page_size=2')
+        self.assertEqual(titles, ["Pulp Fiction", "Goodfellas", "Se7en", "Heat", "Tie Two", "Tie One", "Casino", "Fargo"])
+
+    def test_sort_by_box_office_and_votes(self):
+        self.assertEqual(self.titles('/api/movies?sort=box_office&box_office_gte=50000000'),
+                         ["Heat", "Se7en", "Pulp Fiction", "Batman Begins"])
+        self.assertEqual(self.titles('/api/movies?sort=votes&votes_lte=2,000&page_size=1'), ["Series", "Tie One", "Tie Two"])
+
+    def test_previous_page_with_tied_values(self):
+        first = self.client.get('/api/movies?rating_gte=8.2&rating_lte=8.2&sort=rating&page_size=2')
+        second = self.client.get(first.data["next"])
+        back = self.client.get(second.data["previous"])
+        self.assertEqual([movie["Title"] for movie in back.data["results"]],
+                         [movie["Title"] for movie in first.data["results"]])
+        self.assertEqual(len(first.data["results"]) + len(second.data["results"]), 3)
+        self.assertIsNone(second.data["next"])
+
+    def test_sorted_stream_matches_pages(self):
+        expected = self.titles('/api/movies?sort=rating&order=dsc&page_size=3')
+        response = self.client.get('/api/movies?sort=rating&order=dsc&stream=1')
+        self.assertEqual([movie["Title"] for movie in json.loads(b"".join(response.streaming_content))], expected)
+
+    def test_bad_filter_parameters(self):
+        self.assertEqual(self.client.get('/api/movies?year_min=nineties').status_code, 400)
+        self.assertEqual(self.client.get('/api/movies?sort=Title').status_code, 400)
+        self.assertEqual(self.client.get('/api/movies?sort=rating&cursor=bm9uc2Vuc2U=').status_code, 404)
+
+
+class MovieSearchTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.batman = MovieSerializer(data=OMDB_MOVIES[0])
+        self.assertTrue(self.batman.is_valid())
+        self.batman.save()
+        Movie.objects.create(Title="Inception", Director="Christopher Nolan", Writer="Christopher Nolan",
+                             Plot="A thief who steals corporate secrets through dream-sharing technology.", Genre="Sci-Fi")
+        Movie.objects.create(Title="Memento", Director="Christopher Nolan", Writer="Jonathan Nolan",
+                             Plot="A man with short-term memory loss attempts to track down his wife's murderer.", Genre="Mystery")
+        Movie.objects.create(Title="Nolan", Plot="A documentary.", Genre="Documentary")
+
+    def search(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, requests.codes.ok)
+        return [movie["Title"] for movie in response.data["results"]]
+
+    def test_search_over_people_plot_and_genre(self):
+        self.assertEqual(set(self.search('/api/movies/search?q=nolan')), {"Inception", "Memento", "Nolan"})
+        self.assertEqual(self.search('/api/movies/search?q=Joker'), ["Batman"])
+        self.assertEqual(self.search('/api/movies/search?q=christopher+nolan+dream'), ["Inception"])
+        self.assertEqual(self.search('/api/movies/search?q=mystery'), ["Memento"])
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('/api/movies/search?q=nolan')[0], "Nolan")
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        Movie.objects.bulk_create([Movie(Title="Dunkirk", Director="Christopher Nolan")])
+        self.assertIn("Dunkirk", self.search('/api/movies/search?q=dunkirk'))
+        movie = Movie.objects.get(Title="Dunkirk")
+        movie.Title = "Tenet"
+        movie.save()
+        self.assertEqual(self.search('/api/movies/search?q=dunkirk'), [])
+        movie.delete()
+        self.assertEqual(self.search('/api/movies/search?q=tenet'), [])
+
+    def test_index_skips_updates_of_other_columns(self):
+        from .search import backend
+        if backend() != "fts5":
+            self.skipTest("needs the SQLite FTS5 index")
+        movie = Movie.objects.get(Title="Memento")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT total_changes()")
+            before = cursor.fetchone()[0]
+            Movie.objects.filter(id=movie.id).update(fetched_at=timezone.now(), payload=None)
+            cursor.execute("SELECT total_changes()")
+            self.assertEqual(cursor.fetchone()[0] - before, 1)
+        self.assertEqual(self.search('/api/movies/search?q=memento'), ["Memento"])
+
+    def test_search_is_paginated(self):
+        first = self.client.get('/api/movies/search?q=nolan&page_size=2')
+        self.assertEqual(len(first.data["results"]), 2)
+        second = self.client.get(first.data["next"])
+        self.assertEqual(len(second.data["results"]), 1)
+        self.assertIsNone(second.data["next"])
+        self.assertIsNotNone(second.data["previous"])
+
+    def test_search_needs_query_and_ignores_query_syntax(self):
+        self.assertEqual(self.client.get('/api/movies/search').status_code, 400)
+        self.assertEqual(self.search('/api/movies/search?q=%22nolan%22+OR+NEAR(*'), [])
+
+    def test_rebuild_command(self):
+        from django.core.management import call_command
+        from io import StringIO
+        output = StringIO()
+        call_command("rebuild_search_index", stdout=output)
+        self.assertIn("rebuilt", output.getvalue())
+        self.assertEqual(set(self.search('/api/movies/search?q=nolan')), {"Inception", "Memento", "Nolan"})
+
+
+class ResponseCacheTestCase(FakeOmdbMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.movie = Movie.objects.create(Title="Local movie")
+        Comment.objects.create(movie_id=self.movie, comment_body="First")
+
+    def count_movies(self):
+        return len(json.loads(self.client.get('/api/movies').content)["results"])
+
+    def test_repeated_get_is_served_from_cache(self):
+        first = self.client.get('/api/movies')
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/movies')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(second["Content-Type"], first["Content-Type"])
+
+    def test_if_none_match_gives_304(self):
+        etag = self.client.get('/api/comments')["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/comments', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+    def test_etag_depends_on_parameters_and_format(self):
+        etags = {
+            self.client.get('/api/movies')["ETag"],
+            self.client.get('/api/movies?order=dsc')["ETag"],
+            self.client.get('/api/movies', HTTP_ACCEPT="application/x-ndjson")["ETag"],
+        }
+        self.assertEqual(len(etags), 3)
+
+    def test_post_comment_invalidates_comments_only(self):
+        movies_etag = self.client.get('/api/movies')["ETag"]
+        comments_etag = self.client.get('/api/comments')["ETag"]
+        self.client.post('/api/comments', {"movie_id": self.movie.id, "comment_body": "Second"}, format="json")
+
+        response = self.client.get('/api/comments', HTTP_IF_NONE_MATCH=comments_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertEqual(self.client.get('/api/movies', HTTP_IF_NONE_MATCH=movies_etag).status_code, 304)
+
+    def test_post_movie_invalidates_movies(self):
+        self.assertEqual(self.count_movies(), 1)
+        self.client.post('/api/movies', {"title": "Django"}, format="json")
+        self.assertEqual(self.count_movies(), 2)
+        self.client.post('/api/movies/batch', {"titles": ["Batman"]}, format="json")
+        self.assertEqual(self.count_movies(), 3)
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.client.get('/api/comments?movie_id=999').status_code, 400)
+        self.assertNotIn("ETag", self.client.get('/api/comments?movie_id=999'))
+
+
+class ChangeFeedTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.since = latest_sequence()
+        self.movie = Movie.objects.create(Title="Local movie")
+        self.comment = Comment.objects.create(movie_id=self.movie, comment_body="First")
+
+    def feed(self, since, **params):
+        response = self.client.get('/api/changes', dict(params, since=since))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_changes_after_cursor(self):
+        feed = self.feed(self.since)
+        self.assertEqual([(change["type"], change["id"]) for change in feed["changes"]],
+                         [("movie", self.movie.id), ("comment", self.comment.id)])
+        self.assertEqual(feed["changes"][1]["data"]["comment_body"], "First")
+        self.assertFalse(feed["more"])
+        self.assertEqual(self.feed(feed["next"])["changes"], [])
+
+        self.comment.comment_body = "Edited"
+        self.comment.save()
+        Rating.objects.create(Movie=self.movie, Source="Metacritic", Value="50/100")
+        changes = self.feed(feed["next"])["changes"]
+        self.assertEqual([(change["type"], change["data"]["id"]) for change in changes],
+                         [("comment", self.comment.id), ("movie", self.movie.id)])
+        self.assertEqual(changes[0]["data"]["comment_body"], "Edited")
+        self.assertEqual(len(changes[1]["data"]["Ratings"]), 1)
+
+    def test_object_is_listed_once_at_its_last_change(self):
+        second = Comment.objects.create(movie_id=self.movie, comment_body="Second")
+        deleted_id = self.comment.id
+        self.comment.delete()
+        changes = self.feed(self.since)["changes"]
+        self.assertEqual([(change["type"], change["id"], change["deleted"]) for change in changes],
+                         [("movie", self.movie.id, False), ("comment", second.id, False), ("comment", deleted_id, True)])
+        self.assertIsNone(changes[2]["data"])
+
+    def test_prune_keeps_what_consumers_need(self):
+        second = Comment.objects.create(movie_id=self.movie, comment_body="Second")
+        self.comment.comment_body = "Edited"
+        self.comment.save()
+        second_id = second.id
+        second.delete()
+        Change.objects.update(at=timezone.now() - timedelta(days=31))
+        fresh = Comment.objects.create(movie_id=self.movie, comment_body="Fresh")
+        fresh_id = fresh.id
+        fresh.delete()
+        before = self.feed(self.since)["changes"]
+
+        from django.core.management import call_command
+        from io import StringIO
+        output = StringIO()
+        call_command("prune_changes", stdout=output)
+        self.assertIn("Deleted 3 changes", output.getvalue())
+        after = self.feed(self.since)["changes"]
+        # The old deletion is gone; everything else reads as before.
+        self.assertEqual(after, [change for change in before if change["id"] != second_id])
+        call_command("prune_changes", "--days", "0", stdout=output)
+        self.assertEqual(list(Change.objects.values_list("kind", "object_id", "deleted")),
+                         [("movie", self.movie.id, False), ("comment", self.comment.id, False),
+                          ("comment", fresh_id, True)])
+
+    def test_pages_by_page_size(self):
+        feed = self.feed(self.since, page_size=1)
+        self.assertEqual((len(feed["changes"]), feed["more"]), (1, True))
+        self.assertEqual(self.feed(feed["next"], page_size=1)["changes"][0]["type"], "comment")
+
+    def test_bulk_inserts_are_recorded(self):
+        data = MovieSerializer(data=dict(OMDB_MOVIES[0]))
+        self.assertTrue(data.is_valid())
+        movie, = bulk_create_movies([data.validated_data])
+        self.assertEqual(Change.objects.latest("id").object_id, movie.id)
+
+    def test_invalid_parameters(self):
+        for params in ({"since": "x"}, {"since": -1}, {"since": 0, "wait": "soon"}):
+            self.assertEqual(self.client.get('/api/changes', params).status_code, 400)
+
+
+class ChangeFeedLongPollTestCase(TransactionTestCase):
+
+    @override_settings(CHANGE_FEED_POLL_INTERVAL=10)
+    def test_waiting_request_wakes_up_on_commit(self):
+        movie = Movie.objects.create(Title="Local movie")
+        since = latest_sequence()
+
+        def comment():
+            time.sleep(0.2)
+            Comment.objects.create(movie_id=movie, comment_body="New")
+            connection.close()
+
+        writer = threading.Thread(target=comment)
+        writer.start()
+        started = time.monotonic()
+        feed = APIClient().get('/api/changes', {"since": since, "wait": 5}).data
+        writer.join()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual([change["data"]["comment_body"] for change in feed["changes"]], ["New"])
+
+    def test_interleaved_writers_commit_in_sequence_order(self):
+        movie = Movie.objects.create(Title="Local movie")
+        since = latest_sequence()
+        locked, committed = threading.Event(), []
+
+        def slow_writer():
+            with transaction.atomic():
+                Comment.objects.create(movie_id=movie, comment_body="Slow")
+                locked.set()
+                time.sleep(0.3)
+            committed.append("Slow")
+            connection.close()
+
+        def fast_writer():
+            locked.wait()
+            while True:
+                try:
+                    with transaction.atomic():
+                        Comment.objects.create(movie_id=movie, comment_body="Fast")
+                    break
+                except OperationalError:
+                    # SQLite's shared in-memory test database fails at once instead of waiting.
+                    time.sleep(0.01)
+            committed.append("Fast")
+            connection.close()
+
+        writers = [threading.Thread(target=slow_writer), threading.Thread(target=fast_writer)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        # The second writer waited for the first one's commit before taking a sequence number.
+        self.assertEqual(committed, ["Slow", "Fast"])
+        feed = APIClient().get('/api/changes', {"since": since}).data
+        self.assertEqual([change["data"]["comment_body"] for change in feed["changes"]], ["Slow", "Fast"])
+        self.assertLess(feed["changes"][0]["seq"], feed["changes"][1]["seq"])
+
+    def test_feed_lock_is_taken_before_the_sequence_number(self):
+        movie = Movie.objects.create(Title="Local movie")
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            record_changes(Change.MOVIE, [movie.id])
+        statements = [query["sql"] for query in queries.captured_queries
+                      if not re.match(r"BEGIN|SAVEPOINT|RELEASE", query["sql"])]
+        self.assertRegex(statements[0], r'^UPDATE "movie_api_tableversion"')
+        self.assertRegex(statements[1], r'^INSERT INTO "movie_api_change"')
+
+    def test_wait_times_out_without_changes(self):
+        started = time.monotonic()
+        feed = APIClient().get('/api/changes', {"since": latest_sequence(), "wait": 0.3}).data
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+        self.assertEqual(feed["changes"], [])
+
+
+class MetricsTestCase(FakeOmdbMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        title_cache.clear()
+
+    def sample(self, line_start):
+        for line in metrics.render().splitlines():
+            if line.startswith(line_start + " "):
+                return float(line.rsplit(" ", 1)[1])
+        return 0
+
+    def test_requests_are_counted_per_route(self):
+        requests_line = 'http_requests_total{route="MoviesView",method="GET",status="200"}'
+        queries_line = 'http_request_db_queries_count{route="MoviesView"}'
+        before = self.sample(requests_line), self.sample(queries_line)
+        self.client.get('/api/movies', {"sort": "rating"})
+        self.assertEqual(self.sample(requests_line), before[0] + 1)
+        self.assertEqual(self.sample(queries_line), before[1] + 1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        text = response.content.decode("utf-8")
+        self.assertIn("# TYPE http_request_duration_seconds histogram", text)
+        self.assertIn('http_request_duration_seconds_bucket{route="MoviesView",method="GET",le="+Inf"}', text)
+
+    def test_omdb_calls_are_recorded(self):
+        calls_line = 'omdb_requests_total{outcome="200"}'
+        upstream_line = 'http_request_omdb_duration_seconds_count{route="MoviesView"}'
+        before = self.sample(calls_line), self.sample(upstream_line)
+        self.assertEqual(self.client.post('/api/movies', {"title": "Django"}, format="json").status_code, 200)
+        self.assertEqual(self.sample(calls_line), before[0] + 1)
+        self.assertEqual(self.sample(upstream_line), before[1] + 1)
+
+    def test_title_cache_counts_are_exported(self):
+        before = (self.sample('title_cache_lookups_total{result="hit"}'),
+                  self.sample('title_cache_lookups_total{result="miss"}'))
+        self.client.post('/api/movies', {"title": "Django"}, format="json")
+        self.client.post('/api/movies', {"title": "django"}, format="json")
+        self.assertEqual(self.sample('title_cache_lookups_total{result="miss"}'), before[1] + 1)
+        self.assertEqual(self.sample('title_cache_lookups_total{result="hit"}'), before[0] + 1)
+        self.assertEqual(self.sample('title_cache_entries{cache="movies"}'), 1)
+        text = metrics.render()
+        self.assertIn("# TYPE title_cache_lookups_total counter", text)
+        self.assertIn("title_cache_evictions_total ", text)
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.client.post('/api/movies', {"title": "Batman"}, format="json")
+        timing = response["Server-Timing"]
+        self.assertIn('omdb;dur=', timing)
+        self.assertIn('desc="1 calls"', timing)
+        self.assertRegex(timing, r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+        self.assertIn("serialize;dur=", timing)
+
+    def test_no_server_timing_by_default(self):
+        self.assertFalse(self.client.get('/api/comments').has_header("Server-Timing"))
+
+
+class AsgiTestCase(FakeOmdbMixin, TransactionTestCase):
+    omdb_latency = 0.3
+
+    def setUp(self):
+        title_cache.clear()
+        self.app = MovieApiAsgi(get_wsgi_application())
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(close_async_client())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def request(self, method, path, body=None, query=b"", headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8") if body is not None else b""
+        headers = [(b"content-type", b"application/json"), (b"host", b"testserver")] + list(headers)
+        scope = {"type": "http", "method": method, "path": path, "query_string": query, "headers": headers,
+                 "http_version": "1.1", "scheme": "http", "server": ("testserver", 80), "client": ("127.0.0.1", 1)}
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.app(scope, receive, send)
+        content = b"".join(message.get("body", b"") for message in messages[1:])
+        return messages[0]["status"], dict(messages[0]["headers"]), content
+
+    def run_requests(self, *requests):
+        return self.loop.run_until_complete(asyncio.gather(*requests))
+
+    def test_async_post_matches_sync_view(self):
+        (status, headers, content), = self.run_requests(self.request("POST", "/api/movies", {"title": "Batman"}))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b"content-type"], b"application/json")
+        self.assertEqual(json.loads(content), json.loads(json.dumps(MovieSerializer(Movie.objects.get()).data)))
+
+        requests_before = self.omdb.requests
+        response = APIClient().post('/api/movies', {"title": "batman"}, format="json")
+        self.assertEqual(json.loads(response.content), json.loads(content))
+        self.assertEqual(self.omdb.requests, requests_before)
+
+    def test_async_post_errors(self):
+        missing, unknown, = self.run_requests(
+            self.request("POST", "/api/movies", {}),
+            self.request("POST", "/api/movies", {"title": f"Unknown {uuid.uuid4()}"}),
+        )
+        self.assertEqual(missing[0], 400)
+        self.assertEqual(unknown[0], 204)
+        self.assertEqual(json.loads(unknown[2]), {"Error": "No movie with that title"})
+
+    def test_async_post_when_keys_are_exhausted(self):
+        with override_settings(OMDB_API_KEYS=["bad"]):
+            (status, headers, content), = self.run_requests(self.request("POST", "/api/movies", {"title": "Batman"}))
+            self.loop.run_until_complete(close_async_client())
+        self.assertEqual(status, 503)
+        self.assertGreaterEqual(int(headers[b"retry-after"]), 1)
+
+    @override_settings(DATABASE_REPLICAS=["replica"], METRICS_SERVER_TIMING=True)
+    def test_async_post_goes_through_middleware(self):
+        (status, headers, content), = self.run_requests(self.request("POST", "/api/movies", {"title": "Batman"}))
+        self.assertEqual(status, 200)
+        self.assertIn(b"db_pinned=1", headers[b"set-cookie"])
+        timing = headers[b"server-timing"].decode("latin-1")
+        self.assertIn('desc="1 calls"', timing)
+        # The view serializes with one query; the lookup's queries ran on ASGI_DB_THREADS.
+        self.assertGreater(int(re.search(r'desc="([0-9]+) queries"', timing).group(1)), 10)
+
+    def test_concurrent_lookups_make_one_upstream_call(self):
+        requests_before = self.omdb.requests
+        responses = self.run_requests(*[self.request("POST", "/api/movies", {"title": "Django"}) for _ in range(20)])
+        self.assertEqual({status for status, headers, content in responses}, {200})
+        self.assertEqual(self.omdb.requests - requests_before, 1)
+        self.assertEqual(Movie.objects.count(), 1)
+
+    def test_lookups_do_not_hold_threads(self):
+        movie = Movie.objects.create(Title="Local movie")
+        Comment.objects.create(movie_id=movie, comment_body="First")
+        finished = {}
+
+        async def timed(name, request):
+            result = await request
+            finished[name] = time.monotonic()
+            return result
+
+        started = time.monotonic()
+        lookups = [self.request("POST", "/api/movies", {"title": f"Unknown {uuid.uuid4()}"}) for _ in range(100)]
+        results = self.run_requests(
+            *[timed(f"lookup {number}", request) for number, request in enumerate(lookups)],
+            timed("comments", self.request("GET", "/api/comments", headers=[(b"accept", b"application/json")])),
+        )
+        # 100 lookups of 0.3 s each, far more than ASGI_DB_THREADS / ASGI_WSGI_THREADS
+        self.assertLess(max(finished.values()) - started, 3)
+        self.assertLess(finished["comments"], min(value for name, value in finished.items() if name != "comments"))
+        status, headers, content = results[-1]
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(content)["results"]), 1)
+
+    def test_other_routes_go_to_django(self):
+        Movie.objects.create(Title="Local movie")
+        (status, headers, content), = self.run_requests(
+            self.request("GET", "/api/movies", query=b"stream=ndjson"))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b"content-type"], b"application/x-ndjson")
+        self.assertEqual(json.loads(content)["Title"], "Local movie")
+        (status, headers, content), = self.run_requests(self.request("POST", "/api/movies", b"{"))
+        self.assertEqual(status, 400)
+        self.assertIn("JSON parse error", json.loads(content)["detail"])
+
+
+class TokenBucketTestCase(TestCase):
+
+    def test_bucket_refills_at_rate(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.assertAlmostEqual(bucket.wait_time(), 0.5)
+        now[0] = 0.5
+        self.assertTrue(bucket.try_acquire())
+        now[0] = 100
+        self.assertEqual(bucket.available, 2)
+
+    def test_acquire_sleeps_until_token(self):
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        bucket = TokenBucket(rate=4, capacity=1, clock=lambda: now[0], sleep=sleep)
+        for _ in range(5):
+            bucket.acquire()
+        self.assertAlmostEqual(now[0], 1.0)
+
+    def test_daily_reservations_are_capped(self):
+        self.assertEqual(reserve_calls("test", 3, 5), 3)
+        self.assertEqual(reserve_calls("test", 3, 5), 2)
+        self.assertEqual(reserve_calls("test", 3, 5), 0)
+        self.assertEqual(calls_today("test"), 5)
+
+
+class KeyPoolTestCase(FakeOmdbMixin, TestCase):
+
+    def pool(self, keys, now=None, **kwargs):
+        clock = (lambda: now[0]) if now is not None else time.monotonic
+        return KeyPool(keys, clock=clock, **kwargs)
+
+    def test_calls_go_to_least_used_key(self):
+        pool = self.pool(["a", "b"], rate=100, reserve_block=2)
+        used = [pool.acquire().value for _ in range(10)]
+        self.assertEqual((used.count("a"), used.count("b")), (5, 5))
+        # Calls are counted in reserved blocks of 2.
+        self.assertEqual(sum(calls_today(key.name) for key in pool.keys), 10 + sum(key.allowance for key in pool.keys))
+
+    def test_status_reports_calls_made_and_reserved(self):
+        pool = self.pool(["a"], rate=100, reserve_block=10)
+        for _ in range(3):
+            pool.acquire()
+        status, = pool.status()
+        self.assertEqual((status["calls_today"], status["quota_used_today"], status["reserved"]), (3, 10, 7))
+        # A restarted worker doesn't make the calls reserved before.
+        restarted = self.pool(["a"], rate=100, reserve_block=10)
+        restarted.acquire()
+        status, = restarted.status()
+        self.assertEqual((status["calls_today"], status["quota_used_today"]), (4, 20))
+
+    def test_rate_limit_scales_with_keys(self):
+        now = [0.0]
+        single = self.pool(["a"], now, rate=2, max_wait=0)
+        single.acquire(), single.acquire()
+        with self.assertRaises(KeysExhausted):
+            single.acquire()
+        double = self.pool(["a", "b"], now, rate=2, max_wait=0)
+        for _ in range(4):
+            double.acquire()
+
+    def test_daily_limit_is_shared_between_workers(self):
+        workers = [self.pool(["a"], rate=100, daily_limit=5, reserve_block=2) for _ in range(2)]
+        calls = 0
+        for _ in range(3):
+            for worker in workers:
+                try:
+                    worker.acquire()
+                    calls += 1
+                except KeysExhausted as exc:
+                    self.assertGreaterEqual(exc.retry_after, 1)
+        self.assertLessEqual(calls, 5)
+        self.assertEqual(calls_today(workers[0].keys[0].name), 5)
+
+    def test_rejected_keys_are_skipped(self):
+        with FakeOmdbServer(OMDB_MOVIES, api_keys=["good", "limited"], daily_limits={"limited": 1}) as omdb:
+            pool = self.pool(["bad", "limited", "good"], rate=100, daily_limit=50)
+            client = OmdbClient(None, url=omdb.url, key_pool=pool)
+            for _ in range(4):
+                self.assertEqual(client.get_movie("Batman")["imdbID"], "tt0096895")
+            bad, limited, good = pool.keys
+            self.assertGreater(bad.quarantined_until, time.monotonic())
+            self.assertTrue(limited.exhausted)
+            self.assertEqual(calls_today(limited.name), 50)
+            self.assertEqual(omdb.key_calls["bad"], 1)
+            self.assertEqual(omdb.key_calls["limited"], 2)
+
+            client.key_pool = pool = self.pool(["bad"], rate=100)
+            with self.assertRaises(KeysExhausted):
+                client.get_movie("Batman")
+
+            # Rejected keys count against the retries.
+            client.key_pool = self.pool([f"bad {number}" for number in range(5)], rate=100)
+            client.max_retries = 1
+            calls_before = omdb.requests
+            with self.assertRaises(OmdbError):
+                client.get_movie("Batman")
+            self.assertEqual(omdb.requests - calls_before, 2)
+            client.close()
+
+    def test_post_fails_fast_when_keys_are_exhausted(self):
+        title_cache.clear()
+        with override_settings(OMDB_API_KEYS=["bad"]):
+            response = APIClient().post('/api/movies', {"title": "Batman"}, format="json")
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+        # Not remembered as a missing title.
+        self.assertEqual(APIClient().post('/api/movies', {"title": "Batman"}, format="json").status_code, 200)
+
+
+class MovieRefreshTestCase(FakeOmdbMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        outdated = dict(OMDB_MOVIES[0], imdbRating="7.0", imdbVotes="1,000", Ratings=[
+            {"Source": "Internet Movie Database", "Value": "7.0/10"},
+            {"Source": "Old Source", "Value": "1/5"},
+        ])
+        serializer = MovieSerializer(data=outdated)
+        self.assertTrue(serializer.is_valid())
+        self.batman = serializer.save()
+        serializer = MovieSerializer(data=OMDB_MOVIES[1])
+        self.assertTrue(serializer.is_valid())
+        self.django = serializer.save(fetched_at=timezone.now())
+
+    def refresher(self, **kwargs):
+        kwargs.setdefault("rate", 1000)
+        return MovieRefresher(**kwargs)
+
+    def test_refresh_updates_changed_columns_and_ratings(self):
+        self.assertEqual(self.client.get('/api/movies').data["results"][0]["imdbRating"], "7.0")
+        stats = self.refresher().run()
+        self.assertEqual((stats["fetched"], stats["updated"]), (1, 1))
+
+        batman = Movie.objects.get(id=self.batman.id)
+        self.assertEqual(batman.imdbRating, "7.6")
+        self.assertEqual(batman.imdb_votes_value, 303988)
+        self.assertIsNotNone(batman.fetched_at)
+        self.assertEqual(sorted(batman.Ratings.values_list("Source", "Value")),
+                         sorted((rating["Source"], rating["Value"]) for rating in OMDB_MOVIES[0]["Ratings"]))
+        # cached listing is invalidated
+        self.assertEqual(json.loads(self.client.get('/api/movies').content)["results"][0]["imdbRating"], "7.6")
+
+    def test_fresh_and_unchanged_movies_are_not_rewritten(self):
+        self.refresher().run()
+        requests_before = self.omdb.requests
+        self.assertEqual(dict(self.refresher().run()), {})
+        self.assertEqual(self.omdb.requests, requests_before)
+
+        Movie.objects.update(fetched_at=None)
+        etag = self.client.get('/api/movies')["ETag"]
+        stats = self.refresher().run()
+        self.assertEqual((stats["fetched"], stats["updated"], stats["unchanged"]), (2, 0, 2))
+        self.assertEqual(self.client.get('/api/movies')["ETag"], etag)
+
+    def test_popular_movies_first_within_quota(self):
+        Movie.objects.filter(id=self.django.id).update(fetched_at=None)
+        Comment.objects.create(movie_id=self.django, comment_body="Popular")
+        self.assertEqual([movie.id for movie in stale_movies()], [self.django.id, self.batman.id])
+
+        stats = self.refresher(daily_quota=1).run()
+        self.assertEqual(stats["fetched"], 1)
+        self.assertIsNone(Movie.objects.get(id=self.batman.id).fetched_at)
+        self.assertEqual(self.refresher(daily_quota=1).run()["quota_exhausted"], 1)
+        self.assertEqual(calls_today("refresh"), 1)
+
+    def test_failed_calls_leave_movie_stale(self):
+        with override_settings(OMDB_API_URL="http://127.0.0.1:9/", OMDB_MAX_RETRIES=0):
+            stats = self.refresher().run()
+        self.assertEqual(stats["failed"], 1)
+        self.assertIsNone(Movie.objects.get(id=self.batman.id).fetched_at)
+
+    @override_settings(OMDB_API_KEYS=["spent"], OMDB_KEY_DAILY_LIMIT=0)
+    def test_quota_is_given_back_when_no_key_is_left(self):
+        self.assertEqual(self.refresher().run()["keys_exhausted"], 1)
+        self.assertEqual(calls_today("refresh"), 0)
+
+    def test_movies_are_ranked_once_per_run(self):
+        Movie.objects.update(fetched_at=None)
+        missing = Movie.objects.create(Title="Nothing Like It")
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.refresher(batch_size=1).run()
+        self.assertEqual(len([query for query in queries.captured_queries if "COUNT(" in query["sql"]]), 1)
+        self.assertEqual((stats["fetched"], stats["updated"], stats["missing"], stats["unchanged"]), (3, 1, 1, 1))
+        self.assertIsNotNone(Movie.objects.get(id=missing.id).fetched_at)
+
+    def test_worker_threads_close_their_connections(self):
+        with mock.patch("movie_api.refresh.connections") as connections:
+            self.assertEqual(self.refresher().run()["fetched"], 1)
+        self.assertEqual(connections.close_all.call_count, 1)
+
+    def test_command(self):
+        from django.core.management import call_command
+        from io import StringIO
+        output = StringIO()
+        call_command("refresh_movies", "--limit", "5", stdout=output)
+        self.assertIn("updated: 1", output.getvalue())
+
+
+class MovieImportTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "movies.jsonl")
+
+    def write_file(self, records, path=None):
+        path = path or self.path
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "wt") as output:
+            for record in records:
+                output.write((record if isinstance(record, str) else json.dumps(record)) + "\n")
+        return path
+
+    def catalogue(self, count):
+        return [dict(OMDB_MOVIES[0], Title=f"Movie {number}", imdbID=f"tt{number:07d}") for number in range(count)]
+
+    def test_import_creates_movies_with_ratings(self):
+        records = self.catalogue(5) + ["not json", {"Response": "False", "Error": "Movie not found!"},
+                                       dict(OMDB_MOVIES[1], Year=None), ""]
+        stats = MovieImporter(self.write_file(records), chunk_size=2).run()
+        self.assertEqual((stats["created"], stats["invalid"], stats["lines"]), (5, 3, 9))
+        self.assertEqual(Movie.objects.count(), 5)
+        self.assertEqual(Rating.objects.count(), 15)
+        movie = Movie.objects.get(imdbID="tt0000003")
+        self.assertEqual((movie.Title, movie.imdb_votes_value, movie.fetched_at), ("Movie 3", 303988, None))
+        self.assertFalse(os.path.exists(self.path + ".checkpoint"))
+
+    def test_import_updates_stored_movies_by_imdb_id(self):
+        serializer = MovieSerializer(data=OMDB_MOVIES[1])
+        self.assertTrue(serializer.is_valid())
+        stored = serializer.save()
+        changed = dict(OMDB_MOVIES[1], imdbRating="8.0", Ratings=[{"Source": "Internet Movie Database", "Value": "8.0/10"}])
+        path = self.write_file([OMDB_MOVIES[0], OMDB_MOVIES[1], changed], self.path + ".gz")
+
+        stats = MovieImporter(path).run()
+        self.assertEqual((stats["created"], stats["updated"]), (1, 1))
+        stored.refresh_from_db()
+        self.assertEqual((stored.imdbRating, stored.imdb_rating_value), ("8.0", 8.0))
+        self.assertEqual(list(stored.Ratings.values_list("Value", flat=True)), ["8.0/10"])
+
+        stats = MovieImporter(path).run()
+        self.assertEqual((stats["created"], stats["updated"], stats["unchanged"]), (0, 0, 2))
+
+    def test_interrupted_import_resumes_from_checkpoint(self):
+        self.write_file(self.catalogue(6))
+        calls = []
+
+        def fail_third_chunk(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 3:
+                raise RuntimeError("disk full")
+            return bulk_create_movies(*args, **kwargs)
+
+        with mock.patch("movie_api.importer.bulk_create_movies", side_effect=fail_third_chunk):
+            with self.assertRaises(RuntimeError):
+                MovieImporter(self.path, chunk_size=2).run()
+        self.assertEqual(Movie.objects.count(), 4)
+        with open(self.path + ".checkpoint") as checkpoint:
+            self.assertEqual(json.load(checkpoint)["line"], 4)
+
+        stats = MovieImporter(self.path, chunk_size=2).run()
+        self.assertEqual((stats["created"], stats["lines"], stats["unchanged"]), (6, 6, 0))
+        self.assertEqual(Movie.objects.count(), 6)
+
+    def test_workers_and_command(self):
+        from django.core.management import call_command
+        from io import StringIO
+        self.write_file(self.catalogue(30))
+        output = StringIO()
+        call_command("import_movies", self.path, "--workers", "2", "--chunk-size", "4", stdout=output)
+        self.assertIn("created: 30", output.getvalue())
+        self.assertIn("rows/s", output.getvalue())
+        self.assertEqual(Movie.objects.count(), 30)
+
+
+class CatalogExportTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.movies = []
+        for data in OMDB_MOVIES:
+            serializer = MovieSerializer(data=data)
+            self.assertTrue(serializer.is_valid())
+            self.movies.append(serializer.save())
+        Comment.objects.create(movie_id=self.movies[1], comment_body="Great")
+
+    def test_ndjson_export_joins_ratings_and_comments(self):
+        path = os.path.join(self.directory, "catalog.ndjson.gz")
+        with self.assertNumQueries(5):  # movies, then ratings and comments of each chunk
+            stats = CatalogExporter(path, chunk_size=1).run()
+        self.assertEqual((stats["movies"], stats["last_id"]), (2, self.movies[1].id))
+        with gzip.open(path, "rt") as exported:
+            rows = [json.loads(line) for line in exported]
+        self.assertEqual(rows[0], dict(MovieReadSerializer(self.movies[0]).data, Comments=[]))
+        self.assertEqual(rows[1]["Comments"], [{"id": Comment.objects.get().id, "comment_body": "Great"}])
+
+    def test_csv_export(self):
+        import csv
+        path = os.path.join(self.directory, "catalog.csv")
+        CatalogExporter(path, "csv", comments=False).run()
+        with open(path, newline="") as exported:
+            rows = list(csv.DictReader(exported))
+        self.assertEqual([row["Title"] for row in rows], ["Batman", "Django"])
+        self.assertEqual(json.loads(rows[1]["Ratings"]), [{"Source": "Internet Movie Database", "Value": "7.2/10"},
+                                                          {"Source": "Rotten Tomatoes", "Value": "92%"}])
+        self.assertNotIn("Comments", rows[0])
+
+    def test_incremental_command(self):
+        from django.core.management import call_command
+        from io import StringIO
+        state = os.path.join(self.directory, "state.json")
+        path = os.path.join(self.directory, "catalog.ndjson")
+        output = StringIO()
+        call_command("export_catalog", path, "--state", state, stdout=output)
+        self.assertIn("Exported 2 movies", output.getvalue())
+        self.assertIn("rows/s", output.getvalue())
+
+        newer = Movie.objects.create(Title="Newer", imdbID="tt9999999")
+        call_command("export_catalog", path, "--state", state, stdout=output)
+        with open(path) as exported:
+            self.assertEqual([json.loads(line)["id"] for line in exported], [newer.id])
+
+
+class SparseFieldsTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        for data in OMDB_MOVIES:
+            serializer = MovieSerializer(data=dict(data, Ratings=[dict(rating) for rating in data["Ratings"]]))
+            self.assertTrue(serializer.is_valid())
+            serializer.save()
+        self.django = Movie.objects.get(Title="Django")
+        Comment.objects.create(movie_id=self.django, comment_body="Great")
+
+    def test_fields_narrow_query_and_output(self):
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/movies?fields=Title,Year,imdbRating&sort=rating')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0], {"id": self.django.id, "Title": "Django", "Year": "1966",
+                                                       "imdbRating": "7.2"})
+        # ETag versions and one page of movies, without Plot and without Ratings
+        self.assertEqual(len(queries), 2)
+        self.assertIn('"Title"', queries[1]["sql"])
+        self.assertNotIn('"Plot"', queries[1]["sql"])
+        # the cursor of a narrowed page still works
+        self.assertEqual(len(self.client.get('/api/movies?fields=Title&page_size=1').data["results"]), 1)
+
+    def test_ratings_and_comments_are_expansions(self):
+        full = self.client.get('/api/movies').data["results"][1]
+        self.assertIn("Ratings", full)
+        self.assertNotIn("Comments", full)
+
+        movie = self.client.get('/api/movies?fields=Title,Ratings,Comments').data["results"][1]
+        self.assertEqual(set(movie), {"id", "Title", "Ratings", "Comments"})
+        self.assertEqual(len(movie["Ratings"]), 2)
+        self.assertEqual(movie["Comments"], [{"id": Comment.objects.get().id, "comment_body": "Great"}])
+
+        # a new comment changes listings with Comments only
+        etag = self.client.get('/api/movies?fields=Title')["ETag"]
+        expanded = self.client.get('/api/movies?fields=Title,Comments')["ETag"]
+        Comment.objects.create(movie_id=self.django, comment_body="Again")
+        self.assertEqual(self.client.get('/api/movies?fields=Title')["ETag"], etag)
+        self.assertNotEqual(self.client.get('/api/movies?fields=Title,Comments')["ETag"], expanded)
+
+    def test_fields_in_streams_and_search(self):
+        response = self.client.get('/api/movies?fields=Title&stream=ndjson')
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([set(row) for row in rows], [{"id", "Title"}] * 2)
+        found = self.client.get('/api/movies/search?q=django&fields=Year').data["results"]
+        self.assertEqual(found, [{"id": self.django.id, "Year": "1966"}])
+
+    def test_unknown_field(self):
+        response = self.client.get('/api/movies?fields=Title,title_key')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("title_key", response.data["Error"])
+
+
+class CompressionTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        Movie.objects.bulk_create([Movie(Title=f"Movie {number}", Plot="A long plot. " * 20) for number in range(20)])
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding("gzip, deflate"), "gzip")
+        self.assertIsNone(choose_encoding("gzip;q=0, identity"))
+        self.assertIsNone(choose_encoding(""))
+        self.assertEqual(choose_encoding("*"), choose_encoding("br, gzip"))
+
+    def test_large_responses_are_gzipped(self):
+        plain = self.client.get('/api/movies')
+        response = self.client.get('/api/movies', HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertLess(len(response.content), len(plain.content) / 5)
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        # the weak ETag of a compressed response still gives 304
+        self.assertEqual(response["ETag"], "W/" + plain["ETag"])
+        revalidated = self.client.get('/api/movies', HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_small_and_streamed_responses(self):
+        response = self.client.get('/api/movies?fields=Title&page_size=1', HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        response = self.client.get('/api/movies?stream=ndjson', HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(len(gzip.decompress(b"".join(response.streaming_content)).splitlines()), 20)
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """default is the primary; replicas are SQLite files with its schema."""
+
+    @classmethod
+    def setUpClass(cls):
+        import sqlite3
+        cls.directory = tempfile.TemporaryDirectory()
+        # Copied before TestCase opens its transaction: a backup waits for it to end.
+        connection.ensure_connection()
+        cls.snapshot = os.path.join(cls.directory.name, "snapshot.sqlite3")
+        replica = sqlite3.connect(cls.snapshot)
+        connection.connection.backup(replica)
+        replica.close()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.directory.cleanup()
+
+    def setUp(self):
+        from OMDB_API_bridge import db_router
+        self.db_router = db_router
+        self.client = APIClient()
+        self.replicated = Movie.objects.create(Title="Replicated")
+        self.add_replica("replica_a")
+        self.primary_only = Movie.objects.create(Title="Primary only")
+        self.addCleanup(db_router._down_until.clear)
+        self.addCleanup(db_router._checked_at.clear)
+
+    def add_replica(self, alias, healthy=True):
+        """Replica holding the movies stored so far."""
+        import shutil
+        from django.db import connections
+        path = os.path.join(self.directory.name, alias + ".sqlite3")
+        if healthy:
+            shutil.copy(self.snapshot, path)
+        else:
+            path = os.path.join(self.directory.name, "missing", alias + ".sqlite3")
+        connections.databases[alias] = {"ENGINE": "django.db.backends.sqlite3", "NAME": path}
+        connections.ensure_defaults(alias)
+        connections.prepare_test_settings(alias)
+
+        def remove():
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+        self.addCleanup(remove)
+        if healthy:
+            for movie in Movie.objects.all():
+                movie.save(using=alias)
+            for version in TableVersion.objects.all():
+                version.save(using=alias)
+
+    def titles(self):
+        return [movie["Title"] for movie in json.loads(self.client.get('/api/movies?fields=Title').content)["results"]]
+
+    def test_reads_go_to_replica_until_client_writes(self):
+        with override_settings(DATABASE_REPLICAS=["replica_a"]):
+            self.assertEqual(self.titles(), ["Replicated"])
+            response = self.client.post('/api/comments', {"movie_id": self.primary_only.id, "comment_body": "Mine"},
+                                        format="json")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(self.db_router.PIN_COOKIE, response.cookies)
+            # pinned to the primary: the client sees its own write
+            self.assertEqual(self.titles(), ["Replicated", "Primary only"])
+            self.assertEqual(json.loads(self.client.get('/api/comments').content)["results"][0]["comment_body"], "Mine")
+
+            self.client.cookies.clear()
+            self.assertEqual(self.titles(), ["Replicated"])
+            # outside requests everything uses the primary
+            self.assertEqual(Movie.objects.count(), 2)
+
+    @override_settings(DATABASE_REPLICAS=["replica_a"], METRICS_SERVER_TIMING=True)
+    def test_streams_and_metrics_follow_replica_reads(self):
+        response = self.client.get('/api/movies?fields=Title&stream=1')
+        self.assertEqual([movie["Title"] for movie in json.loads(b"".join(response.streaming_content))], ["Replicated"])
+
+        response = self.client.get('/api/movies?fields=Title')
+        self.assertRegex(response["Server-Timing"], r'desc="[1-9][0-9]* queries"')
+
+    @override_settings(DATABASE_REPLICAS=["replica_a"])
+    def test_search_ranks_on_the_replica_it_reads(self):
+        # Not replicated yet, and the better match.
+        Movie.objects.create(Title="Replicated Replicated")
+        response = self.client.get('/api/movies/search', {"q": "replicated", "fields": "Title", "page_size": 1})
+        data = json.loads(response.content)
+        self.assertEqual([movie["Title"] for movie in data["results"]], ["Replicated"])
+        self.assertIsNone(data["next"])
+
+    def test_round_robin_skips_unhealthy_replicas(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from OMDB_API_bridge.db_router import replica_status, ReplicaRouter, ReplicaRoutingMiddleware
+        self.add_replica("replica_b")
+        self.add_replica("replica_down", healthy=False)
+        router = ReplicaRouter()
+        chosen = []
+
+        def view(request):
+            chosen.extend(router.db_for_read(Movie) for _ in range(4))
+            return HttpResponse()
+
+        with override_settings(DATABASE_REPLICAS=["replica_a", "replica_b", "replica_down"]):
+            ReplicaRoutingMiddleware(view)(RequestFactory().get('/api/movies'))
+            self.assertEqual(sorted(set(chosen)), ["replica_a", "replica_b"])
+            self.assertEqual(chosen.count("replica_a"), 2)
+            self.assertEqual(replica_status(), {"replica_a": True, "replica_b": True, "replica_down": False})
+
+            chosen.clear()
+            ReplicaRoutingMiddleware(view)(RequestFactory().post('/api/comments'))
+            self.assertEqual(set(chosen), {"default"})
+
+        with override_settings(DATABASE_REPLICAS=["replica_down"]):
+            self.assertEqual(self.titles(), ["Replicated", "Primary only"])
+
+
+@override_settings(FUZZY_TITLE_MATCHING=True, FUZZY_INDEX_SYNC_INTERVAL=0)
+class FuzzyTitleTestCase(FakeOmdbMixin, TestCase):
+
+    def setUp(self):
+        reset_title_index()
+        self.addCleanup(reset_title_index)
+        title_cache.clear()
+        self.addCleanup(title_cache.clear)
+        self.client = APIClient()
+        self.begins = Movie.objects.create(Title="Batman Begins", Year="2005")
+        self.django = Movie.objects.create(Title="Django", Year="1966")
+        self.sunshine = Movie.objects.create(Title="Eternal Sunshine of the Spotless Mind", Year="2004")
+
+    def post(self, title):
+        requests_before = self.omdb.requests
+        response = self.client.post('/api/movies', {"title": title}, format="json")
+        return response, self.omdb.requests - requests_before
+
+    def test_similar_titles_resolve_locally(self):
+        for title in ["Batman Begins (2005)", "batman begins 2005"]:
+            response, upstream_calls = self.post(title)
+            self.assertEqual((response.status_code, response.data["Title"], upstream_calls),
+                             (200, "Batman Begins", 0), title)
+        for title in ["eternal sunshine of the spotless mnd", "Eternal Sunshin of the Spotless Mind (2004)"]:
+            response, upstream_calls = self.post(title)
+            self.assertEqual((response.data["id"], upstream_calls), (self.sunshine.id, 0), title)
+
+    def test_year_and_numbers_must_match(self):
+        for title in ["Batman Begins (1999)", "Django 2", "Batman"]:
+            response, upstream_calls = self.post(title)
+            self.assertEqual(upstream_calls, 1, title)
+        self.assertEqual(Movie.objects.count(), 4)  # Batman (1989) from OMDb
+
+    def test_other_films_with_similar_titles_are_fetched(self):
+        for title in ["Alien", "Predator", "Frozen", "Rocky II"]:
+            Movie.objects.create(Title=title)
+        sequels = ["Aliens", "Predators", "Frozen II", "Rocky III"]
+        self.assertEqual([match_title(title) for title in sequels], [None] * 4)
+        # Not even at a low threshold (they are 0.6 to 0.9 similar).
+        self.assertEqual([match_title(title, threshold=0.6) for title in sequels], [None] * 4)
+        with override_settings(FUZZY_TITLE_THRESHOLD=0.6):
+            for title in sequels:
+                response, upstream_calls = self.post(title)
+                self.assertEqual((response.status_code, upstream_calls), (204, 1), title)
+
+    def test_threshold(self):
+        with override_settings(FUZZY_TITLE_THRESHOLD=0.9):
+            self.assertEqual(self.post("eternal sunshine of the spotless mnd")[1], 1)
+        with override_settings(FUZZY_TITLE_MATCHING=False):
+            self.assertEqual(self.post("Batman Begins (2005)")[1], 1)
+
+    def test_years_out_of_range_are_indexed_without_year(self):
+        Movie.objects.create(Title="The Long Count of Days", Year="1,000,000")
+        response, upstream_calls = self.post("the long cont of days")
+        self.assertEqual((response.status_code, response.data["Title"], upstream_calls),
+                         (200, "The Long Count of Days", 0))
+        Movie.objects.create(Title="Before the Beginning of Time", Year="-50000")
+        self.assertEqual(self.post("before the beginnng of time")[0].data["Title"], "Before the Beginning of Time")
+
+    def test_index_follows_inserts(self):
+        self.post("eternal sunshine of the spotless mnd")
+        created = bulk_create_movies([{"Title": "Once Upon a Time in the West", "Year": "1968",
+                                       "imdbID": "tt0064116"}])
+        response, upstream_calls = self.post("once upon a time in the wst")
+        self.assertEqual((response.data["id"], upstream_calls), (created[0].id, 0))
+
+    def test_index_search(self):
+        index = TitleIndex()
+        index.add(1, "batman begins", 2005)
+        index.add(2, "batman returns", 1992)
+        index.add(3, "the dark knight", 2008)
+        self.assertEqual([movie_id for movie_id, score in index.search("batman begin")], [1])
+        self.assertEqual(index.search("batman returns", year=2005), [])
+        index.remove(1)
+        self.assertEqual(index.search("batman begins"), [])
+        self.assertEqual(split_year("batman begins 2005"), ("batman begins", 2005))
+        self.assertEqual(split_year("blade runner"), ("blade runner", None))
+
+
+
+class MoviePayloadTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        for data in OMDB_MOVIES:
+            serializer = MovieSerializer(data=self.fresh(data))
+            self.assertTrue(serializer.is_valid())
+            serializer.save()
+        self.batman = Movie.objects.get(Title="Batman")
+
+    @staticmethod
+    def fresh(data, **fields):
+        # Saves elsewhere add the "pk" of stored rows to OMDB_MOVIES ratings.
+        ratings = [{"Source": rating["Source"], "Value": rating["Value"]} for rating in data["Ratings"]]
+        return dict(data, Ratings=ratings, **fields)
+
+    def stored(self, movie):
+        return json.loads(Movie.objects.get(id=movie.id).payload)
+
+    def live(self, movie):
+        movie = Movie.objects.prefetch_related("Ratings").get(id=movie.id)
+        return json.loads(json.dumps(MovieReadSerializer(movie).data))
+
+    def test_writes_keep_payloads_current(self):
+        self.assertEqual(self.stored(self.batman), self.live(self.batman))
+        rating = Rating.objects.create(Movie=self.batman, Source="Letterboxd", Value="3.9/5")
+        self.assertEqual(self.stored(self.batman)["Ratings"][-1], {"Source": "Letterboxd", "Value": "3.9/5"})
+        rating.delete()
+        self.assertEqual(len(self.stored(self.batman)["Ratings"]), 3)
+
+        with transaction.atomic():
+            bulk_update_movies([(self.batman, {"Plot": "New plot",
+                                               "Ratings": [{"Source": "Metacritic", "Value": "70/100"}]})])
+        self.assertEqual(self.stored(self.batman)["Plot"], "New plot")
+        self.assertEqual(self.stored(self.batman), self.live(self.batman))
+        heat, = bulk_create_movies([{"Title": "Heat", "imdbID": "tt0113277",
+                                     "Ratings": [{"Source": "Metacritic", "Value": "76/100"}]}])
+        self.assertEqual(self.stored(heat), self.live(heat))
+
+    def test_serializer_save_refreshes_once(self):
+        from .payloads import refresh_payloads
+        serializer = MovieSerializer(data=self.fresh(OMDB_MOVIES[0], imdbID="tt0103776", Title="Batman Returns"))
+        self.assertTrue(serializer.is_valid())
+        with mock.patch("movie_api.payloads.refresh_payloads", wraps=refresh_payloads) as refresh:
+            movie = serializer.save()
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(self.stored(movie), self.live(movie))
+
+    def test_listings_match_serialized_output(self):
+        cache = caches[settings.RESPONSE_CACHE_ALIAS]
+        for url in ['/api/movies', '/api/movies?paginate=false&order=dsc', '/api/movies?sort=rating&page_size=1',
+                    '/api/movies/search?q=django', '/api/movies?stream=ndjson']:
+            cache.clear()
+            stored = self.client.get(url)
+            cache.clear()
+            with self.settings(MOVIE_PAYLOADS=False):
+                serialized = self.client.get(url)
+            self.assertEqual(b"".join(stored) if stored.streaming else stored.content,
+                             b"".join(serialized) if serialized.streaming else serialized.content, url)
+        self.assertEqual(self.client.get('/api/movies').data["results"][0]["Title"], "Batman")
+        # indented (as the browsable API asks): the payloads are parsed and rendered again
+        indented = self.client.get('/api/movies', HTTP_ACCEPT="application/json; indent=2")
+        self.assertIn(b'\n      "Title": "Django"', indented.content)
+
+    def test_missing_payloads_and_rebuild_command(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from io import StringIO
+        Movie.objects.filter(id=self.batman.id).update(payload=None)
+        self.assertEqual(json.loads(self.client.get('/api/movies').content)["results"][0], self.live(self.batman))
+
+        Movie.objects.filter(id=self.batman.id).update(payload='{"Title":"Stale"}')
+        output = StringIO()
+        with self.assertRaisesMessage(CommandError, f"1 movie payloads differ from the serializer output (ids {self.batman.id})"):
+            call_command("rebuild_movie_payloads", "--check", stdout=output)
+        call_command("rebuild_movie_payloads", stdout=output)
+        self.assertIn("Rebuilt 2 movie payloads", output.getvalue())
+        call_command("rebuild_movie_payloads", "--check", stdout=output)
+        self.assertEqual(self.stored(self.batman), self.live(self.batman))
+
+
+@override_settings(OMDB_MAX_RETRIES=0, OMDB_BREAKER_MIN_CALLS=3)
+class CircuitBreakerTestCase(FakeOmdbMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        title_cache.clear()
+        caches["default"].clear()
+        self.now = [1000.0]
+        logger = mock.patch("movie_api.breaker.logger")
+        self.logger = logger.start()
+        self.addCleanup(logger.stop)
+
+    def tearDown(self):
+        self.omdb.error_rate = 0
+        caches["default"].clear()
+
+    def breaker(self, **kwargs):
+        return CircuitBreaker(clock=lambda: self.now[0], min_calls=4, open_seconds=30, **kwargs)
+
+    def test_opens_on_failure_rate_and_probes(self):
+        breaker = self.breaker()
+        for outcome in (200, 500, 500):
+            breaker.before_call()
+            breaker.record(0.1, outcome)
+        self.assertFalse(breaker.is_open())  # fewer than min_calls
+        breaker.record(0.1, "error")
+        self.assertTrue(breaker.is_open())
+        with self.assertRaises(CircuitOpen) as raised:
+            breaker.before_call()
+        self.assertEqual(raised.exception.retry_after, 30)
+
+        # Half open: one probe at a time; a failed one opens the circuit again.
+        self.now[0] += 30
+        probe = breaker.before_call()
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+        breaker.record(0.1, 503, probe)
+        self.assertTrue(breaker.is_open())
+
+        self.now[0] += 30
+        probe = breaker.before_call()
+        breaker.record(0.1, 200, probe)
+        status = breaker.status()
+        self.assertEqual(status["state"], "closed")
+        self.assertEqual(status["window"], {"calls": 0, "failures": 0, "slow": 0})
+        self.assertEqual([(item["from"], item["to"]) for item in status["transitions"]],
+                         [("closed", "open"), ("open", "half_open"), ("half_open", "open"),
+                          ("open", "half_open"), ("half_open", "closed")])
+
+    def test_probe_is_given_back_when_no_call_is_made(self):
+        breaker = self.breaker()
+        for _ in range(4):
+            breaker.record(0.1, "error")
+        self.now[0] += 30
+        key_pool = mock.Mock()
+        key_pool.acquire.side_effect = KeysExhausted("No OMDb API key has calls left today", 60)
+        with self.assertRaises(KeysExhausted):
+            OmdbClient("key", key_pool=key_pool, breaker=breaker).get_movie("Batman")
+
+        async def acquire_async(run_in_thread):
+            raise KeysExhausted("No OMDb API key has calls left today", 60)
+        key_pool.acquire_async = acquire_async
+        in_thread = []
+
+        async def run_in_thread(fn, *args):
+            in_thread.append(fn.__name__)
+            return fn(*args)
+
+        async def lookup():
+            client = AsyncOmdbClient("key", key_pool=key_pool, run_in_thread=run_in_thread, breaker=breaker)
+            try:
+                await client.get_movie("Batman")
+            finally:
+                await client.close()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        with self.assertRaises(KeysExhausted):
+            loop.run_until_complete(lookup())
+        # Off the event loop, and the probe left for the next call.
+        self.assertEqual(in_thread, ["before_call", "cancel_probe"])
+        self.assertTrue(breaker.before_call())
+
+    def test_only_the_probe_decides_while_half_open(self):
+        breaker = self.breaker()
+        for _ in range(4):
+            breaker.record(0.1, "error")
+        self.now[0] += 30
+        self.assertTrue(breaker.before_call())
+        # Calls started before the circuit opened finish meanwhile.
+        breaker.record(0.1, 200)
+        breaker.record(0.1, "error")
+        self.assertEqual(breaker.current()["state"], "half_open")
+        breaker.record(0.1, 200, True)
+        self.assertEqual(breaker.current()["state"], "closed")
+
+    def test_unexpected_errors_are_reported_and_free_the_probe(self):
+        breaker = self.breaker()
+        for _ in range(4):
+            breaker.record(0.1, "error")
+        self.now[0] += 30
+        client = OmdbClient("key", breaker=breaker)
+        with mock.patch.object(client.session, "get", side_effect=UnicodeError("bad title")):
+            with self.assertRaises(UnicodeError):
+                client.get_movie("Batman")
+        # The probe failed: open again, and after a while another probe goes out.
+        self.assertTrue(breaker.is_open())
+        self.now[0] += 30
+        self.assertTrue(breaker.before_call())
+        client.close()
+
+    def test_transitions_of_concurrent_workers_are_all_kept(self):
+        first, second = self.breaker(), self.breaker()
+        for _ in range(4):
+            first.record(0.1, "error")
+        # second still saw the circuit closed and opens it too.
+        second._switch({"state": "closed"}, "open", self.now[0])
+        self.assertEqual([(item["from"], item["to"]) for item in first.status()["transitions"]],
+                         [("closed", "open"), ("closed", "open")])
+        for _ in range(25):
+            first._log_transition({"from": "open", "to": "half_open", "at": None})
+        self.assertEqual(len(first.transitions()), 20)
+
+    def test_opens_on_slow_calls_and_forgets_old_ones(self):
+        breaker = self.breaker(slow_call_seconds=2)
+        for _ in range(3):
+            breaker.record(3, 200)
+        self.now[0] += 61  # out of the window
+        breaker.record(3, 200)
+        self.assertFalse(breaker.is_open())
+        for _ in range(3):
+            breaker.record(2.5, 200)
+        self.assertTrue(breaker.is_open())
+
+    def test_workers_share_the_circuit(self):
+        first, second = self.breaker(), self.breaker()
+        for _ in range(4):
+            first.record(0.1, "error")
+        with self.assertRaises(CircuitOpen):
+            second.before_call()
+        self.logger.warning.assert_called_once_with("OMDb circuit breaker: %s -> %s", "closed", "open")
+
+    def test_lookups_fail_fast_while_open(self):
+        stored = Movie.objects.create(Title="Heat")
+        self.omdb.error_rate = 1
+        requests_before = self.omdb.requests
+        for title in ("Batman", "Django", "Memento"):
+            response = self.client.post('/api/movies', {"title": title}, format="json")
+            # Not the "no such movie" 204.
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(self.omdb.requests - requests_before, 3)
+
+        response = self.client.post('/api/movies', {"title": "Batman"}, format="json")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(int(response["Retry-After"]), settings.OMDB_BREAKER_OPEN_SECONDS)
+        self.assertIn("paused", response.data["Error"])
+        self.assertEqual(self.omdb.requests - requests_before, 3)
+        # Stored movies are still answered.
+        self.assertEqual(self.client.post('/api/movies', {"title": "heat"}, format="json").data["id"], stored.id)
+
+        status = self.client.get('/api/upstream').data
+        self.assertEqual(status["circuit"]["state"], "open")
+        self.assertEqual(status["circuit"]["transitions"][-1]["to"], "open")
+        self.assertIn('omdb_circuit_state{state="open"} 1', self.client.get('/metrics').content.decode("utf-8"))
@@ -0,0 +1,16 @@
+import re
+import unicodedata
+
+
+_APOSTROPHES = re.compile(r"['‘’`]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_title(title):
+    """Fold a movie title to the key used for local lookups:
+    "  Schindler's  List! " and "schindlers list" give the same key."""
+    title = unicodedata.normalize("NFKD", str(title))
+    title = "".join(char for char in title if not unicodedata.combining(char))
+    title = _APOSTROPHES.sub("", title.casefold())
+    title = "".join(" " if unicodedata.category(char)[0] in "PS" else char for char in title)
+    return _WHITESPACE.sub(" ", title).strip()
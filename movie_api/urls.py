@@ -1,8 +1,13 @@
 from django.conf.urls import url
-from .views import MoviesView, CommentsView, welcome
+from .views import MoviesView, MovieBatchView, MovieSearchView, CommentsView, CommentBatchView, ChangesView, UpstreamStatusView, welcome
 
 urlpatterns = [
+    url('movies/batch', MovieBatchView.as_view(), name="MovieBatchView"),
+    url('movies/search', MovieSearchView.as_view(), name="MovieSearchView"),
     url('movies', MoviesView.as_view(), name="MoviesView"),
+    url('comments/batch', CommentBatchView.as_view(), name="CommentBatchView"),
     url('comments', CommentsView.as_view(), name="CommentsView"),
+    url('changes', ChangesView.as_view(), name="ChangesView"),
+    url('upstream', UpstreamStatusView.as_view(), name="UpstreamStatusView"),
     url('', welcome, name="welcome")
 ]
@@ -0,0 +1,65 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import UpstreamUsage
+
+
+def today():
+    # OMDb quotas are per day; count them in UTC.
+    return timezone.now().date()
+
+
+def calls_today(name):
+    """Calls of name's daily quota reserved today (made or not)."""
+    return usage_today(name)[0]
+
+
+def usage_today(name):
+    """(calls reserved, calls made) of name today."""
+    return UpstreamUsage.objects.filter(day=today(), name=name).values_list("calls", "used").first() or (0, 0)
+
+
+def reserve_calls(name, wanted, daily_limit):
+    """Reserve up to wanted of name's daily_limit OMDb calls for today; return how many were granted.
+
+    Counters live in the database, so all workers and processes share them.
+    """
+    day = today()
+    _ensure_row(day, name)
+    with transaction.atomic():
+        usage = UpstreamUsage.objects.select_for_update().get(day=day, name=name)
+        granted = max(0, min(wanted, daily_limit - usage.calls))
+        if granted:
+            UpstreamUsage.objects.filter(pk=usage.pk).update(calls=F("calls") + granted)
+    return granted
+
+
+def release_calls(name, count):
+    """Give back count calls reserved today with reserve_calls that won't be made."""
+    UpstreamUsage.objects.filter(day=today(), name=name).update(calls=Greatest(F("calls") - count, 0))
+
+
+def record_calls(name, count=1):
+    """Count calls that were made (reserved before or not; see usage_today)."""
+    day = today()
+    _ensure_row(day, name)
+    UpstreamUsage.objects.filter(day=day, name=name).update(used=F("used") + count)
+
+
+def _ensure_row(day, name):
+    if UpstreamUsage.objects.filter(day=day, name=name).exists():
+        return
+    try:
+        with transaction.atomic():
+            UpstreamUsage.objects.create(day=day, name=name)
+    except IntegrityError:
+        pass
+
+
+def exhaust_calls(name, daily_limit):
+    """Record that OMDb refused name for the rest of today."""
+    day = today()
+    _ensure_row(day, name)
+    UpstreamUsage.objects.filter(day=day, name=name, calls__lt=daily_limit).update(calls=daily_limit)
@@ -1,9 +1,28 @@
-import requests
-from .serializers import MovieSerializer, CommentSerializer
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, DatabaseError, router, transaction
+from .bulk import bulk_create_comments, chunked
+from .changes import change_feed, wait_for_changes
+from .comment_buffer import get_comment_buffer, BufferFull
+from .filters import filter_movies, select_fields, InvalidFilter
+from .response_cache import cached_response, MOVIES, COMMENTS
+from .pagination import get_param, paginated_response, ranked_page_response, KeysetPagination
+from .payloads import StoredPayloads
+from .search import search_movie_ids
+from .breaker import get_breaker, CircuitOpen
+from .keys import KeysExhausted, get_key_pool
+from .omdb import OmdbError
+from .resolver import resolve_title, resolve_titles, UpstreamDataError, TITLE_LOOKUP, UPSTREAM_ERROR
+from .serializers import MovieSerializer, MovieReadSerializer, CommentSerializer
+from .streaming import NDJSONRenderer, PrerenderedJSONRenderer, stream_format, streaming_response
 from .models import Movie, Comment
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.settings import api_settings
 from django.http import HttpResponse
 
 
@@ -14,20 +33,38 @@ def welcomehome(request):
     return HttpResponse("More info on: github.com/lobsterick/OMDB_API_bridge/")
 
 
+def expanded_tables(request):
+    """Tables that ?fields= adds to a movie listing."""
+    return (COMMENTS,) if "Comments" in str(get_param(request, "fields") or "") else ()
+
+
+def movie_serializer(fields):
+    if fields is None:
+        return StoredPayloads if settings.MOVIE_PAYLOADS else MovieReadSerializer
+    return partial(MovieReadSerializer, fields=fields)
+
+
 class MoviesView(APIView):
+    renderer_classes = [PrerenderedJSONRenderer, BrowsableAPIRenderer, NDJSONRenderer]
 
+    @cached_response(MOVIES, extra_tables=expanded_tables)
     def get(self, request):
-        if request.data.get("order"):
-            if request.data["order"] == "dsc":
-                print("working dsc")
-                movies = Movie.objects.all().order_by("id").reverse()
-            else:
-                return Response(data={"Error": "You can only sort id with order equal to dsc (for descending)"}, status=status.HTTP_400_BAD_REQUEST)
+        order = get_param(request, "order")
+        if order and order != "dsc":
+            return Response(data={"Error": "You can only sort with order equal to dsc (for descending)"}, status=status.HTTP_400_BAD_REQUEST)
 
-        else:
-            movies = Movie.objects.all()
-        serializer = MovieSerializer(movies, many=True)
-        return Response(serializer.data)
+        try:
+            movies, sort_field = filter_movies(request, Movie.objects)
+            movies, fields = select_fields(request, movies, sort_field)
+        except InvalidFilter as error:
+            return Response(data={"Error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        descending = order == "dsc"
+        serializer_class = movie_serializer(fields)
+        stream = stream_format(request)
+        if stream:
+            return streaming_response(movies, serializer_class, stream, descending=descending, sort_field=sort_field)
+        return paginated_response(request, self, movies, serializer_class, descending=descending, sort_field=sort_field)
 
     def post(self, request):
 
@@ -36,40 +73,84 @@ class MoviesView(APIView):
         else:
             return Response(data={"Error": "You must provide title in POST request with key named title"}, status=status.HTTP_400_BAD_REQUEST)
 
-        my_api_key = '28cb1743'
-        url = f'http://www.omdbapi.com/?t={title}&type=movie&apikey={my_api_key}'
-        response = requests.get(url)
-        if response.status_code == requests.codes.ok and response.json()['Response'] == 'True':
-            if not Movie.objects.filter(Title=response.json()['Title']).exists():
-                serializer = MovieSerializer(data=response.json())
-                if serializer.is_valid():
-                    serializer.save()
-                    return Response(serializer.data)
-                else:
-                    return Response(data={"Error": "Problem with serializing data from external API"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            else:
-                movie_from_database = Movie.objects.get(Title=response.json()['Title'])
-                movie_from_database_serialized = MovieSerializer(movie_from_database)
-                return Response(movie_from_database_serialized.data)
-        else:
+        # In ASGI mode the OMDb lookup was done on the event loop already.
+        lookup = request.META.get(TITLE_LOOKUP)
+        try:
+            movie = lookup.result() if lookup is not None and lookup.title == title else resolve_title(title)
+        except UpstreamDataError:
+            return Response(data={"Error": "Problem with serializing data from external API"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except (KeysExhausted, CircuitOpen) as exc:
+            return Response(data={"Error": str(exc)}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={"Retry-After": str(exc.retry_after)})
+        except OmdbError:
+            return Response(data={"Error": UPSTREAM_ERROR}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={"Retry-After": "1"})
+        if movie is None:
             return Response(data={"Error": "No movie with that title"}, status=status.HTTP_204_NO_CONTENT)
+        return Response(MovieSerializer(movie).data)
+
+
+class MovieSearchView(APIView):
+    renderer_classes = [PrerenderedJSONRenderer, BrowsableAPIRenderer]
+
+    @cached_response(MOVIES, extra_tables=expanded_tables)
+    def get(self, request):
+        query = get_param(request, "q")
+        if not query or not str(query).strip():
+            return Response(data={"Error": "You must provide search text in parameter named q"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            movies, fields = select_fields(request, Movie.objects)
+        except InvalidFilter as error:
+            return Response(data={"Error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Ids and rows from the same database, so a lagging replica can't drop hits.
+        alias = router.db_for_read(Movie)
+        return ranked_page_response(
+            request,
+            lambda limit, offset: search_movie_ids(str(query), limit, offset, using=connections[alias]),
+            movies.using(alias).in_bulk,
+            movie_serializer(fields),
+        )
+
+
+class MovieBatchView(APIView):
+
+    def post(self, request):
+        titles = request.data.get("titles")
+        if not isinstance(titles, list) or not titles:
+            return Response(data={"Error": "You must provide list of titles in POST request with key named titles"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(titles) > settings.MOVIE_BATCH_MAX_TITLES:
+            return Response(data={"Error": f"You can send at most {settings.MOVIE_BATCH_MAX_TITLES} titles at once"}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(title, str) and title.strip() for title in titles):
+            return Response(data={"Error": "Every title must be a non-empty string"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(data={"results": resolve_titles(titles)})
 
 
 class CommentsView(APIView):
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+
+    @cached_response(COMMENTS)
     def get(self, request):
-        if request.data.get("movie_id"):
-            comments = Comment.objects.filter(movie_id=request.data["movie_id"])
-            if comments.count() == 0:
+        movie_id = get_param(request, "movie_id")
+        if movie_id:
+            comments = Comment.objects.filter(movie_id=movie_id)
+            if not comments.exists():
                 return Response(data={"Error": "We don't have movie of this ID in database."}, status=status.HTTP_400_BAD_REQUEST)
         else:
             comments = Comment.objects.all()
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        descending = get_param(request, "order") == "dsc"
+        stream = stream_format(request)
+        if stream:
+            return streaming_response(comments, CommentSerializer, stream, descending=descending)
+        return paginated_response(request, self, comments, CommentSerializer, descending=descending)
 
     def post(self, request):
         if not (request.data.get("comment_body") and request.data.get("movie_id")):
             return Response(data={"Error": "You must provide comment and movie_id in POST request"}, status=status.HTTP_400_BAD_REQUEST)
 
+        if settings.COMMENT_WRITE_BEHIND:
+            return self.post_buffered(request)
         if Movie.objects.filter(id=request.data["movie_id"]).exists():
             serializer = CommentSerializer(data=request.data)
             if serializer.is_valid():
@@ -78,3 +159,93 @@ class CommentsView(APIView):
             else:
                 return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         return Response(data={"Error": "No movie with that id"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+    def post_buffered(self, request):
+        """post() through the write-behind buffer: the comment is written with others in one batch."""
+        comment = comment_fields(request.data)
+        if comment is None:
+            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        try:
+            created = get_comment_buffer().submit(*comment).result(timeout=settings.COMMENT_WRITE_TIMEOUT)
+        except BufferFull as error:
+            return Response(data={"Error": str(error)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+        except FutureTimeout:
+            # Still queued or being written: it may be saved yet.
+            return Response(data={"Error": "Comment was not written in time, it may still be saved"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+        except DatabaseError:
+            return Response(data={"Error": "Comment could not be written"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+        if created is None:
+            return Response(data={"Error": "No movie with that id"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(CommentSerializer(created).data)
+
+
+def comment_fields(data):
+    """(movie_id, comment_body) of a comment in request data, or None when they aren't valid."""
+    body = data.get("comment_body")
+    max_length = Comment._meta.get_field("comment_body").max_length
+    if not (isinstance(body, str) and body and len(body) <= max_length):
+        return None
+    try:
+        return int(data.get("movie_id")), body
+    except (TypeError, ValueError):
+        return None
+
+
+class CommentBatchView(APIView):
+
+    def post(self, request):
+        comments = request.data.get("comments")
+        if not isinstance(comments, list) or not comments:
+            return Response(data={"Error": "You must provide list of comments in POST request with key named comments"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(comments) > settings.COMMENT_BATCH_MAX:
+            return Response(data={"Error": f"You can send at most {settings.COMMENT_BATCH_MAX} comments at once"}, status=status.HTTP_400_BAD_REQUEST)
+
+        parsed = [comment_fields(comment) if isinstance(comment, dict) else None for comment in comments]
+        valid = [comment for comment in parsed if comment is not None]
+        try:
+            # All chunks or none: a retry after an error mustn't save comments twice.
+            with transaction.atomic():
+                created = iter([comment for chunk in chunked(valid, settings.COMMENT_FLUSH_SIZE)
+                                for comment in bulk_create_comments(chunk)])
+        except DatabaseError:
+            return Response(data={"Error": "Comments could not be written, none was saved"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+        results = []
+        for comment in parsed:
+            if comment is None:
+                results.append({"status": "error", "Error": "Comment needs comment_body (at most 100 characters) and movie_id"})
+                continue
+            created_comment = next(created)
+            if created_comment is None:
+                results.append({"status": "error", "Error": "No movie with that id"})
+            else:
+                results.append(dict(CommentSerializer(created_comment).data, status="created"))
+        return Response(data={"results": results})
+
+
+class UpstreamStatusView(APIView):
+
+    def get(self, request):
+        """State of the OMDb circuit breaker and usage of the API keys, for monitoring."""
+        breaker = get_breaker()
+        return Response(data={"circuit": breaker.status() if breaker is not None else None,
+                              "keys": get_key_pool().status()})
+
+
+class ChangesView(APIView):
+
+    def get(self, request):
+        try:
+            since = int(request.query_params.get("since", 0))
+            wait = float(request.query_params.get("wait", 0))
+            if since < 0 or not wait >= 0:
+                raise ValueError
+        except ValueError:
+            return Response(data={"Error": "since must be a sequence number and wait a number of seconds"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if wait:
+            wait_for_changes(since, min(wait, settings.CHANGE_FEED_MAX_WAIT))
+        return Response(change_feed(since, KeysetPagination().get_page_size(request)))